@@ -0,0 +1,54 @@
+import os
+import sys
+import json
+import argparse
+import subprocess
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+SCRIPTS = os.path.join(HERE, "..", "scripts")
+
+# Modules the CLI entry point must not import before a subcommand needs them
+HEAVY_MODULES = ["numpy", "pandas", "matplotlib", "pdf2docx", "fitz", "docx", "pyproj", "lxml"]
+
+PROBE = """
+import sys, time, json
+t0 = time.perf_counter()
+import cli
+parser = cli.build_parser()
+elapsed = time.perf_counter() - t0
+print(json.dumps({"seconds": elapsed, "loaded": [m for m in %r if m in sys.modules]}))
+""" % (HEAVY_MODULES,)
+
+def measure(repeat):
+    """Imports cli in fresh interpreters and returns (best seconds, heavy modules loaded)."""
+    env = dict(os.environ, PYTHONPATH=os.pathsep.join([SCRIPTS, os.environ.get("PYTHONPATH", "")]))
+    best = None
+    loaded = []
+    for _ in range(repeat):
+        out = subprocess.run([sys.executable, "-c", PROBE], env=env, capture_output=True, text=True, check=True)
+        result = json.loads(out.stdout.strip().splitlines()[-1])
+        best = result["seconds"] if best is None else min(best, result["seconds"])
+        loaded = result["loaded"]
+    return best, loaded
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Fail if importing the CLI is slow or pulls in heavy dependencies.")
+    parser.add_argument("--budget-ms", type=float, default=100.0, help="Allowed import time in milliseconds")
+    parser.add_argument("--repeat", type=int, default=5, help="Fresh interpreters to try (the best is kept)")
+    args = parser.parse_args(argv)
+
+    seconds, loaded = measure(args.repeat)
+    print(f"import cli + build_parser: {seconds * 1000:.1f} ms (budget {args.budget_ms:.0f} ms)")
+    status = 0
+    if loaded:
+        print(f"FAIL: heavy modules imported at startup: {', '.join(loaded)}")
+        status = 1
+    if seconds * 1000 > args.budget_ms:
+        print("FAIL: import time budget exceeded")
+        status = 1
+    if status == 0:
+        print("OK")
+    return status
+
+if __name__ == "__main__":
+    sys.exit(main())
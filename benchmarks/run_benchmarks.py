@@ -0,0 +1,162 @@
+import os
+import sys
+import json
+import time
+import logging
+import argparse
+import platform
+import tempfile
+import contextlib
+
+import numpy as np
+import pandas as pd
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, os.path.join(HERE, "..", "scripts"))
+
+from synthetic import make_fixtures, parcel_rings
+
+from pdf_2_doc import convert_pdf_to_docx
+from pdf_2_coords import read_pdf_with_tables
+from doc_2_coords import read_docx_with_tables
+from coords_2_kml import generate_kml
+from vis import detect_polygons
+
+DEFAULT_BASELINE = os.path.join(HERE, "baseline.json")
+
+def _package_version(name):
+    try:
+        from importlib.metadata import version
+        return version(name)
+    except Exception:
+        return "unknown"
+
+def time_stage(func, repeat):
+    """
+    Runs `func` `repeat` times with its console output silenced.
+
+    Returns:
+        dict: 'median', 'min' and 'runs' wall times in seconds.
+    """
+    runs = []
+    with open(os.devnull, "w") as devnull:
+        for _ in range(repeat):
+            with contextlib.redirect_stdout(devnull):
+                t0 = time.perf_counter()
+                func()
+                runs.append(time.perf_counter() - t0)
+    return {"median": float(np.median(runs)), "min": float(min(runs)), "runs": runs}
+
+def run(args, work_dir):
+    """Generates the fixtures and times every pipeline stage."""
+    fixtures = make_fixtures(work_dir, args.tables, args.rows, args.pages)
+
+    # Many small parcels for the KML and segmentation stages
+    rings = parcel_rings(args.polygons, args.rows, seed=1)
+    polygons = [pd.DataFrame(ring.astype(np.float64), columns=["x", "y"]) for ring in rings]
+    vertices = pd.concat(polygons, ignore_index=True)
+    docx_out = os.path.join(work_dir, "converted.docx")
+    kml_out = os.path.join(work_dir, "bench.docx")
+
+    stages = {
+        "convert_pdf_to_docx": lambda: convert_pdf_to_docx(fixtures["pdf"], docx_out),
+        "read_pdf_with_tables": lambda: read_pdf_with_tables(fixtures["pdf"]),
+        "read_docx_with_tables": lambda: read_docx_with_tables(fixtures["docx"]),
+        "generate_kml": lambda: generate_kml(polygons, kml_out),
+        "polygon_segmentation": lambda: detect_polygons(vertices),
+    }
+
+    results = {}
+    for name, func in stages.items():
+        if args.stages and name not in args.stages:
+            continue
+        print(f"Timing {name}...")
+        results[name] = time_stage(func, args.repeat)
+        print(f"  median {results[name]['median'] * 1000:.1f} ms")
+    return results
+
+def compare(results, baseline, tolerance):
+    """
+    Compares median times against a baseline.
+
+    Returns:
+        list: (stage, baseline_s, current_s, ratio) for every stage slower
+              than baseline * (1 + tolerance).
+    """
+    regressions = []
+    for name, current in results.items():
+        previous = baseline.get("results", {}).get(name)
+        if not previous:
+            continue
+        ratio = current["median"] / previous["median"] if previous["median"] else float("inf")
+        if ratio > 1.0 + tolerance:
+            regressions.append((name, previous["median"], current["median"], ratio))
+    return regressions
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Benchmark every pipeline stage on synthetic survey documents.")
+    parser.add_argument("--tables", type=int, default=3, help="Coordinate tables per document")
+    parser.add_argument("--rows", type=int, default=40, help="Rows per coordinate table")
+    parser.add_argument("--pages", type=int, default=10, help="Minimum pages per PDF")
+    parser.add_argument("--polygons", type=int, default=2000, help="Polygons for the KML/segmentation stages")
+    parser.add_argument("--repeat", type=int, default=5, help="Runs per stage (the median is reported)")
+    parser.add_argument("--stages", nargs="*", default=None, help="Only run these stages")
+    parser.add_argument("-o", "--output", default="bench_results.json", help="Where to write the JSON results")
+    parser.add_argument("--baseline", default=DEFAULT_BASELINE, help="Baseline JSON to compare against")
+    parser.add_argument("--save-baseline", action="store_true", help="Store these results as the new baseline")
+    parser.add_argument("--allow-missing-baseline", action="store_true",
+                        help="Succeed when there is no baseline to compare against")
+    parser.add_argument("--tolerance", type=float, default=0.25,
+                        help="Allowed slowdown over the baseline before failing (0.25 = 25%%)")
+    args = parser.parse_args(argv)
+
+    logging.disable(logging.INFO) # pdf2docx logs every page
+    with tempfile.TemporaryDirectory() as work_dir:
+        results = run(args, work_dir)
+
+    report = {
+        "environment": {
+            "python": platform.python_version(),
+            "platform": platform.platform(),
+            "numpy": _package_version("numpy"),
+            "pandas": _package_version("pandas"),
+            "pyproj": _package_version("pyproj"),
+            "pdf2docx": _package_version("pdf2docx"),
+            "PyMuPDF": _package_version("PyMuPDF"),
+            "python-docx": _package_version("python-docx"),
+        },
+        "config": {k: getattr(args, k) for k in ("tables", "rows", "pages", "polygons", "repeat")},
+        "results": results,
+    }
+    with open(args.output, "w", encoding="utf-8") as f:
+        json.dump(report, f, indent=2)
+    print(f"Results written to '{args.output}'")
+
+    if args.save_baseline:
+        with open(args.baseline, "w", encoding="utf-8") as f:
+            json.dump(report, f, indent=2)
+        print(f"Baseline saved to '{args.baseline}'")
+        return 0
+
+    # Timings are machine-specific, so no baseline is shipped; without one
+    # the check cannot pass unless explicitly allowed
+    if not os.path.exists(args.baseline):
+        print(f"No baseline at '{args.baseline}'. Run with --save-baseline on this machine to create one.")
+        return 0 if args.allow_missing_baseline else 2
+
+    with open(args.baseline, "r", encoding="utf-8") as f:
+        baseline = json.load(f)
+    if baseline.get("config") != report["config"]:
+        print("Warning: baseline was recorded with a different configuration; ratios may be meaningless.")
+
+    regressions = compare(results, baseline, args.tolerance)
+    if regressions:
+        print("PERFORMANCE REGRESSION:")
+        for name, before, after, ratio in regressions:
+            print(f"  {name}: {before * 1000:.1f} ms -> {after * 1000:.1f} ms ({ratio:.2f}x)")
+        return 1
+    print(f"No regressions beyond {args.tolerance:.0%} of the baseline.")
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main())
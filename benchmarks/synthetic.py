@@ -0,0 +1,102 @@
+import os
+import math
+
+import numpy as np
+
+# Centre of the synthetic parcels: WGS 84 / UTM zone 17S, coastal Ecuador
+CENTER_X = 532000.0
+CENTER_Y = 9892000.0
+
+def parcel_rings(n_tables, rows_per_table, seed=0):
+    """
+    Builds closed survey rings, one per table.
+
+    Each ring has `rows_per_table` vertices on a jittered circle of integer
+    coordinates plus the repeated first vertex, like the tables in our PDFs.
+
+    Returns:
+        list: One (rows_per_table + 1, 2) int64 array per table.
+    """
+    rng = np.random.default_rng(seed)
+    rings = []
+    for t in range(n_tables):
+        cx = CENTER_X + 2000.0 * (t % 20)
+        cy = CENTER_Y + 2000.0 * (t // 20)
+        angles = np.linspace(0.0, 2.0 * math.pi, rows_per_table, endpoint=False)
+        radius = 400.0 + rng.uniform(-50.0, 50.0, rows_per_table)
+        xs = np.round(cx + radius * np.cos(angles)).astype(np.int64)
+        ys = np.round(cy + radius * np.sin(angles)).astype(np.int64)
+        ring = np.column_stack([xs, ys])
+        rings.append(np.vstack([ring, ring[:1]]))
+    return rings
+
+def write_docx(path, rings):
+    """Writes one 'PUNTO | X | Y' table per ring to a .docx file."""
+    import docx
+
+    doc = docx.Document()
+    doc.add_paragraph("Coordenadas UTM WGS84 Zona 17 Sur")
+    for ring in rings:
+        table = doc.add_table(rows=len(ring) + 1, cols=3)
+        for c, title in enumerate(("PUNTO", "X", "Y")):
+            table.cell(0, c).text = title
+        for r, (x, y) in enumerate(ring.tolist(), start=1):
+            table.cell(r, 0).text = str(r)
+            table.cell(r, 1).text = str(x)
+            table.cell(r, 2).text = str(y)
+        doc.add_paragraph("")
+    doc.save(path)
+    return path
+
+def write_pdf(path, rings, n_pages=1):
+    """
+    Writes a PDF whose first pages hold the coordinate tables (ruled cells,
+    so pdf2docx and PyMuPDF detect them as tables) and whose remaining pages,
+    up to `n_pages`, are filler text like the rest of a permit.
+    """
+    import fitz  # PyMuPDF, installed with pdf2docx
+
+    x0, y0, col_w, row_h = 72, 90, 120, 16
+    page_bottom = 780
+    doc = fitz.open()
+    page = None
+    y = page_bottom
+
+    for t, ring in enumerate(rings):
+        rows = [("PUNTO", "X", "Y")] + [(str(r), str(x), str(yy)) for r, (x, yy) in enumerate(ring.tolist(), start=1)]
+        for row in rows:
+            if y + row_h > page_bottom:
+                page = doc.new_page()
+                page.insert_text((x0, 60), f"Cuadro de coordenadas UTM, tabla {t + 1}", fontsize=11)
+                y = y0
+            for c, value in enumerate(row):
+                rect = fitz.Rect(x0 + c * col_w, y, x0 + (c + 1) * col_w, y + row_h)
+                page.draw_rect(rect, color=(0, 0, 0), width=0.5)
+                page.insert_text((rect.x0 + 4, rect.y1 - 4), value, fontsize=9)
+            y += row_h
+        y += 2 * row_h # Gap between tables
+
+    while doc.page_count < n_pages:
+        filler = doc.new_page()
+        filler.insert_text((72, 60), f"Anexo {doc.page_count}", fontsize=11)
+        filler.insert_textbox(fitz.Rect(72, 80, 540, 780), "Texto del permiso ambiental. " * 60, fontsize=10)
+
+    doc.save(path)
+    doc.close()
+    return path
+
+def make_fixtures(out_dir, n_tables=2, rows_per_table=20, n_pages=5, seed=0):
+    """
+    Generates a matching synthetic PDF and DOCX in `out_dir`.
+
+    Returns:
+        dict: 'pdf', 'docx' and 'rings' (the coordinates written).
+    """
+    os.makedirs(out_dir, exist_ok=True)
+    rings = parcel_rings(n_tables, rows_per_table, seed)
+    stem = f"survey_t{n_tables}_r{rows_per_table}_p{n_pages}"
+    return {
+        "pdf": write_pdf(os.path.join(out_dir, stem + ".pdf"), rings, n_pages),
+        "docx": write_docx(os.path.join(out_dir, stem + ".docx"), rings),
+        "rings": rings,
+    }
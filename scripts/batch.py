@@ -0,0 +1,571 @@
+import os
+import sys
+import json
+import time
+import signal
+import argparse
+
+from glob import glob, has_magic
+from contextlib import contextmanager
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from concurrent.futures.process import BrokenProcessPool
+
+import metrics
+
+from cache import PipelineCache
+from incremental import SourceManifest, options_key
+from pdf_2_coords import extract_coords
+from coordset import CoordinateSet
+from coords_2_kml import generate_kml
+from geometry import clean_polygons, precision_for_tolerance
+
+# --- Helpers ---
+class StageTimeout(Exception):
+    """Raised inside a worker when a file exceeds its time budget."""
+
+
+class OutputCollision(ValueError):
+    """Raised when two input PDFs would write the same output files."""
+
+
+@contextmanager
+def time_limit(seconds):
+    """
+    Aborts the enclosed block with StageTimeout after `seconds`.
+
+    Uses SIGALRM, so the limit is only enforced on Unix and only in the
+    main thread of the (worker) process. Elsewhere, or when `seconds` is
+    None/0, the block runs without a limit.
+    """
+    if not seconds or not hasattr(signal, "SIGALRM"):
+        yield
+        return
+
+    def _handler(signum, frame):
+        raise StageTimeout(f"Timed out after {seconds}s")
+
+    previous = signal.signal(signal.SIGALRM, _handler)
+    signal.setitimer(signal.ITIMER_REAL, seconds)
+    try:
+        yield
+    finally:
+        signal.setitimer(signal.ITIMER_REAL, 0)
+        signal.signal(signal.SIGALRM, previous)
+
+
+def collect_pdfs(inputs):
+    """
+    Expands directories and glob patterns into a sorted list of PDF paths.
+
+    Args:
+        inputs (list): Directories, glob patterns or individual file paths.
+
+    Returns:
+        list: Unique PDF paths, sorted.
+    """
+    found = set()
+    for item in inputs:
+        if os.path.isdir(item):
+            found.update(glob(os.path.join(item, "**", "*.pdf"), recursive=True))
+            found.update(glob(os.path.join(item, "**", "*.PDF"), recursive=True))
+        else:
+            found.update(p for p in glob(item, recursive=True) if p.lower().endswith(".pdf"))
+    return sorted(found)
+
+
+def _glob_base(pattern):
+    # Leading directories of a glob pattern, up to the first wildcard
+    parts = []
+    for part in os.path.normpath(pattern).split(os.sep)[:-1]:
+        if has_magic(part):
+            break
+        parts.append(part)
+    return os.sep.join(parts)
+
+def output_stems(inputs):
+    """
+    Maps every PDF found in `inputs` to the path of its outputs, relative to
+    the output directory and without extension.
+
+    PDFs found under a directory (or the fixed prefix of a glob pattern)
+    keep their path below it, so 'in/a/permit.pdf' and 'in/b/permit.pdf'
+    give 'a/permit' and 'b/permit'; files named directly keep their base
+    name.
+
+    Returns:
+        dict: {pdf path: relative output stem}, in sorted path order.
+
+    Raises:
+        OutputCollision: If two PDFs would still share their outputs (e.g.
+                         two files with the same name given directly).
+    """
+    stems = {}
+    for item in inputs:
+        if os.path.isdir(item):
+            base = item
+        elif has_magic(item):
+            base = _glob_base(item)
+        else:
+            base = os.path.dirname(item)
+        for pdf in collect_pdfs([item]):
+            if pdf not in stems:
+                stems[pdf] = os.path.splitext(os.path.relpath(pdf, base or os.curdir))[0]
+
+    owners = {}
+    collisions = []
+    for pdf in sorted(stems):
+        # Case-insensitive file systems would merge names differing by case only
+        key = os.path.normcase(stems[pdf]).lower()
+        if key in owners:
+            collisions.append(f"'{owners[key]}' and '{pdf}' -> '{stems[pdf]}'")
+        else:
+            owners[key] = pdf
+    if collisions:
+        raise OutputCollision("Input PDFs would overwrite each other's outputs: " + "; ".join(collisions))
+    return {pdf: stems[pdf] for pdf in sorted(stems)}
+
+
+def _init_worker(metrics_path, quiet):
+    # Runs once in every pool process
+    if metrics_path:
+        metrics.enable(metrics_path)
+    metrics.set_quiet(quiet)
+
+# --- Pipeline for a single PDF ---
+def process_pdf(pdf_path, output_dir, timeout=None, engine="auto", cache_dir=None,
+                cache_max_bytes=None, refresh=False, zone=17, south=None, keep_coords=False,
+                page_window=None, clean=None, precision=None, stem=None):
+    """
+    Runs PDF -> coords -> KML for one file, going through DOCX only when
+    the direct PDF engine cannot find a coordinate table.
+
+    Never raises: any failure is recorded in the returned dict so that one
+    bad PDF cannot take down the batch.
+
+    Args:
+        pdf_path (str): Path to the input PDF.
+        output_dir (str): Directory for the .docx and .kml outputs.
+        timeout (float, optional): Time budget in seconds for the whole file.
+        engine (str, optional): Extraction engine passed to extract_coords.
+        cache_dir (str, optional): PipelineCache directory. No cache if None.
+        cache_max_bytes (int, optional): Size limit of the cache.
+        refresh (bool, optional): Recompute even if the PDF is cached.
+        zone (int, optional): UTM zone of the coordinates. Defaults to 17.
+        south (bool, optional): Hemisphere; None detects it from the northings.
+        keep_coords (bool, optional): Return the parsed CoordinateSet under
+                                      'coordset' (used to update a spatial index
+                                      or a GeoParquet dataset).
+        page_window (int, optional): Convert this many pages at a time on the
+                                     DOCX route to bound memory on very long
+                                     PDFs (see pdf_2_coords.read_pdf_in_windows).
+        clean (dict, optional): Run geometry.clean_polygons with these
+                                keyword arguments before export, and return
+                                its per-polygon report under
+                                'geometry_report'. Defaults to None (off).
+        precision (int, optional): Decimal places of the KML coordinates.
+        stem (str, optional): Output path relative to `output_dir`, without
+                              extension (see output_stems). Defaults to the
+                              PDF's base name.
+
+    Returns:
+        dict: Keys 'pdf', 'status' ('ok', 'no_coords', 'failed', 'timeout'),
+              'error', 'engine', 'cache', 'docx', 'pages' (converted page indices,
+              None for all pages or the direct engine), 'kml', 'points',
+              'polygons', 'invalid' (polygons flagged by the cleaning stage)
+              and 'timings' (seconds per stage).
+    """
+    if stem is None:
+        stem = os.path.splitext(os.path.basename(pdf_path))[0]
+    docx_path = os.path.join(output_dir, stem + ".docx")
+    kml_path = os.path.join(output_dir, stem + ".kml")
+    os.makedirs(os.path.dirname(docx_path), exist_ok=True)
+    result = {
+        "pdf": pdf_path,
+        "status": "failed",
+        "error": None,
+        "engine": None,
+        "cache": None,
+        "docx": None,
+        "pages": None,
+        "kml": None,
+        "points": 0,
+        "polygons": 0,
+        "invalid": None,
+        "timings": {},
+    }
+    timings = result["timings"]
+    stage = None
+    started = time.perf_counter()
+
+    try:
+        with time_limit(timeout):
+            stage = "extract"
+            t0 = time.perf_counter()
+            cache = PipelineCache(cache_dir, cache_max_bytes) if cache_dir else None
+            text, coords, info = extract_coords(pdf_path, docx_path, engine=engine,
+                                                cache=cache, refresh=refresh,
+                                                page_window=page_window)
+            timings["extract"] = time.perf_counter() - t0
+            result["engine"] = info["engine"]
+            result["cache"] = info.get("cache")
+            result["pages"] = info.get("pages")
+            if info["engine"] == "docx" and os.path.exists(docx_path):
+                result["docx"] = docx_path
+            if coords is None:
+                result["error"] = "could not read coordinates"
+                return result
+            coordset = CoordinateSet.from_rows(coords)
+            result["points"] = len(coordset)
+            if not len(coordset):
+                result["status"] = "no_coords"
+                return result
+
+            if clean is not None:
+                stage = "geometry"
+                t0 = time.perf_counter()
+                coordset, report = clean_polygons(coordset, **clean)
+                timings["geometry"] = time.perf_counter() - t0
+                result["invalid"] = int((~report["valid"]).sum())
+                result["geometry_report"] = report
+
+            stage = "kml"
+            t0 = time.perf_counter()
+            # One placemark per closed ring, split on repeated closing vertices
+            result["polygons"] = coordset.n_polygons
+            generate_kml(coordset, docx_path, zone=zone, south=south, precision=precision)
+            timings["kml"] = time.perf_counter() - t0
+            if os.path.exists(kml_path):
+                result["kml"] = kml_path
+                result["status"] = "ok"
+                if keep_coords:
+                    result["coordset"] = coordset
+            else:
+                result["error"] = "KML file was not written"
+
+    except StageTimeout as e:
+        result["status"] = "timeout"
+        result["error"] = f"{stage}: {e}"
+    except Exception as e:
+        result["error"] = f"{stage}: {type(e).__name__}: {e}"
+    finally:
+        timings["total"] = time.perf_counter() - started
+        metrics.emit("pipeline", file=pdf_path, status=result["status"], failure=result["error"],
+                     engine=result["engine"], cache=result["cache"], points=result["points"],
+                     polygons=result["polygons"], **{f"{k}_s": v for k, v in timings.items()})
+
+    return result
+
+
+def update_index(index_path, results, coordsets, removed=()):
+    """
+    Adds the polygons of the processed PDFs (`coordsets`, a list of
+    (pdf, CoordinateSet)) to the spatial index at `index_path`, replacing
+    earlier versions, and drops the PDFs that were removed or no longer
+    yield coordinates.
+    """
+    from spatial_index import SpatialIndex
+
+    index = SpatialIndex.open(index_path)
+    index.remove_many(list(removed) + [pdf for pdf, record in results.items()
+                                       if record["status"] != "ok"])
+    index.add_many(coordsets)
+    index.save(index_path)
+    print(f"Spatial index '{index_path}': {index}")
+
+
+def write_geometry_report(path, reports):
+    """
+    Writes the per-polygon cleaning reports of the processed PDFs
+    (a list of (pdf, DataFrame)) as one CSV with a 'source' column.
+
+    Returns:
+        str: `path`, or None if there was nothing to report.
+    """
+    if not reports:
+        return None
+    import pandas as pd
+
+    frames = [report.assign(source=pdf) for pdf, report in reports]
+    combined = pd.concat(frames, ignore_index=True)
+    combined = combined[["source"] + [c for c in combined.columns if c != "source"]]
+    combined.to_csv(path, index=False)
+    invalid = int((~combined["valid"]).sum())
+    print(f"Geometry report '{path}': {len(combined)} polygon(s), {invalid} invalid")
+    return path
+
+
+# --- Batch runner ---
+def run_batch(inputs, output_dir, workers=None, timeout=None, manifest_path=None, retries=1,
+              engine="auto", cache_dir=None, cache_max_bytes=None, refresh=False,
+              zone=17, south=None, metrics_path=None, prometheus_path=None, quiet=True,
+              state_db=None, retry_failed=False, index_path=None, page_window=None,
+              geoparquet_dir=None, clean=None, precision=None, dedup_db=None, dedup_tolerance=None):
+    """
+    Runs the full pipeline over many PDFs using a process pool.
+
+    Args:
+        inputs (list): Directories, glob patterns or PDF paths.
+        output_dir (str): Directory for all outputs.
+        workers (int, optional): Pool size. Defaults to os.cpu_count().
+        timeout (float, optional): Per-file time budget in seconds.
+        manifest_path (str, optional): Where to write the JSON summary.
+                                       Defaults to <output_dir>/manifest.json.
+        retries (int, optional): How many times to resubmit files whose
+                                 worker process died (e.g. a crash inside
+                                 MuPDF). Defaults to 1.
+        engine (str, optional): "auto", "direct" or "docx". See extract_coords.
+        cache_dir (str, optional): Directory of a PipelineCache shared by all
+                                   workers. Defaults to None (no cache).
+        cache_max_bytes (int, optional): Size limit of the cache in bytes.
+        refresh (bool, optional): Force recomputation of cached PDFs.
+        zone (int, optional): UTM zone of the coordinates. Defaults to 17.
+        south (bool, optional): Hemisphere; None detects it per document.
+        metrics_path (str, optional): JSON-lines file for structured stage
+                                      events from every worker. Defaults to
+                                      None (instrumentation off).
+        prometheus_path (str, optional): Also write the aggregated metrics
+                                         in Prometheus text format here.
+        quiet (bool, optional): Silence the per-stage status lines printed
+                                by the workers. Defaults to True.
+        state_db (str, optional): SQLite manifest (see incremental.SourceManifest)
+                                  enabling incremental runs: only new or
+                                  modified PDFs are processed and the outputs
+                                  of deleted PDFs are removed. Defaults to
+                                  None (process everything).
+        retry_failed (bool, optional): In incremental runs, also redo files
+                                       that failed or timed out last time.
+        page_window (int, optional): Pages converted at a time on the DOCX
+                                     route. Defaults to None (whole document).
+        index_path (str, optional): spatial_index.SpatialIndex file updated
+                                    with the polygons of every processed PDF
+                                    (and cleared of deleted ones).
+        geoparquet_dir (str, optional): GeoParquet dataset holding one part
+                                        file per PDF with its polygons and
+                                        points; reprocessed PDFs replace
+                                        their part, deleted or failed ones
+                                        drop it (see geoparquet.py).
+        clean (dict, optional): Options of geometry.clean_polygons; when set,
+                                polygons are cleaned before export and the
+                                per-polygon report of the files processed in
+                                this run is written to
+                                <output_dir>/geometry_report.csv.
+        precision (int, optional): Decimal places of the KML coordinates.
+        dedup_db (str, optional): dedup.ParcelStore recording every parcel
+                                  once with the documents it appears in; the
+                                  unique parcels are written to
+                                  <output_dir>/parcels.kml.
+        dedup_tolerance (float, optional): Fingerprint grid in meters for a
+                                           new store. Defaults to 0.01.
+
+    Returns:
+        dict: The manifest written to disk.
+
+    Raises:
+        OutputCollision: See output_stems; raised before any file is processed.
+    """
+    stems = output_stems(inputs)
+    pdfs = list(stems)
+    os.makedirs(output_dir, exist_ok=True)
+    if manifest_path is None:
+        manifest_path = os.path.join(output_dir, "manifest.json")
+
+    started = time.perf_counter()
+    keep_coords = bool(index_path or geoparquet_dir or dedup_db)
+    state = None
+    removed = []
+    unchanged = 0
+    if state_db:
+        state = SourceManifest(state_db)
+        # Keys must not depend on the working directory the batch is started from
+        stems = {os.path.abspath(p): stem for p, stem in stems.items()}
+        pdfs = list(stems)
+        run_options = options_key(engine=engine, zone=zone, south=south, output_dir=os.path.abspath(output_dir),
+                                  clean=clean, precision=precision,
+                                  dedup_db=os.path.abspath(dedup_db) if dedup_db else None,
+                                  dedup_tolerance=dedup_tolerance)
+        removed = state.prune_deleted()
+        todo, unchanged = state.plan(pdfs, run_options, retry_failed)
+        pdfs = [p for p in pdfs if p in todo]
+        print(f"Incremental run: {len(todo)} new or modified, {unchanged} unchanged, "
+              f"{len(removed)} deleted source(s) cleaned up.")
+
+    print(f"Found {len(pdfs)} PDF(s). Processing with {workers or os.cpu_count()} worker(s)...")
+    results = {}
+    pending = list(pdfs)
+    attempt = 0
+
+    while pending:
+        crashed = []
+        with ProcessPoolExecutor(max_workers=workers, initializer=_init_worker,
+                                 initargs=(metrics_path, quiet)) as pool:
+            futures = {pool.submit(process_pdf, p, output_dir, timeout, engine, cache_dir,
+                                   cache_max_bytes, refresh, zone, south, keep_coords,
+                                   page_window, clean, precision, stems[p]): p
+                       for p in pending}
+            for future in as_completed(futures):
+                pdf_path = futures[future]
+                try:
+                    record = future.result()
+                except BrokenProcessPool:
+                    crashed.append(pdf_path)
+                    continue
+                except Exception as e:
+                    record = {"pdf": pdf_path, "status": "failed",
+                              "error": f"{type(e).__name__}: {e}", "timings": {}}
+                results[pdf_path] = record
+                if state is not None:
+                    state.record(record, *todo[pdf_path], run_options)
+                print(f"[{len(results)}/{len(pdfs)}] {record['status']}: {pdf_path}")
+
+        attempt += 1
+        if crashed and attempt > retries:
+            for pdf_path in crashed:
+                results[pdf_path] = {"pdf": pdf_path, "status": "failed",
+                                     "error": "worker process died", "timings": {}}
+                if state is not None:
+                    state.record(results[pdf_path], *todo[pdf_path], run_options)
+            crashed = []
+        pending = crashed
+
+    coordsets = [(pdf, results[pdf].pop("coordset")) for pdf in pdfs if "coordset" in results[pdf]]
+    report_path = None
+    if clean is not None:
+        report_path = write_geometry_report(os.path.join(output_dir, "geometry_report.csv"),
+                                            [(pdf, results[pdf].pop("geometry_report")) for pdf in pdfs
+                                             if "geometry_report" in results[pdf]])
+    failed = [pdf for pdf in pdfs if results[pdf]["status"] != "ok"]
+    if index_path:
+        update_index(index_path, results, coordsets, removed)
+    if geoparquet_dir:
+        from geoparquet import write_geoparquet
+        write_geoparquet(geoparquet_dir, coordsets, list(removed) + failed, zone=zone, south=south)
+    parcels_kml = None
+    if dedup_db:
+        from dedup import update_parcels
+        parcels_kml = os.path.join(output_dir, "parcels.kml")
+        counts = update_parcels(dedup_db, coordsets, removed, failed, zone, south, dedup_tolerance,
+                                kml_path=parcels_kml, precision=precision)
+        for pdf, count in counts.items():
+            results[pdf]["new_parcels"] = count["new"]
+            results[pdf]["duplicate_parcels"] = count["duplicates"]
+
+    files = [results[p] for p in pdfs]
+    status_counts = {}
+    stage_totals = {}
+    for record in files:
+        status_counts[record["status"]] = status_counts.get(record["status"], 0) + 1
+        for stage, seconds in record.get("timings", {}).items():
+            stage_totals[stage] = stage_totals.get(stage, 0.0) + seconds
+
+    manifest = {
+        "output_dir": output_dir,
+        "workers": workers or os.cpu_count(),
+        "timeout": timeout,
+        "engine": engine,
+        "elapsed": time.perf_counter() - started,
+        "counts": status_counts,
+        "stage_totals": stage_totals,
+        "files": files,
+    }
+    if index_path:
+        manifest["index"] = index_path
+    if geoparquet_dir:
+        manifest["geoparquet"] = geoparquet_dir
+    if report_path:
+        manifest["geometry_report"] = report_path
+    if dedup_db:
+        manifest["dedup_db"] = dedup_db
+        manifest["parcels_kml"] = parcels_kml
+    if state is not None:
+        state.close()
+        manifest["state_db"] = state_db
+        manifest["unchanged"] = unchanged
+        manifest["removed"] = removed
+    with open(manifest_path, "w", encoding="utf-8") as f:
+        json.dump(manifest, f, indent=2)
+    print(f"Batch finished: {status_counts}. Manifest written to '{manifest_path}'")
+    if metrics_path and prometheus_path and os.path.exists(metrics_path):
+        metrics.dump_prometheus(metrics_path, prometheus_path)
+        print(f"Prometheus metrics written to '{prometheus_path}'")
+    return manifest
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Run PDF -> DOCX -> coords -> KML over many PDFs.")
+    parser.add_argument("inputs", nargs="+", help="PDF files, directories or glob patterns")
+    parser.add_argument("-o", "--output-dir", default="output", help="Directory for DOCX/KML outputs")
+    parser.add_argument("-j", "--workers", type=int, default=None, help="Number of worker processes")
+    parser.add_argument("-t", "--timeout", type=float, default=None, help="Per-file timeout in seconds")
+    parser.add_argument("-e", "--engine", choices=["auto", "direct", "docx"], default="auto",
+                        help="Coordinate extraction engine (default: direct with DOCX fallback)")
+    parser.add_argument("--page-window", type=int, default=None,
+                        help="Convert long PDFs this many pages at a time to bound memory")
+    parser.add_argument("--cache-dir", default=None, help="Directory of the conversion cache")
+    parser.add_argument("--cache-max-mb", type=float, default=None, help="Cache size limit in MiB")
+    parser.add_argument("--refresh", action="store_true", help="Ignore cached results and recompute")
+    parser.add_argument("--zone", type=int, default=17, help="UTM zone of the coordinates (default: 17)")
+    parser.add_argument("--hemisphere", choices=["auto", "north", "south"], default="auto",
+                        help="UTM hemisphere (default: detected from the northings)")
+    parser.add_argument("--metrics", default=None, help="Append structured stage events (JSON lines) to this file")
+    parser.add_argument("--prometheus", default=None, help="Write aggregated metrics in Prometheus text format")
+    parser.add_argument("-v", "--verbose", action="store_true", help="Show the status lines of every stage")
+    parser.add_argument("-m", "--manifest", default=None, help="Path of the JSON summary manifest")
+    parser.add_argument("-i", "--incremental", action="store_true",
+                        help="Only process new or modified PDFs and clean up outputs of deleted ones")
+    parser.add_argument("--state-db", default=None,
+                        help="SQLite manifest for --incremental (default: <output-dir>/sources.sqlite)")
+    parser.add_argument("--retry-failed", action="store_true",
+                        help="With --incremental, also redo files that failed last time")
+    parser.add_argument("--index", default=None,
+                        help="Spatial index file (.npz) to update with the extracted polygons")
+    parser.add_argument("--clean", action="store_true",
+                        help="Remove duplicate/collinear vertices, orient rings and report invalid polygons")
+    parser.add_argument("--simplify", type=float, default=None,
+                        help="Douglas-Peucker tolerance in meters (implies --clean)")
+    parser.add_argument("--quantize", type=float, default=None,
+                        help="Snap coordinates to this grid in meters (implies --clean)")
+    parser.add_argument("--precision", type=int, default=None,
+                        help="Decimal places of the KML coordinates (default: from --quantize, else full)")
+    parser.add_argument("--dedup", action="store_true",
+                        help="Record each parcel once across documents and write <output-dir>/parcels.kml")
+    parser.add_argument("--dedup-db", default=None,
+                        help="Parcel store for --dedup (default: <output-dir>/parcels.sqlite)")
+    parser.add_argument("--dedup-tolerance", type=float, default=None,
+                        help="Coordinate tolerance in meters of the parcel fingerprints (default: 0.01)")
+    parser.add_argument("--geoparquet", default=None,
+                        help="GeoParquet dataset directory to update with the extracted polygons and points")
+    args = parser.parse_args(argv)
+    clean = None
+    precision = args.precision
+    if args.clean or args.simplify or args.quantize:
+        clean = {"simplify_tolerance": args.simplify, "quantize": args.quantize}
+        if precision is None and args.quantize:
+            precision = precision_for_tolerance(args.quantize)
+    dedup_db = None
+    if args.dedup or args.dedup_db:
+        dedup_db = args.dedup_db or os.path.join(args.output_dir, "parcels.sqlite")
+    state_db = None
+    if args.incremental or args.state_db:
+        state_db = args.state_db or os.path.join(args.output_dir, "sources.sqlite")
+
+    try:
+        manifest = run_batch(args.inputs, args.output_dir, workers=args.workers,
+                             timeout=args.timeout, manifest_path=args.manifest,
+                             engine=args.engine, cache_dir=args.cache_dir,
+                             cache_max_bytes=int(args.cache_max_mb * 1024 ** 2) if args.cache_max_mb else None,
+                             refresh=args.refresh, zone=args.zone,
+                             south={"auto": None, "north": False, "south": True}[args.hemisphere],
+                             metrics_path=args.metrics, prometheus_path=args.prometheus,
+                             quiet=not args.verbose, state_db=state_db,
+                             retry_failed=args.retry_failed, index_path=args.index,
+                             page_window=args.page_window, geoparquet_dir=args.geoparquet,
+                             clean=clean, precision=precision, dedup_db=dedup_db,
+                             dedup_tolerance=args.dedup_tolerance)
+    except OutputCollision as e:
+        print(f"Error: {e}", file=sys.stderr)
+        return 2
+    return 0 if manifest["counts"].get("ok", 0) == len(manifest["files"]) else 1
+
+
+if __name__ == "__main__":
+    sys.exit(main())
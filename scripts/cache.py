@@ -0,0 +1,157 @@
+import os
+import json
+import shutil
+import hashlib
+import tempfile
+
+# Bump whenever read_docx_with_tables / read_pdf_with_tables change their output,
+# so that entries written by an older parser are no longer hit.
+PARSER_VERSION = "2"
+
+DEFAULT_MAX_BYTES = 2 * 1024 ** 3
+
+def _package_version(name):
+    try:
+        from importlib.metadata import version
+        return version(name)
+    except Exception:
+        return "unknown"
+
+def file_sha256(path, chunk_size=1 << 20):
+    """Returns the hex SHA-256 of a file, read in chunks."""
+    h = hashlib.sha256()
+    with open(path, "rb") as f:
+        for chunk in iter(lambda: f.read(chunk_size), b""):
+            h.update(chunk)
+    return h.hexdigest()
+
+
+class PipelineCache:
+    """
+    On-disk, content-addressed cache for converted DOCX files and extracted
+    coordinates.
+
+    Entries are keyed by the SHA-256 of the PDF bytes plus the parser and
+    pdf2docx/PyMuPDF versions, the engine and the conversion mode, so
+    renamed or duplicate uploads hit the same entry and upgrades invalidate
+    it. Each entry is a directory holding
+    'coords.json' and, when the DOCX route was used, 'output.docx'. The total
+    size is bounded by `max_bytes`, evicting least recently used entries.
+
+    Args:
+        root (str): Cache directory.
+        max_bytes (int, optional): Size limit in bytes. Defaults to 2 GiB;
+                                   0 disables eviction.
+    """
+
+    def __init__(self, root, max_bytes=None):
+        self.root = root
+        self.max_bytes = DEFAULT_MAX_BYTES if max_bytes is None else max_bytes
+        self.version = "|".join([
+            PARSER_VERSION,
+            _package_version("pdf2docx"),
+            _package_version("PyMuPDF"),
+        ])
+        os.makedirs(root, exist_ok=True)
+
+    # --- Keys and paths ---
+    def key_for(self, pdf_path, engine="auto", page_window=None):
+        """
+        Cache key for a PDF: hash of its bytes, the versions, the engine and
+        the conversion mode. Windowed conversions keep no DOCX, so they get
+        their own entries; otherwise a later whole-document run would hit
+        one and leave no DOCX at its docx_path. The window size itself does
+        not change the result and is not part of the key.
+        """
+        mode = "windowed" if page_window else "whole"
+        h = hashlib.sha256()
+        h.update(file_sha256(pdf_path).encode())
+        h.update(f"|{self.version}|{engine}|{mode}".encode())
+        return h.hexdigest()
+
+    def _entry_dir(self, key):
+        return os.path.join(self.root, key[:2], key)
+
+    # --- Lookup and store ---
+    def get(self, key, docx_path=None):
+        """
+        Returns the cached (text, coords, info) for `key`, or None on a miss.
+
+        If the entry holds a DOCX and `docx_path` is given, the DOCX is copied
+        there, so callers get the same files as after a real conversion.
+        """
+        entry = self._entry_dir(key)
+        meta_path = os.path.join(entry, "coords.json")
+        try:
+            with open(meta_path, "r", encoding="utf-8") as f:
+                meta = json.load(f)
+            cached_docx = os.path.join(entry, "output.docx")
+            if docx_path and os.path.exists(cached_docx):
+                shutil.copyfile(cached_docx, docx_path)
+            # Mark as recently used for LRU eviction
+            os.utime(entry)
+        except (OSError, ValueError):
+            return None
+
+        info = dict(meta.get("info") or {})
+        info["cache"] = "hit"
+        return meta.get("text"), meta.get("coords"), info
+
+    def put(self, key, text, coords, info, docx_path=None):
+        """
+        Stores an extraction result (and the DOCX, if given) under `key`.
+
+        The entry is written to a temporary directory and renamed into place,
+        so concurrent workers never see half-written entries.
+        """
+        entry = self._entry_dir(key)
+        os.makedirs(os.path.dirname(entry), exist_ok=True)
+        tmp = tempfile.mkdtemp(prefix=".tmp-", dir=self.root)
+        try:
+            with open(os.path.join(tmp, "coords.json"), "w", encoding="utf-8") as f:
+                json.dump({"text": text, "coords": coords, "info": info}, f)
+            if docx_path and os.path.exists(docx_path):
+                shutil.copyfile(docx_path, os.path.join(tmp, "output.docx"))
+            try:
+                os.rename(tmp, entry)
+            except OSError:
+                # Another worker stored the same entry first
+                shutil.rmtree(tmp, ignore_errors=True)
+        except Exception:
+            shutil.rmtree(tmp, ignore_errors=True)
+            raise
+        self.evict()
+
+    def invalidate(self, key):
+        """Removes the entry for `key`, if any."""
+        shutil.rmtree(self._entry_dir(key), ignore_errors=True)
+
+    # --- Eviction ---
+    def _entries(self):
+        for prefix in os.listdir(self.root):
+            prefix_dir = os.path.join(self.root, prefix)
+            if prefix.startswith(".") or not os.path.isdir(prefix_dir):
+                continue
+            for key in os.listdir(prefix_dir):
+                entry = os.path.join(prefix_dir, key)
+                try:
+                    size = sum(e.stat().st_size for e in os.scandir(entry))
+                    yield os.stat(entry).st_mtime, size, entry
+                except OSError:
+                    continue # Removed by another worker meanwhile
+
+    def size(self):
+        """Total size of all entries in bytes."""
+        return sum(size for _, size, _ in self._entries())
+
+    def evict(self):
+        """Deletes least recently used entries until the cache fits `max_bytes`."""
+        if not self.max_bytes:
+            return
+        entries = sorted(self._entries())
+        total = sum(size for _, size, _ in entries)
+        for _, size, entry in entries:
+            if total <= self.max_bytes:
+                break
+            shutil.rmtree(entry, ignore_errors=True)
+            total -= size
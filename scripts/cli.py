@@ -0,0 +1,176 @@
+import os
+import sys
+import argparse
+
+# Only the standard library is imported at module level. Every subcommand
+# imports what it needs when it runs, so `--help` and light subcommands do not
+# pay for pandas, matplotlib, pdf2docx or pyproj.
+
+HEMISPHERES = {"auto": None, "north": False, "south": True}
+
+def _load_points(path, engine="auto"):
+    """Reads the vertices of a .csv ('x', 'y' columns), .docx or .pdf into a DataFrame."""
+    import pandas as pd
+    from doc_2_coords import coords_to_dataframe
+
+    lowered = path.lower()
+    if lowered.endswith(".csv"):
+        return pd.read_csv(path)
+    if lowered.endswith(".docx"):
+        from doc_2_coords import read_docx_with_tables
+        extracted = read_docx_with_tables(path)
+        coords = extracted[1] if isinstance(extracted, tuple) else None
+    else:
+        from pdf_2_coords import extract_coords
+        _, coords, _ = extract_coords(path, engine=engine)
+    return coords_to_dataframe(coords)
+
+def cmd_pdf(args):
+    from pdf_2_doc import convert_pdf_to_docx, convert_coordinate_pages
+
+    failed = 0
+    for pdf_path in args.inputs:
+        docx_path = None
+        if args.output_dir:
+            os.makedirs(args.output_dir, exist_ok=True)
+            docx_path = os.path.join(args.output_dir, os.path.splitext(os.path.basename(pdf_path))[0] + ".docx")
+        if args.all_pages:
+            ok = convert_pdf_to_docx(pdf_path, docx_path)
+        else:
+            ok = convert_coordinate_pages(pdf_path, docx_path)["success"]
+        failed += 0 if ok else 1
+    return 1 if failed else 0
+
+def cmd_coords(args):
+    import pandas as pd
+
+    frames = []
+    for path in args.inputs:
+        df = _load_points(path, args.engine)
+        df.insert(0, "source", path)
+        frames.append(df)
+    result = pd.concat(frames, ignore_index=True) if frames else pd.DataFrame()
+    result.to_csv(args.output or sys.stdout, index=False)
+    return 0 if len(result) else 1
+
+def cmd_kml(args):
+    from coordset import CoordinateSet
+    from coords_2_kml import generate_kml
+
+    df = _load_points(args.input, args.engine)
+    if df.empty:
+        print(f"No coordinates found in '{args.input}'.", file=sys.stderr)
+        return 1
+    output = args.output or os.path.splitext(args.input)[0] + ".kml"
+    coordset = CoordinateSet.from_dataframe(df)
+    precision = args.precision
+    if args.clean or args.simplify or args.quantize or args.report:
+        from geometry import clean_polygons, precision_for_tolerance
+
+        coordset, report = clean_polygons(coordset, simplify_tolerance=args.simplify, quantize=args.quantize)
+        if precision is None and args.quantize:
+            precision = precision_for_tolerance(args.quantize)
+        if args.report:
+            report.to_csv(args.report, index=False)
+        invalid = report[~report["valid"]]
+        for row in invalid.itertuples():
+            print(f"Polygon {row.polygon}: {row.issue}", file=sys.stderr)
+    generate_kml(coordset, args.input, zone=args.zone, south=HEMISPHERES[args.hemisphere],
+                 output_path=output, precision=precision)
+    return 0 if os.path.exists(output) else 1
+
+def cmd_plot(args):
+    if args.output:
+        import matplotlib
+        matplotlib.use("Agg") # No display needed when saving to a file
+    from vis import report_polygons
+
+    df = _load_points(args.input, args.engine)
+    report_polygons(df, output=args.output, decimate=args.decimate)
+    return 0
+
+def cmd_batch(args):
+    from batch import main as batch_main
+    return batch_main(args.args)
+
+def cmd_dedup(args):
+    from dedup import main as dedup_main
+    return dedup_main(args.args)
+
+def cmd_index(args):
+    from spatial_index import main as index_main
+    return index_main(args.args)
+
+def cmd_serve(args):
+    from service import main as service_main
+    return service_main(args.args)
+
+def build_parser():
+    parser = argparse.ArgumentParser(prog="utm-pdfs", description="Extract UTM coordinates from PDFs and export them to KML.")
+    parser.add_argument("-q", "--quiet", action="store_true", help="Hide per-stage status lines")
+    sub = parser.add_subparsers(dest="command", required=True)
+
+    p = sub.add_parser("pdf", help="Convert PDFs to DOCX (only the pages with coordinate tables)")
+    p.add_argument("inputs", nargs="+", help="PDF files")
+    p.add_argument("-o", "--output-dir", default=None, help="Directory for the DOCX files (default: next to each PDF)")
+    p.add_argument("--all-pages", action="store_true", help="Convert every page instead of the pre-scanned ones")
+    p.set_defaults(func=cmd_pdf)
+
+    p = sub.add_parser("coords", help="Extract coordinates from PDF/DOCX files as CSV")
+    p.add_argument("inputs", nargs="+", help="PDF or DOCX files")
+    p.add_argument("-e", "--engine", choices=["auto", "direct", "docx"], default="auto")
+    p.add_argument("-o", "--output", default=None, help="CSV file (default: standard output)")
+    p.set_defaults(func=cmd_coords)
+
+    p = sub.add_parser("kml", help="Write the polygons of a PDF/DOCX/CSV to KML")
+    p.add_argument("input", help="PDF, DOCX or CSV (with 'x' and 'y' columns)")
+    p.add_argument("-o", "--output", default=None, help="Output .kml/.kmz/.kml.gz (default: next to the input)")
+    p.add_argument("-e", "--engine", choices=["auto", "direct", "docx"], default="auto")
+    p.add_argument("--zone", type=int, default=17, help="UTM zone (default: 17)")
+    p.add_argument("--hemisphere", choices=list(HEMISPHERES), default="auto")
+    p.add_argument("--precision", type=int, default=None, help="Decimal places of the output coordinates")
+    p.add_argument("--clean", action="store_true",
+                   help="Remove duplicate/collinear vertices and orient rings before writing")
+    p.add_argument("--simplify", type=float, default=None,
+                   help="Douglas-Peucker tolerance in meters (implies --clean)")
+    p.add_argument("--quantize", type=float, default=None,
+                   help="Snap coordinates to this grid in meters (implies --clean)")
+    p.add_argument("--report", default=None, help="Write the per-polygon cleaning report to this CSV")
+    p.set_defaults(func=cmd_kml)
+
+    p = sub.add_parser("plot", help="Print polygon areas and plot them")
+    p.add_argument("input", help="PDF, DOCX or CSV (with 'x' and 'y' columns)")
+    p.add_argument("-o", "--output", default=None, help="Save the figure (PNG/SVG/PDF) instead of showing it")
+    p.add_argument("-e", "--engine", choices=["auto", "direct", "docx"], default="auto")
+    p.add_argument("--decimate", type=lambda v: v if v == "auto" else float(v), default=None,
+                   help="Simplify the saved figure: grid size in meters, or 'auto' (about one pixel)")
+    p.set_defaults(func=cmd_plot)
+
+    p = sub.add_parser("batch", help="Run the whole pipeline over many PDFs (see 'batch -h')", add_help=False)
+    p.add_argument("args", nargs=argparse.REMAINDER)
+    p.set_defaults(func=cmd_batch)
+
+    p = sub.add_parser("index", help="Query a spatial index built by 'batch --index' (see 'index -h')", add_help=False)
+    p.add_argument("args", nargs=argparse.REMAINDER)
+    p.set_defaults(func=cmd_index)
+
+    p = sub.add_parser("dedup", help="List or export the unique parcels of a 'batch --dedup' store (see 'dedup -h')",
+                       add_help=False)
+    p.add_argument("args", nargs=argparse.REMAINDER)
+    p.set_defaults(func=cmd_dedup)
+
+    p = sub.add_parser("serve", help="Start the local PDF -> KML job service (see 'serve -h')", add_help=False)
+    p.add_argument("args", nargs=argparse.REMAINDER)
+    p.set_defaults(func=cmd_serve)
+    return parser
+
+def main(argv=None):
+    args = build_parser().parse_args(argv)
+    # Status lines would mix with the CSV when it goes to standard output
+    if args.quiet or (args.command == "coords" and not args.output):
+        import metrics
+        metrics.set_quiet(True)
+    return args.func(args)
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -1,19 +1,14 @@
+import numpy as np
 import pandas as pd
-from pyproj import CRS, Transformer
 
-def generate_kml(polygons, file_name):
-    # --- Define Coordinate Reference Systems ---
-    # Source: WGS 84 / UTM zone 17S
-    source_crs = CRS("EPSG:32717")
-    # Target: WGS 84 (lat/lon) used by KML
-    target_crs = CRS("EPSG:4326")
+from crs import get_transformer, resolve_utm_epsg
+from kml_writer import KMLWriter
+from coordset import CoordinateSet
 
-    # --- Create Transformer ---
-    # always_xy=True ensures output is (longitude, latitude) order, which KML needs
-    transformer = Transformer.from_crs(source_crs, target_crs, always_xy=True)
+import metrics
 
-    # --- KML Structure Components ---
-    kml_header = """<?xml version="1.0" encoding="UTF-8"?>
+# --- KML Structure Components ---
+KML_HEADER = """<?xml version="1.0" encoding="UTF-8"?>
     <kml xmlns="http://www.opengis.net/kml/2.2">
     <Document>
         <name>Polygons from DataFrames</name>
@@ -31,20 +26,37 @@ def generate_kml(polygons, file_name):
         </Style>
     """
 
-    kml_footer = """
+KML_FOOTER = """
     </Document>
     </kml>"""
 
-    kml_placemarks = [] # To store KML for each polygon
+def collect_polygon_vertices(polygons):
+    """
+    Validates polygon DataFrames and packs their vertices into flat arrays.
+
+    Items that are not DataFrames, lack 'x'/'y' columns or have fewer than
+    3 valid points after dropping NaNs are skipped (and reported).
+
+    Args:
+        polygons (list): DataFrames with 'x' (easting) and 'y' (northing) columns.
 
-    # --- Process each DataFrame ---
+    Returns:
+        tuple: (ids, x, y, offsets). ids are the 1-based positions of the
+               kept polygons in `polygons`; polygon k has the vertices
+               offsets[k]:offsets[k+1] of the float64 arrays x and y.
+    """
+    ids = []
+    xs = []
+    ys = []
     for i, df in enumerate(polygons):
         if not isinstance(df, pd.DataFrame) or df.empty:
-            print(f"Skipping item {i+1} as it's not a valid DataFrame or is empty.")
+            metrics.report(f"Skipping item {i+1} as it's not a valid DataFrame or is empty.",
+                           event="kml.skipped", polygon=i + 1, reason="not_a_dataframe_or_empty")
             continue
 
         if 'x' not in df.columns or 'y' not in df.columns:
-            print(f"Skipping DataFrame {i+1} due to missing 'x' or 'y' columns.")
+            metrics.report(f"Skipping DataFrame {i+1} due to missing 'x' or 'y' columns.",
+                           event="kml.skipped", polygon=i + 1, reason="missing_columns")
             continue
 
         # Drop rows with missing coordinates if any
@@ -52,58 +64,99 @@ def generate_kml(polygons, file_name):
 
         # Need at least 3 points for a polygon
         if len(df_clean) < 3:
-            print(f"Skipping polygon {i+1} as it has less than 3 valid points.")
+            metrics.report(f"Skipping polygon {i+1} as it has less than 3 valid points.",
+                           event="kml.skipped", polygon=i + 1, reason="fewer_than_3_points")
             continue
 
-        # Extract coordinates
-        x_coords = df_clean['x'].values
-        y_coords = df_clean['y'].values
-
-        # Transform coordinates to lon/lat
-        lons, lats = transformer.transform(x_coords, y_coords)
-
-        # Format coordinates for KML string: "lon,lat,alt lon,lat,alt ..."
-        # Altitude (alt) is typically 0 for ground polygons.
-        coord_list = []
-        for lon, lat in zip(lons, lats):
-            coord_list.append(f"{lon},{lat},0") # Altitude 0
-
-        # KML polygons must be closed: the first coordinate must be repeated at the end.
-        # Check if the provided data already does this. If not, add it.
-        if coord_list: # Check if list is not empty after potential drops
-            first_coord = coord_list[0]
-            last_coord = coord_list[-1]
-            # Compare the lon,lat parts only (ignore potential altitude differences if any)
-            if first_coord.rsplit(',', 1)[0] != last_coord.rsplit(',', 1)[0]:
-                print(f"Note: Closing polygon {i+1} by repeating the first coordinate.")
-                coord_list.append(first_coord)
-
-        coordinates_str = " ".join(coord_list)
-
-        # Create KML Placemark for this polygon
-        placemark = f"""
-        <Placemark>
-        <name>Polygon {i+1}</name>
-        <styleUrl>#polygonStyle</styleUrl> <!-- Link to the style defined above -->
-        <Polygon>
-            <outerBoundaryIs>
-            <LinearRing>
-                <coordinates>{coordinates_str}</coordinates>
-            </LinearRing>
-            </outerBoundaryIs>
-        </Polygon>
-        </Placemark>"""
-        kml_placemarks.append(placemark)
-
-    # --- Combine all parts into the final KML string ---
-    full_kml = kml_header + "\n".join(kml_placemarks) + kml_footer
-
-    # --- Write the KML string to a file ---
-    # output_kml_file = "output_polygons.kml"
-    output_kml_file = file_name.replace(".docx", ".kml")
+        ids.append(i + 1)
+        xs.append(df_clean['x'].to_numpy(dtype=np.float64))
+        ys.append(df_clean['y'].to_numpy(dtype=np.float64))
+
+    offsets = np.zeros(len(xs) + 1, dtype=np.int64)
+    if not xs:
+        return ids, np.empty(0), np.empty(0), offsets
+    np.cumsum([len(v) for v in xs], out=offsets[1:])
+    return ids, np.concatenate(xs), np.concatenate(ys), offsets
+
+def transform_vertices(transformer, x, y, chunk_size=None):
+    """
+    Reprojects flat vertex arrays in one transform call, or in fixed-size
+    chunks of `chunk_size` vertices to cap the temporary memory.
+
+    Returns:
+        tuple: (lons, lats) float64 arrays aligned with x and y.
+    """
+    if chunk_size is None or len(x) <= chunk_size:
+        lons, lats = transformer.transform(x, y)
+        return np.asarray(lons), np.asarray(lats)
+
+    lons = np.empty(len(x))
+    lats = np.empty(len(x))
+    for start in range(0, len(x), chunk_size):
+        stop = start + chunk_size
+        lons[start:stop], lats[start:stop] = transformer.transform(x[start:stop], y[start:stop])
+    return lons, lats
+
+def generate_kml(polygons, file_name, zone=17, south=None, chunk_size=None,
+                 output_path=None, precision=None):
+    """
+    Writes a list of polygon DataFrames ('x', 'y' in WGS 84 / UTM), or a
+    CoordinateSet, to a KML file named after `file_name` with a .kml extension.
+
+    All valid vertices are packed into one array and reprojected with a
+    single transform call, then split back per polygon and streamed to the
+    file through KMLWriter, so the document is never held in memory.
+
+    Args:
+        polygons (list | CoordinateSet): DataFrames with 'x' (easting) and
+                                         'y' (northing) columns, or a
+                                         CoordinateSet whose arrays are used
+                                         as they are.
+        file_name (str): Source document name; ".docx" is replaced by ".kml".
+        zone (int, optional): UTM zone of the input. Defaults to 17.
+        south (bool, optional): Southern hemisphere. Defaults to None, which
+                                detects it from the northing values.
+        chunk_size (int, optional): Reproject at most this many vertices per
+                                    transform call. Defaults to None (one call).
+        output_path (str, optional): Output file; a '.kmz' or '.gz' extension
+                                     compresses it. Defaults to `file_name`
+                                     with ".docx" replaced by ".kml".
+        precision (int, optional): Decimal places of the coordinates.
+                                   Defaults to None (full float repr).
+    """
+    with metrics.stage("kml", file=file_name) as st:
+        _generate_kml(polygons, file_name, zone, south, chunk_size, output_path, precision, st)
+
+def _generate_kml(polygons, file_name, zone, south, chunk_size, output_path, precision, st):
+    # --- Validate and pack all polygons into flat arrays ---
+    if isinstance(polygons, CoordinateSet):
+        ids, x_all, y_all, offsets = polygons.packed(min_vertices=3)
+        n_input = polygons.n_polygons
+    else:
+        ids, x_all, y_all, offsets = collect_polygon_vertices(polygons)
+        n_input = len(polygons)
+    st.count(polygons=len(ids), skipped=n_input - len(ids), vertices=len(x_all))
+
+    # --- Source CRS: WGS 84 / UTM zone (17S unless told otherwise) ---
+    source_epsg = resolve_utm_epsg(y_all if len(y_all) else None, zone, south)
+
+    # --- Shared, cached transformer to WGS 84 (lon/lat) used by KML ---
+    transformer = get_transformer(source_epsg)
+
+    # --- Transform every vertex to lon/lat at once ---
+    lons_all, lats_all = transform_vertices(transformer, x_all, y_all, chunk_size)
+
+    # --- Stream a placemark for each polygon straight to the file ---
+    output_kml_file = output_path or file_name.replace(".docx", ".kml")
     try:
-        with open(output_kml_file, 'w', encoding='utf-8') as f:
-            f.write(full_kml)
-        print(f"Successfully created KML file: '{output_kml_file}'")
+        with KMLWriter(output_kml_file, KML_HEADER, KML_FOOTER, precision=precision) as kml:
+            for k, i in enumerate(ids):
+                lons = lons_all[offsets[k]:offsets[k+1]]
+                lats = lats_all[offsets[k]:offsets[k+1]]
+                # KML polygons must be closed: the writer repeats the first coordinate if needed
+                if kml.write_polygon(f"Polygon {i}", lons, lats):
+                    metrics.report(f"Note: Closing polygon {i} by repeating the first coordinate.")
+        metrics.report(f"Successfully created KML file: '{output_kml_file}'")
     except Exception as e:
-        print(f"Error writing KML file: {e}")
+        metrics.report(f"Error writing KML file: {e}")
+        st.fail(f"{type(e).__name__}: {e}")
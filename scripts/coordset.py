@@ -0,0 +1,174 @@
+from array import array
+
+import numpy as np
+
+from vis import find_polygon_offsets, calculate_polygon_areas
+
+class CoordinateSet:
+    """
+    Compact, array-backed set of surveyed vertices grouped into polygons.
+
+    Replaces the lists of string lists returned by read_docx_with_tables:
+    point ids are int64, eastings/northings float64, and polygon k is made
+    of the vertices offsets[k]:offsets[k+1]. Slices and DataFrame views share
+    memory with these arrays instead of copying them.
+
+    Args:
+        point_ids (array-like): Point number of each vertex (int64).
+        x, y (array-like): Eastings and northings in meters (float64).
+        offsets (array-like, optional): Polygon boundaries, length
+                                        n_polygons + 1. Defaults to splitting
+                                        on repeated closing vertices, as in
+                                        vis.find_polygon_offsets.
+    """
+
+    __slots__ = ("point_ids", "x", "y", "offsets")
+
+    def __init__(self, point_ids, x, y, offsets=None):
+        self.point_ids = np.asarray(point_ids, dtype=np.int64)
+        self.x = np.asarray(x, dtype=np.float64)
+        self.y = np.asarray(y, dtype=np.float64)
+        if not (len(self.point_ids) == len(self.x) == len(self.y)):
+            raise ValueError("point_ids, x and y must have the same length")
+        if offsets is None:
+            offsets = find_polygon_offsets(self.x, self.y)
+        self.offsets = np.asarray(offsets, dtype=np.int64)
+
+    # --- Constructors ---
+    @classmethod
+    def empty(cls):
+        return cls(np.empty(0), np.empty(0), np.empty(0), np.zeros(1))
+
+    @classmethod
+    def from_rows(cls, rows):
+        """
+        Builds a set from coordinate rows such as ['1', '532137', '9892120'].
+
+        Same rules as doc_2_coords.coords_to_dataframe: empty cells are
+        ignored, the last two fields are X and Y and the first one (if there
+        are three or more) is the point number. Rows that are not numeric
+        are dropped.
+        """
+        builder = CoordinateSetBuilder()
+        for row in rows or []:
+            builder.append(row)
+        return builder.build()
+
+    @classmethod
+    def from_dataframe(cls, df, offsets=None):
+        """Builds a set from a DataFrame with 'x', 'y' and optionally 'point' columns."""
+        df = df.dropna(subset=['x', 'y'])
+        x = df['x'].to_numpy(dtype=np.float64)
+        y = df['y'].to_numpy(dtype=np.float64)
+        if 'point' in df.columns:
+            import pandas as pd
+            ids = pd.to_numeric(df['point'], errors='coerce').fillna(-1).to_numpy(dtype=np.int64)
+        else:
+            ids = np.arange(1, len(x) + 1)
+        return cls(ids, x, y, offsets)
+
+    # --- Views ---
+    def __len__(self):
+        return len(self.x)
+
+    @property
+    def n_polygons(self):
+        return len(self.offsets) - 1
+
+    def polygon(self, k):
+        """Returns (x, y) views of polygon k."""
+        a, b = self.offsets[k], self.offsets[k + 1]
+        return self.x[a:b], self.y[a:b]
+
+    def to_dataframe(self):
+        """
+        DataFrame with 'point', 'x' and 'y' columns backed by the same arrays
+        (no copy), plus a 'polygon' column with each vertex's polygon number.
+        """
+        import pandas as pd
+
+        polygon = np.repeat(np.arange(1, self.n_polygons + 1), np.diff(self.offsets))
+        return pd.DataFrame({'point': self.point_ids, 'x': self.x, 'y': self.y, 'polygon': polygon},
+                            copy=False)
+
+    def polygons(self):
+        """List of one DataFrame slice per polygon, as expected by generate_kml."""
+        df = self.to_dataframe()
+        return [df.iloc[a:b] for a, b in zip(self.offsets[:-1], self.offsets[1:])]
+
+    def areas(self):
+        """Area of every polygon in square meters (shoelace formula)."""
+        return calculate_polygon_areas(self.x, self.y, self.offsets)
+
+    def packed(self, min_vertices=3):
+        """
+        Keeps only the polygons with at least `min_vertices` vertices.
+
+        Returns:
+            tuple: (ids, x, y, offsets) where ids are the 1-based numbers of
+                   the kept polygons, as returned by
+                   coords_2_kml.collect_polygon_vertices.
+        """
+        counts = np.diff(self.offsets)
+        keep = counts >= min_vertices
+        ids = (np.flatnonzero(keep) + 1).tolist()
+        if keep.all():
+            return ids, self.x, self.y, self.offsets
+        mask = np.repeat(keep, counts)
+        offsets = np.zeros(int(keep.sum()) + 1, dtype=np.int64)
+        np.cumsum(counts[keep], out=offsets[1:])
+        return ids, self.x[mask], self.y[mask], offsets
+
+    def to_rows(self):
+        """The legacy list of [point, x, y] string rows."""
+        return [[str(p), f"{x:.15g}", f"{y:.15g}"]
+                for p, x, y in zip(self.point_ids.tolist(), self.x.tolist(), self.y.tolist())]
+
+    def to_text(self):
+        """Rows joined like the text returned by read_docx_with_tables."""
+        return "\n".join(",".join(row) for row in self.to_rows())
+
+    def __repr__(self):
+        return f"CoordinateSet({len(self)} vertices, {self.n_polygons} polygon(s))"
+
+
+class CoordinateSetBuilder:
+    """
+    Accumulates coordinate rows into typed arrays as they are parsed.
+
+    It has the list `append` / `len` interface, so a parser can use it in
+    place of the usual list of rows without keeping the strings around.
+    """
+
+    def __init__(self):
+        self.point_ids = array("q")
+        self.x = array("d")
+        self.y = array("d")
+
+    def __len__(self):
+        return len(self.x)
+
+    def append(self, row):
+        fields = [str(f).strip() for f in row if str(f).strip() != '']
+        if len(fields) < 2:
+            return
+        try:
+            x = float(fields[-2])
+            y = float(fields[-1])
+        except ValueError:
+            return
+        if x != x or y != y:
+            return # NaN
+        try:
+            point = int(fields[0]) if len(fields) >= 3 else len(self.x) + 1
+        except ValueError:
+            point = -1
+        self.point_ids.append(point)
+        self.x.append(x)
+        self.y.append(y)
+
+    def build(self, offsets=None):
+        return CoordinateSet(np.frombuffer(self.point_ids, dtype=np.int64),
+                             np.frombuffer(self.x, dtype=np.float64),
+                             np.frombuffer(self.y, dtype=np.float64),
+                             offsets)
@@ -0,0 +1,78 @@
+import threading
+
+import numpy as np
+
+# WGS 84 (lat/lon), used by KML
+WGS84_EPSG = 4326
+
+# pyproj Transformer objects must not be shared between threads, so each
+# thread keeps its own memo of (source EPSG, target EPSG) -> Transformer.
+_local = threading.local()
+
+def get_transformer(source_epsg, target_epsg=WGS84_EPSG):
+    """
+    Returns a cached Transformer from `source_epsg` to `target_epsg`.
+
+    Transformers are built once per thread and reused on every later call,
+    since construction is far more expensive than transforming a few points.
+    always_xy=True ensures (x, y) / (longitude, latitude) order, which KML needs.
+
+    Args:
+        source_epsg (int): EPSG code of the input CRS, e.g. 32717.
+        target_epsg (int, optional): EPSG code of the output CRS. Defaults to 4326.
+
+    Returns:
+        pyproj.Transformer
+    """
+    registry = getattr(_local, "transformers", None)
+    if registry is None:
+        registry = _local.transformers = {}
+
+    key = (int(source_epsg), int(target_epsg))
+    transformer = registry.get(key)
+    if transformer is None:
+        from pyproj import CRS, Transformer
+        transformer = Transformer.from_crs(CRS(f"EPSG:{key[0]}"), CRS(f"EPSG:{key[1]}"), always_xy=True)
+        registry[key] = transformer
+    return transformer
+
+def utm_epsg(zone, south=True):
+    """
+    EPSG code of a WGS 84 / UTM zone.
+
+    Example: utm_epsg(17, south=True) -> 32717, utm_epsg(18, south=False) -> 32618
+    """
+    zone = int(zone)
+    if not 1 <= zone <= 60:
+        raise ValueError(f"UTM zone must be between 1 and 60, got {zone}")
+    return (32700 if south else 32600) + zone
+
+def detect_south(northings):
+    """
+    Guesses the UTM hemisphere from the northing values.
+
+    Southern-hemisphere northings carry a 10,000,000 m false northing, so near
+    the equator (where our surveys are) they are close to 10 million, while
+    northern ones are close to 0. Values of 5,000,000 m or more are taken as
+    southern. This does not hold above ~45° N, so pass `south` explicitly there.
+
+    Args:
+        northings (array-like): Northing values in meters.
+
+    Returns:
+        bool: True for the southern hemisphere.
+    """
+    northings = np.asarray(northings, dtype=np.float64)
+    northings = northings[np.isfinite(northings)]
+    if northings.size == 0:
+        return True
+    return bool(np.median(northings) >= 5_000_000)
+
+def resolve_utm_epsg(northings=None, zone=17, south=None):
+    """
+    EPSG code for the given zone, detecting the hemisphere from the northings
+    when `south` is None.
+    """
+    if south is None:
+        south = detect_south(northings) if northings is not None else True
+    return utm_epsg(zone, south)
@@ -0,0 +1,304 @@
+import os
+import sys
+import time
+import sqlite3
+import hashlib
+import argparse
+
+import numpy as np
+
+from crs import get_transformer, resolve_utm_epsg
+from vis import calculate_polygon_areas
+from geometry import remove_duplicates, orient_rings
+
+import metrics
+
+DEFAULT_TOLERANCE = 0.01 # Meters
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS meta (
+    key TEXT PRIMARY KEY,
+    value TEXT NOT NULL
+);
+CREATE TABLE IF NOT EXISTS parcels (
+    fingerprint TEXT PRIMARY KEY,
+    vertices INTEGER NOT NULL,
+    area_m2 REAL NOT NULL,
+    epsg INTEGER NOT NULL,
+    x BLOB NOT NULL,
+    y BLOB NOT NULL,
+    first_seen REAL NOT NULL
+);
+CREATE TABLE IF NOT EXISTS occurrences (
+    source TEXT NOT NULL,
+    polygon INTEGER NOT NULL,
+    fingerprint TEXT NOT NULL REFERENCES parcels(fingerprint),
+    seen REAL NOT NULL,
+    PRIMARY KEY (source, polygon)
+);
+CREATE INDEX IF NOT EXISTS occurrences_fingerprint ON occurrences(fingerprint);
+"""
+
+# --- Fingerprints ---
+def polygon_fingerprints(coordset, tolerance=DEFAULT_TOLERANCE, min_vertices=3):
+    """
+    Canonical fingerprint of every polygon with at least `min_vertices`
+    vertices.
+
+    Coordinates are snapped to a `tolerance` grid, the closing vertex and
+    repeated vertices are dropped, the ring is oriented counter-clockwise
+    and rotated to start at its smallest (x, y) vertex. The same parcel
+    therefore gets the same fingerprint whatever vertex its table starts
+    at, whichever way it runs and whether or not it repeats the first
+    point. Values lying right on a grid boundary may still round apart.
+
+    Args:
+        coordset (CoordinateSet): Extracted polygons (UTM meters).
+        tolerance (float, optional): Grid size in meters. Defaults to 0.01.
+        min_vertices (int, optional): Smaller polygons are skipped.
+
+    Returns:
+        tuple: (ids, fingerprints). ids are the 1-based polygon numbers that
+               were fingerprinted (see CoordinateSet.packed), fingerprints
+               hex digests aligned with them.
+    """
+    ids, x, y, offsets = coordset.packed(min_vertices)
+    n_rings = len(ids)
+    if not n_rings:
+        return ids, []
+    qx = np.round(np.asarray(x) / tolerance)
+    qy = np.round(np.asarray(y) / tolerance)
+    ring = np.repeat(np.arange(n_rings), np.diff(offsets))
+    idx, ring, _ = remove_duplicates(qx, qy, np.arange(len(qx)), ring, n_rings)
+    idx, _ = orient_rings(qx, qy, idx, ring, n_rings, "ccw")
+
+    # Rotate each ring to start at its smallest vertex
+    counts = np.bincount(ring, minlength=n_rings)
+    starts = np.cumsum(counts) - counts
+    order = np.lexsort((qy[idx], qx[idx], ring))
+    first = np.ones(len(order), dtype=bool)
+    first[1:] = ring[order[1:]] != ring[order[:-1]]
+    shift = order[first] - starts
+    local = np.arange(len(idx)) - starts[ring]
+    idx = idx[starts[ring] + (local + shift[ring]) % counts[ring]]
+
+    packed = np.empty((len(idx), 2), dtype="<i8")
+    packed[:, 0] = qx[idx]
+    packed[:, 1] = qy[idx]
+    data = packed.tobytes()
+    bounds = (np.concatenate([[0], np.cumsum(counts)]) * 16).tolist()
+    fingerprints = [hashlib.blake2b(data[a:b], digest_size=16).hexdigest()
+                    for a, b in zip(bounds[:-1], bounds[1:])]
+    return ids, fingerprints
+
+
+# --- Persistent store ---
+class ParcelStore:
+    """
+    SQLite store of the unique parcels seen across documents.
+
+    Each parcel is kept once, under its fingerprint, with the geometry of
+    the first document it was found in; every (document, polygon) where it
+    appears is recorded as an occurrence. Re-registering a document replaces
+    its occurrences, and a parcel disappears with its last occurrence.
+
+    Fingerprints made with different tolerances are not comparable, so the
+    tolerance is fixed when the store is created.
+
+    Args:
+        db_path (str): SQLite database file (created if missing).
+        tolerance (float, optional): Fingerprint grid in meters. Defaults to
+                                     the store's own, or 0.01 for a new one.
+    """
+
+    def __init__(self, db_path, tolerance=None):
+        self.db_path = db_path
+        directory = os.path.dirname(db_path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        self.conn = sqlite3.connect(db_path)
+        self.conn.row_factory = sqlite3.Row
+        self.conn.execute("PRAGMA journal_mode=WAL")
+        self.conn.executescript(SCHEMA)
+        row = self.conn.execute("SELECT value FROM meta WHERE key = 'tolerance'").fetchone()
+        if row is None:
+            self.tolerance = DEFAULT_TOLERANCE if tolerance is None else tolerance
+            self.conn.execute("INSERT INTO meta VALUES ('tolerance', ?)", (repr(self.tolerance),))
+        else:
+            self.tolerance = float(row["value"])
+            if tolerance is not None and tolerance != self.tolerance:
+                raise ValueError(f"'{db_path}' holds fingerprints made with tolerance {self.tolerance}, "
+                                 f"not {tolerance}")
+        self.conn.commit()
+
+    def close(self):
+        self.conn.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        self.close()
+
+    def __len__(self):
+        return self.conn.execute("SELECT COUNT(*) FROM parcels").fetchone()[0]
+
+    # --- Updates ---
+    def register(self, source, coordset, zone=17, south=None):
+        """
+        Records the polygons of `source`, replacing what was recorded for it.
+
+        Returns:
+            dict: 'new' (parcels not seen in any other document) and
+                  'duplicates' (parcels already known from another document,
+                  or repeated within this one).
+        """
+        ids, fingerprints = polygon_fingerprints(coordset, self.tolerance)
+        self._remove(source)
+        self._drop_orphans()
+        counts = {"new": 0, "duplicates": 0}
+        if not ids:
+            self.conn.commit()
+            return counts
+
+        _, x, y, offsets = coordset.packed(3)
+        areas = calculate_polygon_areas(x, y, offsets)
+        epsg = resolve_utm_epsg(y, zone, south)
+        now = time.time()
+        for k, (polygon, fingerprint) in enumerate(zip(ids, fingerprints)):
+            a, b = offsets[k], offsets[k + 1]
+            inserted = self.conn.execute(
+                "INSERT OR IGNORE INTO parcels (fingerprint, vertices, area_m2, epsg, x, y, first_seen)"
+                " VALUES (?, ?, ?, ?, ?, ?, ?)",
+                (fingerprint, int(b - a), float(areas[k]), epsg,
+                 np.ascontiguousarray(x[a:b], dtype="<f8").tobytes(),
+                 np.ascontiguousarray(y[a:b], dtype="<f8").tobytes(), now)).rowcount
+            counts["new" if inserted else "duplicates"] += 1
+            self.conn.execute("INSERT INTO occurrences (source, polygon, fingerprint, seen) VALUES (?, ?, ?, ?)",
+                              (source, int(polygon), fingerprint, now))
+        self.conn.commit()
+        return counts
+
+    def remove(self, sources):
+        """Forgets every occurrence in `sources`, and the parcels left without one."""
+        for source in sources:
+            self._remove(source)
+        self._drop_orphans()
+        self.conn.commit()
+
+    def _remove(self, source):
+        self.conn.execute("DELETE FROM occurrences WHERE source = ?", (source,))
+
+    def _drop_orphans(self):
+        self.conn.execute("DELETE FROM parcels WHERE fingerprint NOT IN (SELECT fingerprint FROM occurrences)")
+
+    # --- Queries ---
+    def sources(self, fingerprint):
+        """(source, polygon) pairs where the parcel appears, in the order they were seen."""
+        return [(row["source"], row["polygon"]) for row in self.conn.execute(
+            "SELECT source, polygon FROM occurrences WHERE fingerprint = ? ORDER BY seen, source, polygon",
+            (fingerprint,))]
+
+    def parcels(self, duplicated_only=False):
+        """
+        Iterates the unique parcels as dicts with 'fingerprint', 'vertices',
+        'area_m2', 'epsg', 'x', 'y' (float64 arrays) and 'sources' (list of
+        (source, polygon)), oldest first.
+        """
+        query = ("SELECT p.*, COUNT(DISTINCT o.source) AS n_sources FROM parcels p"
+                 " JOIN occurrences o USING (fingerprint) GROUP BY p.fingerprint")
+        if duplicated_only:
+            query += " HAVING n_sources > 1"
+        query += " ORDER BY p.first_seen, p.fingerprint"
+        for row in self.conn.execute(query).fetchall():
+            yield {
+                "fingerprint": row["fingerprint"],
+                "vertices": row["vertices"],
+                "area_m2": row["area_m2"],
+                "epsg": row["epsg"],
+                "x": np.frombuffer(row["x"], dtype="<f8"),
+                "y": np.frombuffer(row["y"], dtype="<f8"),
+                "sources": self.sources(row["fingerprint"]),
+            }
+
+    def stats(self):
+        row = self.conn.execute(
+            "SELECT (SELECT COUNT(*) FROM parcels) AS parcels, COUNT(*) AS occurrences,"
+            " COUNT(DISTINCT source) AS sources FROM occurrences").fetchone()
+        return dict(row)
+
+    def __repr__(self):
+        stats = self.stats()
+        return (f"ParcelStore({stats['parcels']} unique parcel(s), {stats['occurrences']} occurrence(s) "
+                f"in {stats['sources']} document(s))")
+
+    # --- Export ---
+    def write_kml(self, path, precision=None):
+        """
+        Writes every unique parcel once to a KML/KMZ file, with the documents
+        it appears in as the placemark description.
+
+        Returns:
+            int: Number of placemarks written.
+        """
+        from kml_writer import KMLWriter
+        from coords_2_kml import KML_HEADER, KML_FOOTER
+
+        with KMLWriter(path, KML_HEADER, KML_FOOTER, precision=precision) as kml:
+            for parcel in self.parcels():
+                lons, lats = get_transformer(parcel["epsg"]).transform(parcel["x"], parcel["y"])
+                refs = "\n".join(f"{os.path.basename(source)} (polygon {polygon})"
+                                 for source, polygon in parcel["sources"])
+                kml.write_polygon(f"Parcel {parcel['fingerprint'][:12]}", np.asarray(lons), np.asarray(lats),
+                                  description=f"{parcel['area_m2'] / 10000:.4f} Ha\nFound in:\n{refs}")
+            count = kml.count
+        return count
+
+def update_parcels(db_path, coordsets, removed=(), failed=(), zone=17, south=None, tolerance=None,
+                   kml_path=None, precision=None):
+    """
+    Registers the polygons of the processed documents (a list of
+    (source, CoordinateSet)) in the ParcelStore at `db_path`, forgets the
+    `removed` and `failed` ones and, if `kml_path` is given, rewrites the
+    KML of all unique parcels.
+
+    Returns:
+        dict: Per source, its 'new' and 'duplicates' counts.
+    """
+    with metrics.stage("dedup", file=db_path) as st, ParcelStore(db_path, tolerance) as store:
+        store.remove(list(removed) + list(failed))
+        counts = {source: store.register(source, coordset, zone, south) for source, coordset in coordsets}
+        st.count(new=sum(c["new"] for c in counts.values()),
+                 duplicates=sum(c["duplicates"] for c in counts.values()), parcels=len(store))
+        if kml_path:
+            store.write_kml(kml_path, precision)
+        metrics.report(f"Parcel store '{db_path}': {store}")
+    return counts
+
+
+# --- Command line ---
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Query or export the unique parcels of a parcel store.")
+    parser.add_argument("store", help="SQLite parcel store written by batch --dedup")
+    parser.add_argument("--kml", default=None, help="Write every unique parcel once to this KML/KMZ")
+    parser.add_argument("--precision", type=int, default=None, help="Decimal places of the KML coordinates")
+    parser.add_argument("--duplicated", action="store_true",
+                        help="List the parcels found in more than one document")
+    args = parser.parse_args(argv)
+
+    if not os.path.exists(args.store):
+        print(f"No parcel store at '{args.store}'.", file=sys.stderr)
+        return 1
+    with ParcelStore(args.store) as store:
+        print(store)
+        if args.duplicated:
+            for parcel in store.parcels(duplicated_only=True):
+                refs = ", ".join(f"{source}#{polygon}" for source, polygon in parcel["sources"])
+                print(f"{parcel['fingerprint']}  {parcel['area_m2'] / 10000:.4f} Ha  {refs}")
+        if args.kml:
+            print(f"Wrote {store.write_kml(args.kml, args.precision)} parcel(s) to '{args.kml}'")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -2,23 +2,296 @@
 # pip install python-docx -q
 
 import os
+import re
 import sys
-import docx
-import argparse
 
-import numpy as np
-import pandas as pd
-import matplotlib.pyplot as plt
+import metrics
 
-from glob import glob
-from pdf2docx import Converter
+def is_coordinate_row(row_text):
+    """
+    Tells whether a comma-joined table row holds only coordinate numbers.
+
+    Header rows (anything mentioning "ipu", "X" or "Y") are rejected, every
+    non-empty field must be made of digits only, and at least two fields
+    must be filled (a lone number such as a page number is not a vertex).
+
+    Args:
+        row_text (str): The row cells joined with ','.
 
-def read_docx_with_tables(filepath):
+    Returns:
+        bool: True if the row is a coordinate row.
+    """
+    if ("ipu" in row_text) or ("X" in row_text) or ("Y" in row_text):
+        return False
+
+    filled = 0
+    for field in row_text.split(','):
+        # Remove leading/trailing whitespace for robustness
+        trimmed_field = field.strip()
+        # Check if the field is NOT empty AND contains anything other than digits
+        if trimmed_field != '' and not trimmed_field.isdecimal():
+            return False # Found an invalid field, no need to check the rest of the line
+        if trimmed_field != '':
+            filled += 1
+    return filled >= 2
+
+# --- Fallback for cells holding runs of space-separated coordinates ---
+# Whitespace-separated plain or decimal numbers, e.g. "532137 532140.5 532150"
+NUMBER_RUN = re.compile(r"\s*\d+(?:\.\d+)?(?:\s+\d+(?:\.\d+)?)*\s*")
+
+# UTM magnitudes in meters when no header says otherwise: 6-digit
+# eastings, 7-digit northings
+EASTING_RANGE = (1e5, 1e6)
+NORTHING_RANGE = (1e6, 1e7)
+OTHER, EASTING, NORTHING, POINT = 0, 1, 2, 3
+KIND_NAMES = {EASTING: "easting", NORTHING: "northing"}
+
+def pair_coordinate_runs(cells, x_columns=(), y_columns=()):
+    """
+    Pairs eastings and northings from cells that hold many coordinates each,
+    such as a row ['532137 532140 532150', '9892120 9892130 9892140'].
+
+    All cells are tokenized together and every value is classified with
+    NumPy. Under an X or Y header column, 5 to 7-digit values are eastings
+    or northings by that header, since northings near the equator (e.g.
+    120000 in zone 17N) have as many digits as eastings. Elsewhere, and in
+    cells that already mix both magnitudes, 6-digit values are eastings and
+    7-digit values are northings. Small integers are point numbers. Runs
+    are then paired:
+
+    1. A cell holding as many eastings as northings is paired on its own
+       (interleaved "x y x y" or "x x y y").
+    2. Within a row, easting and northing runs of the same length are
+       paired, those under the X / Y header columns first.
+    3. Leftover runs are paired with the next opposite run of the same
+       length in document order (an X row followed by a Y row).
+
+    Args:
+        cells (list): (table_index, row_index, column, text) of the
+                      candidate cells, in document order.
+        x_columns, y_columns (set): (table_index, column) of the cells
+                                    holding the X / Y headers.
+
+    Returns:
+        tuple: (rows, unpaired). rows are [point, x, y] string lists in
+               document order. unpaired lists the easting/northing runs that
+               found no partner, as dicts with 'table', 'row', 'column',
+               'kind' and 'count'. Nothing is raised for malformed input.
+    """
+    import numpy as np
+
+    tokens = [tok for cell in cells for tok in cell[3].split()]
+    if not tokens:
+        return [], []
+    counts = np.array([len(cell[3].split()) for cell in cells], dtype=np.int64)
+    values = np.array(tokens, dtype=np.float64)
+    cell_of = np.repeat(np.arange(len(cells)), counts)
+
+    kind = np.full(len(values), OTHER, dtype=np.int64)
+    kind[(values >= EASTING_RANGE[0]) & (values < EASTING_RANGE[1])] = EASTING
+    kind[(values >= NORTHING_RANGE[0]) & (values < NORTHING_RANGE[1])] = NORTHING
+    kind[(values < 1e4) & (values == np.floor(values))] = POINT
+
+    # The header column decides, unless the cell interleaves both kinds
+    header = np.array([EASTING if (table, column) in x_columns else
+                       NORTHING if (table, column) in y_columns else OTHER
+                       for table, _, column, _ in cells], dtype=np.int64)
+    mixed = ((np.bincount(cell_of, kind == EASTING, len(cells)) > 0)
+             & (np.bincount(cell_of, kind == NORTHING, len(cells)) > 0))
+    by_header = (header[cell_of] != OTHER) & ~mixed[cell_of] & (values >= 1e4) & (values < 1e7)
+    kind[by_header] = header[cell_of][by_header]
+
+    # One run per (cell, kind): the token indices of that kind, in order
+    order = np.lexsort((np.arange(len(values)), kind, cell_of))
+    keys = cell_of[order] * 4 + kind[order]
+    runs = {}
+    for group in np.split(order, np.flatnonzero(np.diff(keys)) + 1):
+        runs[(int(cell_of[group[0]]), int(kind[group[0]]))] = group
+
+    pairs = [] # (easting cell, easting tokens, northing tokens, point tokens or None)
+    used = set()
+
+    def point_run(cell_indices, n):
+        # A run of point numbers of the same length in the same row, if any
+        for c in cell_indices:
+            ids = runs.get((c, POINT))
+            if ids is not None and len(ids) == n:
+                return ids
+        return None
+
+    def add_pair(e_cell, n_cell, row_cells):
+        e, n = runs[(e_cell, EASTING)], runs[(n_cell, NORTHING)]
+        pairs.append((e_cell, e, n, point_run(row_cells, len(e))))
+        used.update({(e_cell, EASTING), (n_cell, NORTHING)})
+
+    # Cells of each row, for pairing within rows
+    by_row = {}
+    for c, (table, row, column, _) in enumerate(cells):
+        by_row.setdefault((table, row), []).append(c)
+
+    for row_cells in by_row.values():
+        # 1. Self-contained cells
+        for c in row_cells:
+            e, n = runs.get((c, EASTING)), runs.get((c, NORTHING))
+            if e is not None and n is not None and len(e) == len(n):
+                add_pair(c, c, row_cells)
+
+        # 2. Easting and northing runs of the same row, by header then by order
+        e_cells = [c for c in row_cells if (c, EASTING) in runs and (c, EASTING) not in used]
+        n_cells = [c for c in row_cells if (c, NORTHING) in runs and (c, NORTHING) not in used]
+        for prefer_headers in (True, False):
+            for ec in list(e_cells):
+                for nc in n_cells:
+                    if len(runs[(ec, EASTING)]) != len(runs[(nc, NORTHING)]):
+                        continue
+                    if prefer_headers and not ((cells[ec][0], cells[ec][2]) in x_columns
+                                               and (cells[nc][0], cells[nc][2]) in y_columns):
+                        continue
+                    add_pair(ec, nc, row_cells)
+                    e_cells.remove(ec)
+                    n_cells.remove(nc)
+                    break
+
+    # 3. Leftovers across rows, in document order
+    pending = {EASTING: [], NORTHING: []}
+    for c in range(len(cells)):
+        for k, other in ((EASTING, NORTHING), (NORTHING, EASTING)):
+            if (c, k) not in runs or (c, k) in used:
+                continue
+            size = len(runs[(c, k)])
+            match = next((p for p in pending[other] if len(runs[(p, other)]) == size), None)
+            if match is None:
+                pending[k].append(c)
+                continue
+            pending[other].remove(match)
+            e_cell, n_cell = (c, match) if k == EASTING else (match, c)
+            add_pair(e_cell, n_cell, [e_cell])
+
+    unpaired = [{"table": cells[c][0], "row": cells[c][1], "column": cells[c][2],
+                 "kind": KIND_NAMES[k], "count": len(runs[(c, k)])}
+                for k in (EASTING, NORTHING) for c in pending[k]]
+
+    rows = []
+    next_point = 1
+    for _, e, n, ids in sorted(pairs, key=lambda p: (p[0], p[1][0])):
+        for i in range(len(e)):
+            point = tokens[ids[i]] if ids is not None else str(next_point)
+            rows.append([point, tokens[e[i]], tokens[n[i]]])
+            next_point += 1
+    return rows, unpaired
+
+# WordprocessingML tags used by the streaming table reader
+W_NS = "{http://schemas.openxmlformats.org/wordprocessingml/2006/main}"
+W_TBL, W_TR, W_TC, W_P = W_NS + "tbl", W_NS + "tr", W_NS + "tc", W_NS + "p"
+
+def _paragraph_text(p):
+    # Same rules as python-docx Paragraph.text for the elements we care about
+    parts = []
+    for el in p.iter(W_NS + "t", W_NS + "tab", W_NS + "br", W_NS + "cr"):
+        if el.tag == W_NS + "t":
+            parts.append(el.text or "")
+        elif el.tag == W_NS + "tab":
+            parts.append("\t")
+        else:
+            parts.append("\n")
+    return "".join(parts)
+
+def _discard(el):
+    # Free an element and everything parsed before it at the same level
+    el.clear()
+    while el.getprevious() is not None:
+        del el.getparent()[0]
+
+def iter_docx_table_rows(filepath):
+    """
+    Streams the rows of every top-level table in a .docx file.
+
+    The body XML (word/document.xml) is parsed incrementally with lxml and
+    each row is discarded once yielded, so memory stays flat no matter how
+    many tables the document has. Cells follow python-docx's row.cells
+    semantics: a horizontally merged cell is repeated once per grid column
+    it spans, and a vertically merged continuation repeats the cell above.
+
+    Args:
+        filepath (str): The path to the .docx file.
+
+    Yields:
+        tuple: (table_index, cells) where cells is a list of the raw cell
+               texts (paragraphs joined by newlines, like cell.text).
+    """
+    import zipfile
+    from lxml import etree
+
+    with zipfile.ZipFile(filepath) as zf, zf.open("word/document.xml") as xml:
+        depth = 0 # Table nesting level; only top-level tables are read
+        table_index = -1
+        above = {} # grid column -> text, for vertically merged cells
+        for event, el in etree.iterparse(xml, events=("start", "end"), tag=(W_TBL, W_TR, W_P)):
+            if el.tag == W_TBL:
+                if event == "start":
+                    depth += 1
+                    if depth == 1:
+                        table_index += 1
+                        above = {}
+                else:
+                    depth -= 1
+                    if depth == 0:
+                        _discard(el)
+                continue
+
+            if event == "start":
+                continue
+
+            if el.tag == W_P:
+                if depth == 0:
+                    _discard(el) # Body paragraphs are not needed
+                continue
+
+            if depth != 1:
+                continue
+
+            cells = []
+            col = 0
+            for tc in el.iterchildren(W_TC):
+                span = 1
+                vmerge = None
+                tc_pr = tc.find(W_NS + "tcPr")
+                if tc_pr is not None:
+                    grid_span = tc_pr.find(W_NS + "gridSpan")
+                    if grid_span is not None:
+                        span = int(grid_span.get(W_NS + "val", "1"))
+                    v_merge = tc_pr.find(W_NS + "vMerge")
+                    if v_merge is not None:
+                        vmerge = v_merge.get(W_NS + "val", "continue")
+
+                if vmerge == "continue":
+                    text = above.get(col, "")
+                else:
+                    text = "\n".join(_paragraph_text(p) for p in tc.iterchildren(W_P))
+                for c in range(col, col + span):
+                    above[c] = text
+                    cells.append(text)
+                col += span
+
+            yield table_index, cells
+
+            _discard(el)
+
+def read_docx_with_tables(filepath, columnar=False):
     """
     Reads text content from a .docx file, including paragraphs and tables.
 
+    The tables are read in a single streaming pass (see iter_docx_table_rows):
+    coordinate rows are classified and the numeric cells needed by the
+    space-separated fallback are collected at the same time.
+
     Args:
         filepath (str): The path to the .docx file.
+        columnar (bool, optional): Parse the coordinate rows straight into a
+                                   coordset.CoordinateSet instead of lists of
+                                   strings. The joined text is not built in
+                                   this mode (the first element is None on
+                                   success; use CoordinateSet.to_text()).
 
     Returns:
         str: The extracted text content from paragraphs and tables,
@@ -27,141 +300,166 @@ def read_docx_with_tables(filepath):
              Returns None if the file cannot be read or doesn't exist.
     """
     if not os.path.exists(filepath):
-        print(f"Error: File not found at {filepath}")
+        metrics.report(f"Error: File not found at {filepath}", event="docx_coords.failed",
+                       file=filepath, reason="not_found")
         return None
     if not filepath.lower().endswith('.docx'):
-        print(f"Error: File {filepath} is not a .docx file.")
+        metrics.report(f"Error: File {filepath} is not a .docx file.")
         return None
 
+    return read_table_rows(iter_docx_table_rows(filepath), filepath, columnar)
+
+def read_table_rows(rows, source=None, columnar=False, stage="docx_coords"):
+    """
+    Classifies table rows exactly like read_docx_with_tables, from any
+    iterable of (table_index, cells) such as iter_docx_table_rows yields.
+
+    Lets a document arrive in pieces (e.g. the DOCX fragments of a
+    page-windowed conversion) while still being read as one: headers seen
+    in an early piece count for coordinate rows in later ones.
+
+    Args:
+        rows (iterable): (table_index, cells) tuples.
+        source (str, optional): Name of the document, for metrics.
+        columnar (bool, optional): See read_docx_with_tables.
+        stage (str, optional): Metrics stage name. Defaults to "docx_coords".
+
+    Returns:
+        tuple: Same as read_docx_with_tables.
+    """
+    with metrics.stage(stage, file=source) as st:
+        result = _read_docx_with_tables(rows, st, columnar)
+        if result[1] is None:
+            st.fail("no_coordinates" if result[0] == "" else "read_error")
+        else:
+            st.count(coords=len(result[1]))
+        return result
+
+def _read_docx_with_tables(rows, st, columnar=False):
     try:
-        doc = docx.Document(filepath)
         full_content = []
         base = []
-        coords = []
+        if columnar:
+            from coordset import CoordinateSet, CoordinateSetBuilder
+            coords = CoordinateSetBuilder()
+        else:
+            coords = []
 
         utmx = 0
         utmy = 0
+        n_tables = 0
+        n_coords = 0 # Coordinate rows seen (the builder may drop malformed ones)
+        x_columns = set() # (table, column) of the X / Y headers, for the fallback
+        y_columns = set()
+
+        n_rows = 0
+        row_in_table = 0
+        for table_index, cells in rows:
+            row_in_table = row_in_table + 1 if table_index + 1 == n_tables else 1
+            n_tables = table_index + 1
+            n_rows += 1
+            row_cells = []
+            for column, raw_text in enumerate(cells):
+                # Clean up cell text (replace newlines within a cell with spaces)
+                cell_text = raw_text.replace('\n', ' ').strip()
+                row_cells.append(cell_text)
+
+                if "X" in cell_text:
+                    utmx+=1
+                    x_columns.add((table_index, column))
+                elif "Y" in cell_text:
+                    utmy+=1
+                    y_columns.add((table_index, column))
+
+                # Candidates for the space-separated fallback below; they are
+                # only needed while no clean coordinate row has been seen
+                if not n_coords and NUMBER_RUN.fullmatch(cell_text):
+                    base.append((table_index, row_in_table, column, cell_text))
+
+            # Join cells of a row with a comma for basic structure
+            row_text = ",".join(row_cells)
+            if is_coordinate_row(row_text):
+                if not columnar:
+                    full_content.append(row_text)
+                coords.append(row_cells)
+                n_coords += 1
+
+        metrics.report(f"Found {n_tables} table(s).")
+        st.count(tables=n_tables, rows=n_rows)
 
-        # Iterate through paragraphs and tables in document order (approximately)
-        # The Document object stores paragraphs and tables separately.
-        # A more complex approach involves parsing the underlying XML (_body._element.xpath('.//w:p | .//w:tbl'))
-        # to get perfect order, but iterating through them separately is often sufficient.
-
-        # print("Reading paragraphs...")
-        for para in doc.paragraphs:
-            if para.text.strip(): # Add non-empty paragraphs
-                 # full_content.append(para.text)
-                 pass
-
-        print(f"Found {len(doc.tables)} table(s). Reading tables...")
-        for i, table in enumerate(doc.tables):
-            # print(f"  Reading Table {i+1}...")
-            # full_content.append(f"--- Table {i+1} Start ---")
-            for row in table.rows:
-                row_cells = []
-                for cell in row.cells:
-                    # Clean up cell text (replace newlines within a cell with spaces)
-                    # print(cell.text)
-                    cell_text = cell.text.replace('\n', ' ').strip()
-                    # print(cell_text)
-                    row_cells.append(cell_text)
-                    
-                    if "X" in cell_text:utmx+=1
-                    elif "Y" in cell_text:utmy+=1
-
-                # Join cells of a row with a Tab character for basic structure
-                # row_text = "\t|\t".join(row_cells)
-                row_text = ",".join(row_cells)
-                # print(row_text)
-                if (
-                    ("ipu" not in row_text) 
-                    and ("X" not in row_text)
-                    and ("Y" not in row_text)
-                ):
-                    is_valid = True
-                    fields = row_text.split(',')
-
-                    for field in fields:
-                        # Remove leading/trailing whitespace for robustness
-                        trimmed_field = field.strip()
-                        # Check if the field is NOT empty AND contains anything other than digits
-                        if trimmed_field != '' and not trimmed_field.isdecimal():
-                            is_valid = False
-                            break # Found an invalid field, no need to check the rest of the line
-                    
-                    if is_valid:
-                        full_content.append(row_text)
-                        coords.append(row_cells)
-                        ### print(row_cells)
-                        # print(row_text)
-                        
-                # print()
-                # full_content.append("\t|\t".join(row_cells))
-            # full_content.append(f"--- Table {i+1} End ---")
-        
         if utmx==0 and utmy==0:
-            print("❌ No se encontraron coordenadas en el documento.")
-            return "", []
+            metrics.report("❌ No se encontraron coordenadas en el documento.")
+            return "", CoordinateSet.empty() if columnar else []
         else:
-            print("✅ Se encontraron coordenadas en el documento.")
-
-        if len(coords)==0:
-            for i, table in enumerate(doc.tables):
-                print(f"  Reading Table {i+1}...")
-                # full_content.append(f"--- Table {i+1} Start ---")
-                for row in table.rows:
-                    for cell in row.cells:
-                        cell_text0 = cell.text.replace(' ', '').strip()
-                        cell_text = cell.text.strip()
-                        is_num = cell_text0.isnumeric()
-                        # print(cell.text)
-                        if (is_num 
-                            #and cell_text.count(" ")>=2
-                            ):
-                            # print(cell.text)
-                            base.append(cell.text)
-        
-            idx_2 = base.index("2")
-            # display(base)
-            # print()
-            base2 = [i for i in base[:idx_2] if len(i.split(" ")[0])>=6]
-            # display(base2)
-            n_b = len(base2)
-
-            cont = 1
-            for i in range(0, n_b, 2):
-                c_c = base2[i]
-                c_d = base2[i+1]
-
-                datax = c_c.split(" ")
-                datay = c_d.split(" ")
-
-                for i, dx in enumerate(datax):
-                    coords.append([cont,dx,datay[i]])
-                    full_content.append(f"{cont},{dx},{datay[i]}")
-                    cont+=1
-
-            # print(n_b)
-            # print(coords)
+            metrics.report("✅ Se encontraron coordenadas en el documento.")
+
+        if n_coords==0:
+            # Cells with runs of space-separated values, e.g. "532137 532140"
+            pairs, unpaired = pair_coordinate_runs(base, x_columns, y_columns)
+            for row in pairs:
+                coords.append(row)
+                if not columnar:
+                    full_content.append(",".join(row))
+            st.count(fallback_points=len(pairs), unpaired_runs=len(unpaired))
+            if unpaired:
+                metrics.report(f"⚠️ Could not pair {len(unpaired)} coordinate run(s): "
+                               + "; ".join(f"{u['count']} {u['kind']}(s) in table {u['table'] + 1}, "
+                                           f"row {u['row']}, column {u['column'] + 1}" for u in unpaired),
+                               event="docx_coords.unpaired", runs=unpaired)
+
             if len(coords)>0:
-                return '\n'.join(full_content), coords
+                return _finish(full_content, coords, columnar)
             else:
-                print("😳 Please, take a look down here.")
+                metrics.report("😳 Please, take a look down here.")
                 return "", None
-            # return full_content, coords
 
         else:
-            return '\n'.join(full_content), coords
+            return _finish(full_content, coords, columnar)
 
     # Catches errors like file not found (if os check fails somehow)
     # or if the file is not a valid docx format (e.g., corrupted, password-protected, or older .doc)
-    except Exception as e:
+    except Exception:
 
         exc_type, exc_obj, exc_tb = sys.exc_info()
         error_l = exc_tb.tb_lineno
         cadena_error = str(exc_type) + " => " + str(exc_obj)
 
         # print(f"Error reading {filepath}: {e}")
-        print(f"Error line: {error_l}")
-        print(f"Error message: {cadena_error}")
+        metrics.report(f"Error line: {error_l}")
+        metrics.report(f"Error message: {cadena_error}")
         return None, None
+
+def _finish(full_content, coords, columnar):
+    if columnar:
+        return None, coords.build()
+    return '\n'.join(full_content), coords
+
+def coords_to_dataframe(coords):
+    """
+    Converts the coordinate rows returned by read_docx_with_tables into a
+    DataFrame of floats with 'x' and 'y' columns, ready for generate_kml.
+
+    Args:
+        coords (list): Rows such as ['1', '532137', '9892120'] or
+                       [1, '532137', '9892120']. Empty cells are ignored;
+                       the last two remaining fields are taken as X and Y.
+
+    Returns:
+        pandas.DataFrame: Columns 'point', 'x' and 'y'. Rows that cannot be
+                          converted to numbers are dropped.
+    """
+    import pandas as pd
+
+    records = []
+    for row in coords or []:
+        fields = [str(f).strip() for f in row if str(f).strip() != '']
+        if len(fields) < 2:
+            continue
+        try:
+            x = float(fields[-2])
+            y = float(fields[-1])
+        except ValueError:
+            continue
+        point = fields[0] if len(fields) >= 3 else str(len(records) + 1)
+        records.append((point, x, y))
+    return pd.DataFrame(records, columns=['point', 'x', 'y'])
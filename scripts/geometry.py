@@ -0,0 +1,411 @@
+import math
+
+import numpy as np
+
+from coordset import CoordinateSet
+from vis import calculate_polygon_areas
+
+import metrics
+
+# Meters per degree of latitude, used to turn a ground tolerance into decimal places
+METERS_PER_DEGREE = 111_320.0
+
+# Edge pairs tested at a time by the self-intersection check
+PAIR_CHUNK = 1 << 22
+
+ORIENTATIONS = ("ccw", "cw", None)
+
+# --- Ring bookkeeping ---
+def _ring_bounds(ring, n_rings):
+    """Start/end (exclusive) positions of each ring in a ring-sorted vertex array."""
+    counts = np.bincount(ring, minlength=n_rings)
+    ends = np.cumsum(counts)
+    return ends - counts, ends, counts
+
+def _neighbors(ring, n_rings):
+    """Previous and next position of every vertex, wrapping around within its ring."""
+    starts, ends, counts = _ring_bounds(ring, n_rings)
+    pos = np.arange(len(ring))
+    prev = pos - 1
+    nxt = pos + 1
+    nonempty = counts > 0
+    prev[starts[nonempty]] = ends[nonempty] - 1
+    nxt[ends[nonempty] - 1] = starts[nonempty]
+    return prev, nxt
+
+def _distance_to_line(px, py, ax, ay, bx, by, clamp):
+    """Distance from P to line AB (or segment AB when `clamp`); |PA| when A == B."""
+    dx = bx - ax
+    dy = by - ay
+    length2 = dx * dx + dy * dy
+    safe = np.where(length2 > 0, length2, 1.0)
+    if clamp:
+        t = np.clip(((px - ax) * dx + (py - ay) * dy) / safe, 0.0, 1.0)
+        dist = np.hypot(px - (ax + t * dx), py - (ay + t * dy))
+    else:
+        dist = np.abs(dx * (py - ay) - dy * (px - ax)) / np.sqrt(safe)
+    return np.where(length2 > 0, dist, np.hypot(px - ax, py - ay))
+
+def _drop(idx, ring, remove, n_rings, min_vertices=3):
+    """Removes the flagged vertices, except in rings that would fall below `min_vertices`."""
+    left = np.bincount(ring[~remove], minlength=n_rings)
+    before = np.bincount(ring, minlength=n_rings)
+    remove = remove & (left >= np.minimum(before, min_vertices))[ring]
+    return idx[~remove], ring[~remove], int(remove.sum())
+
+def segments_intersect(ax, ay, bx, by, cx, cy, dx, dy):
+    """
+    Tests segments AB against segments CD, element-wise with NumPy
+    broadcasting (e.g. AB as a column and CD as a row for all pairs).
+    Touching counts as intersecting; collinear segments do not.
+
+    Returns:
+        numpy.ndarray: bool per broadcast pair.
+    """
+    def orient(px, py, qx, qy, rx, ry):
+        return np.sign((qx - px) * (ry - py) - (qy - py) * (rx - px))
+    o1 = orient(ax, ay, bx, by, cx, cy)
+    o2 = orient(ax, ay, bx, by, dx, dy)
+    o3 = orient(cx, cy, dx, dy, ax, ay)
+    o4 = orient(cx, cy, dx, dy, bx, by)
+    return (o1 * o2 <= 0) & (o3 * o4 <= 0) & ~((o1 == 0) & (o2 == 0))
+
+# --- Cleaning steps (vertex positions are tracked as indices into x/y) ---
+def remove_duplicates(x, y, idx, ring, n_rings, tolerance=0.0):
+    """
+    Drops every vertex closer than `tolerance` (0 = identical) to the one
+    before it in its ring, including the implicit closing edge.
+
+    Returns:
+        tuple: (idx, ring, removed count per ring).
+    """
+    prev, _ = _neighbors(ring, n_rings)
+    starts, ends, counts = _ring_bounds(ring, n_rings)
+    px, py = x[idx], y[idx]
+    close = np.hypot(px - px[prev], py - py[prev]) <= tolerance
+    # The first vertex stays: when it repeats the last one, the last one goes
+    multi = counts > 1
+    close[ends[multi] - 1] |= close[starts[multi]]
+    close[starts[counts > 0]] = False
+    kept_idx, kept_ring, _ = _drop(idx, ring, close, n_rings)
+    return kept_idx, kept_ring, np.bincount(ring, minlength=n_rings) - np.bincount(kept_ring, minlength=n_rings)
+
+def remove_collinear(x, y, idx, ring, n_rings, tolerance):
+    """
+    Drops vertices lying within `tolerance` of the line through their
+    neighbours (including spikes that double back on themselves).
+
+    Each pass removes every other vertex of a run of flagged neighbours,
+    so a long straight run shrinks geometrically instead of one vertex per
+    pass, and two removed vertices are never adjacent.
+
+    Returns:
+        tuple: (idx, ring, removed count per ring).
+    """
+    before = np.bincount(ring, minlength=n_rings)
+    while len(idx):
+        prev, nxt = _neighbors(ring, n_rings)
+        starts, _, _ = _ring_bounds(ring, n_rings)
+        px, py = x[idx], y[idx]
+        flagged = _distance_to_line(px, py, px[prev], py[prev], px[nxt], py[nxt], clamp=False) <= tolerance
+        flagged &= np.bincount(ring, minlength=n_rings)[ring] > 3
+        if not flagged.any():
+            break
+        is_start = np.zeros(len(idx), dtype=bool)
+        is_start[starts[starts < len(idx)]] = True
+        run_start = flagged & (~flagged[prev] | is_start)
+        first = np.maximum.accumulate(np.where(run_start, np.arange(len(idx)), 0))
+        remove = flagged & ((np.arange(len(idx)) - first) % 2 == 0)
+        remove &= ~remove[prev] # A run wrapping around the ring start
+        idx, ring, dropped = _drop(idx, ring, remove, n_rings)
+        if not dropped:
+            break
+    return idx, ring, before - np.bincount(ring, minlength=n_rings)
+
+def simplify(x, y, idx, ring, n_rings, tolerance):
+    """
+    Douglas–Peucker simplification of every ring at once, `tolerance` in
+    coordinate units (meters for UTM).
+
+    Each ring is anchored at its first vertex and the vertex farthest from
+    it. Every pass then finds, for all open segments of all rings together,
+    the vertex farthest from its segment and keeps it if it lies beyond
+    `tolerance`; rings are never reduced below 3 vertices.
+
+    Returns:
+        tuple: (idx, ring, removed count per ring).
+    """
+    n = len(idx)
+    before = np.bincount(ring, minlength=n_rings)
+    if n == 0:
+        return idx, ring, before
+    starts, ends, counts = _ring_bounds(ring, n_rings)
+    nonempty = counts > 0
+    px, py = x[idx], y[idx]
+
+    keep = np.zeros(n, dtype=bool)
+    keep[starts[nonempty]] = True
+    far = np.hypot(px - px[starts[ring]], py - py[starts[ring]])
+    far_max = np.maximum.reduceat(far, starts[nonempty])
+    keep[np.minimum.reduceat(np.where(far == np.repeat(far_max, counts[nonempty]), np.arange(n), n),
+                             starts[nonempty])] = True
+
+    # Only vertices of segments that may still be split take part in a pass
+    active = ~keep
+    while active.any():
+        act = np.flatnonzero(active)
+        kept_pos = np.flatnonzero(keep)
+        # The vertices between two kept ones are contiguous; the ring start is
+        # always kept, so a segment never spans two rings
+        segment = np.searchsorted(kept_pos, act, side="right") - 1
+        prev_kept = kept_pos[segment]
+        next_kept = np.append(kept_pos[1:], n)[segment]
+        act_ring = ring[act]
+        next_kept = np.where(next_kept >= ends[act_ring], starts[act_ring], next_kept)
+        dist = _distance_to_line(px[act], py[act], px[prev_kept], py[prev_kept],
+                                 px[next_kept], py[next_kept], clamp=True)
+
+        # Farthest vertex of each segment
+        new_segment = np.ones(len(act), dtype=bool)
+        new_segment[1:] = segment[1:] != segment[:-1]
+        seg_first = np.flatnonzero(new_segment)
+        group = np.cumsum(new_segment) - 1
+        seg_max = np.maximum.reduceat(dist, seg_first)
+        farthest = act[np.minimum.reduceat(np.where(dist == seg_max[group], np.arange(len(act)), len(act)),
+                                           seg_first)]
+        kept_per_ring = np.bincount(ring[keep], minlength=n_rings)
+        threshold = np.where(kept_per_ring < np.minimum(counts, 3), -0.5, tolerance)
+        seg_ring = act_ring[seg_first]
+        split = seg_max > threshold[seg_ring]
+        forced = threshold[seg_ring] < 0
+        if forced.any():
+            # Short rings only need one more vertex, not one per segment
+            short = np.flatnonzero(split & forced)
+            short = short[np.lexsort((-seg_max[short], seg_ring[short]))]
+            split[short] = False
+            split[short[np.unique(seg_ring[short], return_index=True)[1]]] = True
+        if not split.any():
+            break
+        keep[farthest[split]] = True
+        active[farthest[split]] = False
+        active[act[~(split | forced)[group]]] = False # Within tolerance: final
+    kept_idx, kept_ring = idx[keep], ring[keep]
+    return kept_idx, kept_ring, before - np.bincount(kept_ring, minlength=n_rings)
+
+def orient_rings(x, y, idx, ring, n_rings, orientation="ccw"):
+    """
+    Reverses the rings that do not wind in `orientation` ('ccw' or 'cw'),
+    keeping their first vertex in place.
+
+    Returns:
+        tuple: (idx, reversed flag per ring).
+    """
+    starts, ends, counts = _ring_bounds(ring, n_rings)
+    offsets = np.concatenate([[0], ends])
+    signed = calculate_polygon_areas(x[idx], y[idx], offsets, signed=True)
+    flip = signed < 0 if orientation == "ccw" else signed > 0
+    if not flip.any():
+        return idx, flip
+    local = np.arange(len(idx)) - starts[ring]
+    source = np.where(flip[ring], starts[ring] + (counts[ring] - local) % counts[ring], np.arange(len(idx)))
+    return idx[source], flip
+
+def find_self_intersections(x, y, offsets, chunk=PAIR_CHUNK):
+    """
+    Flags the rings in which two non-adjacent edges touch or cross.
+
+    Each ring is covered by a grid of about one cell per edge, and only edges
+    sharing a cell are tested, so the cost follows the number of nearby edge
+    pairs rather than the square of the ring size. Candidate pairs are tested
+    `chunk` at a time to bound memory.
+
+    Args:
+        x, y (array-like): Open rings (no repeated closing vertex).
+        offsets (array-like): Ring boundaries.
+
+    Returns:
+        numpy.ndarray: bool per ring.
+    """
+    x = np.asarray(x, dtype=np.float64)
+    y = np.asarray(y, dtype=np.float64)
+    offsets = np.asarray(offsets, dtype=np.int64)
+    counts = np.diff(offsets)
+    n_rings = len(counts)
+    bad = np.zeros(n_rings, dtype=bool)
+    if len(x) == 0:
+        return bad
+    ring = np.repeat(np.arange(n_rings), counts)
+    _, nxt = _neighbors(ring, n_rings)
+    starts = offsets[:-1][counts > 0]
+
+    # Edge boxes, in grid cells of the ring's bounding box split ~sqrt(m) ways
+    xmin = np.minimum(x, x[nxt])
+    xmax = np.maximum(x, x[nxt])
+    ymin = np.minimum(y, y[nxt])
+    ymax = np.maximum(y, y[nxt])
+    ox = np.minimum.reduceat(xmin, starts)
+    oy = np.minimum.reduceat(ymin, starts)
+    extent = np.maximum(np.maximum.reduceat(xmax, starts) - ox, np.maximum.reduceat(ymax, starts) - oy)
+    size = np.zeros(n_rings)
+    size[counts > 0] = extent / np.ceil(np.sqrt(counts[counts > 0]))
+    origin_x = np.zeros(n_rings)
+    origin_y = np.zeros(n_rings)
+    origin_x[counts > 0] = ox
+    origin_y[counts > 0] = oy
+    cell = np.where(size > 0, size, 1.0)[ring]
+    cx0 = np.floor((xmin - origin_x[ring]) / cell).astype(np.int64)
+    cy0 = np.floor((ymin - origin_y[ring]) / cell).astype(np.int64)
+    ncx = np.floor((xmax - origin_x[ring]) / cell).astype(np.int64) - cx0 + 1
+    ncy = np.floor((ymax - origin_y[ring]) / cell).astype(np.int64) - cy0 + 1
+
+    # One (ring, cell) key per cell each edge touches, grouped by sorting
+    per_edge = ncx * ncy
+    edge = np.repeat(np.arange(len(x)), per_edge)
+    j = np.arange(len(edge)) - np.repeat(np.cumsum(per_edge) - per_edge, per_edge)
+    kx = cx0[edge] + j % ncx[edge]
+    ky = cy0[edge] + j // ncx[edge]
+    order = np.lexsort((ky, kx, ring[edge]))
+    edge, kx, ky = edge[order], kx[order], ky[order]
+    new_group = np.ones(len(edge), dtype=bool)
+    new_group[1:] = (kx[1:] != kx[:-1]) | (ky[1:] != ky[:-1]) | (ring[edge[1:]] != ring[edge[:-1]])
+    group_start = np.flatnonzero(new_group)
+    group_end = np.append(group_start[1:], len(edge))
+
+    # Every member pairs with the members after it in its cell
+    partners = np.repeat(group_end, group_end - group_start) - np.arange(len(edge)) - 1
+    cum = np.concatenate([[0], np.cumsum(partners)])
+    for lo in range(0, int(cum[-1]), chunk):
+        k = np.arange(lo, min(lo + chunk, int(cum[-1])))
+        p = np.searchsorted(cum, k, side="right") - 1
+        a = edge[p]
+        b = edge[p + 1 + (k - cum[p])]
+        pair = (b != a) & (nxt[a] != b) & (nxt[b] != a) & ~bad[ring[a]]
+        a, b = a[pair], b[pair]
+        hit = segments_intersect(x[a], y[a], x[nxt[a]], y[nxt[a]],
+                                 x[b], y[b], x[nxt[b]], y[nxt[b]])
+        bad[ring[a[hit]]] = True
+    return bad
+
+def precision_for_tolerance(meters):
+    """Decimal places of degrees needed to resolve `meters` on the ground (at least 0)."""
+    return max(0, math.ceil(-math.log10(meters / METERS_PER_DEGREE)))
+
+
+# --- Cleaning stage ---
+def clean_polygons(coordset, duplicate_tolerance=0.0, collinear_tolerance=0.001,
+                   simplify_tolerance=None, orientation="ccw", quantize=None):
+    """
+    Cleans the polygons of a CoordinateSet before export: snaps coordinates
+    to a grid, removes duplicate and collinear vertices, optionally
+    simplifies with Douglas–Peucker and normalizes the ring orientation.
+    Every step works on all polygons at once.
+
+    Tolerances are in coordinate units (meters for UTM). Polygons that were
+    closed (last vertex repeating the first) are closed again afterwards;
+    polygons with fewer than 3 vertices are passed through untouched.
+
+    Args:
+        coordset (CoordinateSet): Extracted polygons.
+        duplicate_tolerance (float, optional): Consecutive vertices at most
+                                               this far apart are merged.
+                                               Defaults to 0.0 (identical).
+        collinear_tolerance (float, optional): Vertices at most this far from
+                                               the line through their
+                                               neighbours are dropped; None
+                                               keeps them. Defaults to 0.001.
+        simplify_tolerance (float, optional): Douglas–Peucker tolerance.
+                                              Defaults to None (off).
+        orientation (str, optional): 'ccw' (default, exterior rings as in
+                                     OGC/GeoJSON), 'cw', or None to keep.
+        quantize (float, optional): Grid size the coordinates are rounded
+                                    to. Defaults to None.
+
+    Returns:
+        tuple: (CoordinateSet, report). report is a DataFrame with one row per
+               polygon: vertices_in, duplicates, collinear, simplified,
+               vertices_out, reversed, area_in_m2, area_out_m2, valid and
+               issue ('', 'too_few_vertices', 'zero_area' or
+               'self_intersection').
+    """
+    if orientation not in ORIENTATIONS:
+        raise ValueError(f"orientation must be one of {ORIENTATIONS}, got {orientation!r}")
+    with metrics.stage("geometry") as st:
+        cleaned, report = _clean_polygons(coordset, duplicate_tolerance, collinear_tolerance,
+                                          simplify_tolerance, orientation, quantize)
+        st.count(polygons=len(report), vertices_in=len(coordset), vertices_out=len(cleaned),
+                 reversed=int(report["reversed"].sum()), invalid=int((~report["valid"]).sum()))
+    return cleaned, report
+
+def _clean_polygons(coordset, duplicate_tolerance, collinear_tolerance, simplify_tolerance,
+                    orientation, quantize):
+    import pandas as pd
+
+    x, y, offsets = coordset.x, coordset.y, coordset.offsets
+    if quantize:
+        x = np.round(x / quantize) * quantize
+        y = np.round(y / quantize) * quantize
+    n_rings = coordset.n_polygons
+    counts_in = np.diff(offsets)
+    ring_of = np.repeat(np.arange(n_rings), counts_in)
+    starts_in = offsets[:-1]
+
+    # Work on open rings; the closing vertex is put back at the end
+    closed = np.zeros(n_rings, dtype=bool)
+    multi = counts_in > 1
+    last = offsets[1:][multi] - 1
+    closed[multi] = (x[starts_in[multi]] == x[last]) & (y[starts_in[multi]] == y[last])
+    workable = counts_in - closed >= 3
+    body = np.ones(len(x), dtype=bool)
+    body[offsets[1:][closed] - 1] = False
+    body &= workable[ring_of]
+    idx = np.flatnonzero(body)
+    ring = ring_of[idx]
+
+    zeros = np.zeros(n_rings, dtype=np.int64)
+    idx, ring, duplicates = remove_duplicates(x, y, idx, ring, n_rings, duplicate_tolerance)
+    collinear = zeros
+    if collinear_tolerance is not None:
+        idx, ring, collinear = remove_collinear(x, y, idx, ring, n_rings, collinear_tolerance)
+    simplified = zeros
+    if simplify_tolerance:
+        idx, ring, simplified = simplify(x, y, idx, ring, n_rings, simplify_tolerance)
+    flipped = np.zeros(n_rings, dtype=bool)
+    if orientation:
+        idx, flipped = orient_rings(x, y, idx, ring, n_rings, orientation)
+
+    open_offsets = np.concatenate([[0], np.cumsum(np.bincount(ring, minlength=n_rings))])
+    self_intersecting = find_self_intersections(x[idx], y[idx], open_offsets)
+    area_in = calculate_polygon_areas(coordset.x, coordset.y, offsets)
+    area_out = calculate_polygon_areas(x[idx], y[idx], open_offsets)
+
+    # --- Reassemble: cleaned rings, closed again, and untouched short ones ---
+    passthrough = np.flatnonzero(~workable[ring_of])
+    close_idx = idx[open_offsets[:-1][closed & workable]]
+    sources = np.concatenate([idx, close_idx, passthrough])
+    source_ring = np.concatenate([ring, np.flatnonzero(closed & workable), ring_of[passthrough]])
+    # Stable sort by ring keeps each ring's order, with its closing vertex last
+    order = np.argsort(source_ring, kind="stable")
+    sources = sources[order]
+    counts_out = np.bincount(source_ring, minlength=n_rings)
+    new_offsets = np.concatenate([[0], np.cumsum(counts_out)])
+    cleaned = CoordinateSet(coordset.point_ids[sources], x[sources], y[sources], new_offsets)
+    area_out = np.where(workable, area_out, area_in)
+
+    issue = np.full(n_rings, "", dtype=object)
+    issue[workable & (area_out == 0)] = "zero_area"
+    issue[self_intersecting] = "self_intersection"
+    issue[~workable] = "too_few_vertices"
+    report = pd.DataFrame({
+        "polygon": np.arange(1, n_rings + 1),
+        "vertices_in": counts_in,
+        "duplicates": duplicates,
+        "collinear": collinear,
+        "simplified": simplified,
+        "vertices_out": counts_out,
+        "reversed": flipped,
+        "area_in_m2": area_in,
+        "area_out_m2": area_out,
+        "valid": issue == "",
+        "issue": issue,
+    })
+    return cleaned, report
@@ -0,0 +1,263 @@
+import os
+import json
+import hashlib
+
+import numpy as np
+
+from crs import get_transformer, resolve_utm_epsg
+from vis import calculate_polygon_areas
+
+import metrics
+
+# WKB geometry type codes (ISO, 2D)
+WKB_POINT = 1
+WKB_POLYGON = 3
+
+DEFAULT_ROW_GROUP_SIZE = 50_000
+
+# --- WKB encoding ---
+def close_rings(x, y, offsets):
+    """Repeats the first vertex of every polygon that is not closed (WKB rings must be)."""
+    x = np.asarray(x, dtype=np.float64)
+    y = np.asarray(y, dtype=np.float64)
+    offsets = np.asarray(offsets, dtype=np.int64)
+    starts, ends = offsets[:-1], offsets[1:]
+    nonempty = ends > starts
+    open_ring = np.zeros(len(starts), dtype=bool)
+    open_ring[nonempty] = ((x[starts[nonempty]] != x[ends[nonempty] - 1]) |
+                           (y[starts[nonempty]] != y[ends[nonempty] - 1]))
+    if not open_ring.any():
+        return x, y, offsets
+    at = ends[open_ring]
+    new_x = np.insert(x, at, x[starts[open_ring]])
+    new_y = np.insert(y, at, y[starts[open_ring]])
+    new_offsets = offsets + np.concatenate([[0], np.cumsum(open_ring)])
+    return new_x, new_y, new_offsets
+
+def polygons_to_wkb(x, y, offsets):
+    """
+    Encodes single-ring polygons as little-endian WKB without a Python loop
+    over vertices: every header and coordinate is scattered into one buffer.
+
+    Returns:
+        tuple: (data, value_offsets) where polygon k is
+               data[value_offsets[k]:value_offsets[k+1]] (uint8 / int64 arrays).
+    """
+    counts = np.diff(offsets).astype(np.int64)
+    sizes = 13 + 16 * counts
+    value_offsets = np.zeros(len(counts) + 1, dtype=np.int64)
+    np.cumsum(sizes, out=value_offsets[1:])
+    data = np.zeros(value_offsets[-1], dtype=np.uint8)
+    starts = value_offsets[:-1]
+
+    header = np.zeros((len(counts), 13), dtype=np.uint8)
+    header[:, 0] = 1 # Little endian
+    header[:, 1:5] = np.array([WKB_POLYGON], dtype="<u4").view(np.uint8)
+    header[:, 5:9] = np.array([1], dtype="<u4").view(np.uint8) # One ring
+    header[:, 9:13] = counts.astype("<u4").view(np.uint8).reshape(-1, 4)
+    data[starts[:, None] + np.arange(13)] = header
+
+    xy = np.empty((len(x), 2), dtype="<f8")
+    xy[:, 0] = x
+    xy[:, 1] = y
+    local = np.arange(len(x)) - np.repeat(offsets[:-1], counts)
+    dest = np.repeat(starts + 13, counts) + 16 * local
+    data[dest[:, None] + np.arange(16)] = xy.view(np.uint8).reshape(-1, 16)
+    return data, value_offsets
+
+def points_to_wkb(x, y):
+    """Encodes points as little-endian WKB (21 bytes each). Returns (data, value_offsets)."""
+    n = len(x)
+    record = np.zeros((n, 21), dtype=np.uint8)
+    record[:, 0] = 1
+    record[:, 1:5] = np.array([WKB_POINT], dtype="<u4").view(np.uint8)
+    xy = np.empty((n, 2), dtype="<f8")
+    xy[:, 0] = x
+    xy[:, 1] = y
+    record[:, 5:] = xy.view(np.uint8).reshape(-1, 16)
+    return record.reshape(-1), np.arange(n + 1, dtype=np.int64) * 21
+
+
+# --- Arrow tables ---
+def _require_pyarrow():
+    try:
+        import pyarrow
+        import pyarrow.parquet
+    except ImportError as e:
+        raise ImportError("GeoParquet export needs pyarrow: pip install 'utm-from-pdfs[geoparquet]'") from e
+    return pyarrow
+
+def _binary_array(pa, data, value_offsets):
+    return pa.LargeBinaryArray.from_buffers(pa.large_binary(), len(value_offsets) - 1,
+                                            [None, pa.py_buffer(value_offsets), pa.py_buffer(data)])
+
+def _bbox_array(pa, xmin, ymin, xmax, ymax):
+    return pa.StructArray.from_arrays([pa.array(xmin), pa.array(ymin), pa.array(xmax), pa.array(ymax)],
+                                      names=["xmin", "ymin", "xmax", "ymax"])
+
+def _geo_metadata(geometry_type):
+    # GeoParquet 1.1; no "crs" key means OGC:CRS84 (lon/lat). The bbox
+    # covering column lets readers skip row groups by their statistics.
+    return json.dumps({
+        "version": "1.1.0",
+        "primary_column": "geometry",
+        "columns": {"geometry": {
+            "encoding": "WKB",
+            "geometry_types": [geometry_type],
+            "covering": {"bbox": {"xmin": ["bbox", "xmin"], "ymin": ["bbox", "ymin"],
+                                  "xmax": ["bbox", "xmax"], "ymax": ["bbox", "ymax"]}},
+        }},
+    })
+
+def polygon_table(source, coordset, zone=17, south=None):
+    """
+    Arrow table with one row per polygon of `coordset`: source, polygon
+    number, vertex count, area (m² and Ha, in the UTM plane), source EPSG,
+    WKB geometry in lon/lat and its bounding box.
+    """
+    pa = _require_pyarrow()
+    ids, x, y, offsets = coordset.packed(min_vertices=3)
+    epsg = resolve_utm_epsg(y if len(y) else None, zone, south)
+    areas = calculate_polygon_areas(x, y, offsets)
+    lons, lats = get_transformer(epsg).transform(x, y)
+    lons, lats, closed = close_rings(np.asarray(lons), np.asarray(lats), offsets)
+    data, value_offsets = polygons_to_wkb(lons, lats, closed)
+
+    n = len(ids)
+    starts = closed[:-1]
+    if n:
+        bbox = [np.minimum.reduceat(lons, starts), np.minimum.reduceat(lats, starts),
+                np.maximum.reduceat(lons, starts), np.maximum.reduceat(lats, starts)]
+    else:
+        bbox = [np.empty(0)] * 4
+    return pa.table({
+        "source": pa.array([source] * n, pa.string()),
+        "polygon": pa.array(ids, pa.int32()),
+        "vertices": pa.array(np.diff(offsets), pa.int32()),
+        "area_m2": pa.array(areas),
+        "area_ha": pa.array(areas / 10000.0),
+        "source_epsg": pa.array(np.full(n, epsg), pa.int32()),
+        "geometry": _binary_array(pa, data, value_offsets),
+        "bbox": _bbox_array(pa, *bbox),
+    })
+
+def point_table(source, coordset, zone=17, south=None):
+    """
+    Arrow table with one row per vertex: source, polygon number, point
+    number, the original UTM x/y, source EPSG and a lon/lat WKB point.
+    """
+    pa = _require_pyarrow()
+    x, y = coordset.x, coordset.y
+    epsg = resolve_utm_epsg(y if len(y) else None, zone, south)
+    lons, lats = get_transformer(epsg).transform(x, y)
+    lons, lats = np.asarray(lons, dtype=np.float64), np.asarray(lats, dtype=np.float64)
+    data, value_offsets = points_to_wkb(lons, lats)
+    polygon = np.repeat(np.arange(1, coordset.n_polygons + 1), np.diff(coordset.offsets))
+    n = len(x)
+    return pa.table({
+        "source": pa.array([source] * n, pa.string()),
+        "polygon": pa.array(polygon, pa.int32()),
+        "point": pa.array(coordset.point_ids),
+        "x": pa.array(x),
+        "y": pa.array(y),
+        "source_epsg": pa.array(np.full(n, epsg), pa.int32()),
+        "geometry": _binary_array(pa, data, value_offsets),
+        "bbox": _bbox_array(pa, lons, lats, lons, lats),
+    })
+
+
+# --- Per-source dataset ---
+def part_name(source):
+    """File name of the part holding `source`'s rows (stable across runs)."""
+    return f"part-{hashlib.blake2b(source.encode('utf-8'), digest_size=10).hexdigest()}.parquet"
+
+class GeoParquetDataset:
+    """
+    GeoParquet dataset directory with one part file per source document,
+    in 'polygons/' and (optionally) 'points/'.
+
+    Writing a source replaces its part files, and removing it deletes
+    them, so reruns and modified PDFs never leave stale copies behind and
+    the dataset is updated without rewriting the other documents. Readers
+    such as pyarrow.dataset, GeoPandas or DuckDB open each directory as a
+    single table.
+
+    Args:
+        dataset_dir (str): Root of the dataset.
+        points (bool, optional): Also write one point per vertex. Defaults to True.
+        row_group_size (int, optional): Rows per row group.
+        zone (int, optional): UTM zone of the input. Defaults to 17.
+        south (bool, optional): Hemisphere; None detects it per document.
+    """
+
+    def __init__(self, dataset_dir, points=True, row_group_size=DEFAULT_ROW_GROUP_SIZE,
+                 zone=17, south=None):
+        self.pa = _require_pyarrow()
+        self.dataset_dir = dataset_dir
+        self.row_group_size = row_group_size
+        self.zone = zone
+        self.south = south
+        self.layers = {"polygons": ("Polygon", polygon_table)}
+        if points:
+            self.layers["points"] = ("Point", point_table)
+
+    def path(self, layer, source):
+        return os.path.join(self.dataset_dir, layer, part_name(source))
+
+    def write(self, source, coordset):
+        """
+        Replaces the rows of `source` with the polygons (and points) of
+        `coordset`.
+
+        Returns:
+            dict: Rows written per layer.
+        """
+        pq = self.pa.parquet
+        written = {}
+        for layer, (geometry_type, build) in self.layers.items():
+            table = build(source, coordset, self.zone, self.south)
+            path = self.path(layer, source)
+            written[layer] = table.num_rows
+            if not table.num_rows:
+                self._delete(path)
+                continue
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            table = table.replace_schema_metadata({b"geo": _geo_metadata(geometry_type).encode()})
+            # Written to a hidden file (skipped by dataset readers) and renamed,
+            # so readers never see a partial part
+            tmp = os.path.join(os.path.dirname(path), "." + os.path.basename(path) + ".tmp")
+            pq.write_table(table, tmp, row_group_size=self.row_group_size, compression="zstd")
+            os.replace(tmp, path)
+        return written
+
+    def remove(self, sources):
+        """Deletes the part files of `sources`."""
+        for source in sources:
+            for layer in self.layers:
+                self._delete(self.path(layer, source))
+
+    @staticmethod
+    def _delete(path):
+        if os.path.exists(path):
+            os.remove(path)
+
+def write_geoparquet(dataset_dir, items, removed=(), points=True, zone=17, south=None,
+                     row_group_size=DEFAULT_ROW_GROUP_SIZE):
+    """
+    Writes (source, CoordinateSet) pairs to the GeoParquet dataset at
+    `dataset_dir`, replacing earlier rows of the same sources, and deletes
+    the rows of the `removed` sources.
+
+    Returns:
+        dict: Rows written per layer ('polygons', 'points').
+    """
+    with metrics.stage("geoparquet", file=dataset_dir) as st:
+        dataset = GeoParquetDataset(dataset_dir, points, row_group_size, zone, south)
+        dataset.remove(removed)
+        written = dict.fromkeys(dataset.layers, 0)
+        for source, coordset in items:
+            for layer, rows in dataset.write(source, coordset).items():
+                written[layer] += rows
+        st.count(removed=len(removed), **written)
+    metrics.report(f"GeoParquet dataset '{dataset_dir}': wrote {written}, removed {len(removed)} source(s)")
+    return written
@@ -0,0 +1,154 @@
+import os
+import json
+import time
+import sqlite3
+
+from cache import PARSER_VERSION, file_sha256
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS sources (
+    path TEXT PRIMARY KEY,
+    size INTEGER NOT NULL,
+    mtime_ns INTEGER NOT NULL,
+    sha256 TEXT NOT NULL,
+    options TEXT NOT NULL,
+    status TEXT NOT NULL,
+    error TEXT,
+    engine TEXT,
+    docx TEXT,
+    kml TEXT,
+    points INTEGER,
+    polygons INTEGER,
+    timings TEXT,
+    processed_at REAL NOT NULL
+)
+"""
+
+def options_key(**options):
+    """Fingerprint of the pipeline settings; results made with other settings are redone."""
+    return json.dumps(dict(options, parser=PARSER_VERSION), sort_keys=True)
+
+
+class SourceManifest:
+    """
+    SQLite record of every PDF the batch has processed: its size, mtime,
+    content hash, the pipeline settings used and the outputs it produced.
+
+    A file is considered unchanged while its size and mtime match, so a
+    scan of an unchanged tree costs one stat per file. The content is only
+    hashed when the stat differs, and a file whose bytes did not change
+    (a copy or a touch) is not reprocessed.
+
+    Args:
+        db_path (str): SQLite database file (created if missing).
+    """
+
+    def __init__(self, db_path):
+        self.db_path = db_path
+        directory = os.path.dirname(db_path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        self.conn = sqlite3.connect(db_path)
+        self.conn.row_factory = sqlite3.Row
+        self.conn.execute("PRAGMA journal_mode=WAL")
+        self.conn.execute(SCHEMA)
+        self.conn.commit()
+
+    def close(self):
+        self.conn.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        self.close()
+
+    def get(self, path):
+        return self.conn.execute("SELECT * FROM sources WHERE path = ?", (path,)).fetchone()
+
+    # --- Change detection ---
+    def plan(self, pdfs, options, retry_failed=False):
+        """
+        Splits `pdfs` into the files that need the pipeline and the rest.
+
+        Args:
+            pdfs (list): Candidate PDF paths.
+            options (str): options_key() of this run.
+            retry_failed (bool, optional): Also redo files whose last run
+                                           failed or timed out.
+
+        Returns:
+            tuple: (todo, unchanged). todo maps each path to schedule to its
+                   (size, mtime_ns, sha256); unchanged is the number skipped.
+        """
+        todo = {}
+        unchanged = 0
+        for path in pdfs:
+            try:
+                st = os.stat(path)
+            except FileNotFoundError:
+                continue # Deleted since the directory was listed
+            row = self.get(path)
+            if row is not None and row["options"] == options and (
+                    row["status"] not in ("failed", "timeout") or not retry_failed):
+                if row["size"] == st.st_size and row["mtime_ns"] == st.st_mtime_ns:
+                    unchanged += 1
+                    continue
+                sha = file_sha256(path)
+                if row["sha256"] == sha:
+                    # Same bytes with a new mtime: just remember the new stat
+                    self.conn.execute("UPDATE sources SET size = ?, mtime_ns = ? WHERE path = ?",
+                                      (st.st_size, st.st_mtime_ns, path))
+                    unchanged += 1
+                    continue
+                todo[path] = (st.st_size, st.st_mtime_ns, sha)
+            else:
+                todo[path] = (st.st_size, st.st_mtime_ns, file_sha256(path))
+        self.conn.commit()
+        return todo, unchanged
+
+    def record(self, result, size, mtime_ns, sha256, options):
+        """
+        Stores the outcome of batch.process_pdf for one file. Outputs of the
+        previous run that this one did not produce again are deleted.
+        """
+        previous = self.get(result["pdf"])
+        self.conn.execute(
+            "INSERT OR REPLACE INTO sources (path, size, mtime_ns, sha256, options, status, error,"
+            " engine, docx, kml, points, polygons, timings, processed_at)"
+            " VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)",
+            (result["pdf"], size, mtime_ns, sha256, options, result["status"], result.get("error"),
+             result.get("engine"), result.get("docx"), result.get("kml"), result.get("points"),
+             result.get("polygons"), json.dumps(result.get("timings", {})), time.time()))
+        if previous is not None:
+            self._remove_stale((previous["docx"], previous["kml"]), keep=(result.get("docx"), result.get("kml")))
+        self.conn.commit()
+
+    # --- Deleted sources ---
+    def prune_deleted(self):
+        """
+        Forgets the PDFs that no longer exist and deletes their DOCX/KML
+        outputs, unless another recorded source produced the same file.
+
+        Returns:
+            list: Paths of the removed sources.
+        """
+        removed = []
+        for row in self.conn.execute("SELECT path, docx, kml FROM sources").fetchall():
+            if os.path.exists(row["path"]):
+                continue
+            self.conn.execute("DELETE FROM sources WHERE path = ?", (row["path"],))
+            self._remove_stale((row["docx"], row["kml"]))
+            removed.append(row["path"])
+        self.conn.commit()
+        return removed
+
+    def _remove_stale(self, outputs, keep=()):
+        for output in outputs:
+            if output and output not in keep and not self._output_in_use(output) \
+                    and os.path.exists(output):
+                os.remove(output)
+
+    def _output_in_use(self, output):
+        return self.conn.execute("SELECT 1 FROM sources WHERE docx = ? OR kml = ? LIMIT 1",
+                                 (output, output)).fetchone() is not None
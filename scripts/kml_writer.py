@@ -0,0 +1,178 @@
+import io
+import gzip
+import zipfile
+
+import numpy as np
+
+from xml.sax.saxutils import escape
+
+def format_coordinates(lons, lats, precision=None):
+    """
+    Formats lon/lat arrays as a KML coordinate string "lon,lat,0 lon,lat,0 ...".
+
+    Args:
+        lons, lats (array-like): Coordinates in degrees.
+        precision (int, optional): Decimal places. Defaults to None, which
+                                   writes the shortest repr of each float
+                                   (same as f"{lon},{lat},0").
+
+    Returns:
+        str
+    """
+    lons = np.asarray(lons, dtype=np.float64)
+    lats = np.asarray(lats, dtype=np.float64)
+    n = len(lons)
+    if n == 0:
+        return ""
+    if precision is None:
+        # tolist() hands plain Python floats to the formatter, far cheaper
+        # than formatting NumPy scalars one by one
+        return " ".join([f"{lon},{lat},0" for lon, lat in zip(lons.tolist(), lats.tolist())])
+
+    # One %-format over the interleaved values formats the whole ring at once
+    fmt = f"%.{int(precision)}f,%.{int(precision)}f,0"
+    values = np.empty(2 * n)
+    values[0::2] = lons
+    values[1::2] = lats
+    return " ".join([fmt] * n) % tuple(values.tolist())
+
+def format_point_coordinates(lons, lats, precision=None):
+    """
+    Formats lon/lat arrays as one "lon,lat,0" string per point.
+
+    Same rules as format_coordinates, applied to the whole batch at once.
+
+    Returns:
+        list: Strings aligned with lons and lats.
+    """
+    lons = np.asarray(lons, dtype=np.float64).tolist()
+    lats = np.asarray(lats, dtype=np.float64).tolist()
+    if precision is None:
+        return [f"{lon},{lat},0" for lon, lat in zip(lons, lats)]
+    fmt = f"%.{int(precision)}f,%.{int(precision)}f,0"
+    return [fmt % pair for pair in zip(lons, lats)]
+
+
+class KMLWriter:
+    """
+    Streams a KML document to disk placemark by placemark, so memory does not
+    grow with the size of the export.
+
+    The output is buffered and compressed according to the file extension:
+    '.kmz' writes a zip archive holding 'doc.kml', '.gz' writes gzip, anything
+    else plain text. Use it as a context manager:
+
+        with KMLWriter("out.kml", header, footer) as kml:
+            kml.write_polygon("Polygon 1", lons, lats)
+
+    Args:
+        path (str): Output file path.
+        header (str): Text written first (XML declaration, <Document>, styles).
+        footer (str): Text written on close.
+        buffer_size (int, optional): Write buffer in bytes. Defaults to 1 MiB.
+        precision (int, optional): Decimal places of coordinates. Defaults to
+                                   None (full float repr).
+    """
+
+    def __init__(self, path, header, footer, buffer_size=1 << 20, precision=None):
+        self.path = path
+        self.footer = footer
+        self.precision = precision
+        self.count = 0
+        self._zip = None
+
+        lowered = path.lower()
+        if lowered.endswith(".kmz"):
+            self._zip = zipfile.ZipFile(path, "w", compression=zipfile.ZIP_DEFLATED)
+            raw = self._zip.open("doc.kml", "w", force_zip64=True)
+            raw = io.BufferedWriter(raw, buffer_size)
+        elif lowered.endswith(".gz"):
+            raw = gzip.open(path, "wb")
+            raw = io.BufferedWriter(raw, buffer_size)
+        else:
+            raw = open(path, "wb", buffering=buffer_size)
+        self._stream = io.TextIOWrapper(raw, encoding="utf-8", newline="")
+        self._stream.write(header)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        self.close()
+        return False
+
+    def write(self, text):
+        """Writes raw KML text."""
+        self._stream.write(text)
+
+    def open_folder(self, name):
+        self._stream.write(f"\n    <Folder>\n      <name>{escape(str(name))}</name>")
+
+    def close_folder(self):
+        self._stream.write("\n    </Folder>")
+
+    def write_polygon(self, name, lons, lats, style="#polygonStyle", description=None):
+        """
+        Writes one polygon placemark. The ring is closed by repeating the
+        first vertex if needed. `description` (plain text) is escaped.
+
+        Returns:
+            bool: True if the ring had to be closed.
+        """
+        closed = False
+        if len(lons) and (lons[0] != lons[-1] or lats[0] != lats[-1]):
+            lons = np.append(lons, lons[0])
+            lats = np.append(lats, lats[0])
+            closed = True
+        coordinates_str = format_coordinates(lons, lats, self.precision)
+
+        if self.count:
+            self._stream.write("\n")
+        self._stream.write(f"""
+        <Placemark>
+        <name>{escape(str(name))}</name>{self._description(description)}
+        <styleUrl>{style}</styleUrl> <!-- Link to the style defined above -->
+        <Polygon>
+            <outerBoundaryIs>
+            <LinearRing>
+                <coordinates>{coordinates_str}</coordinates>
+            </LinearRing>
+            </outerBoundaryIs>
+        </Polygon>
+        </Placemark>""")
+        self.count += 1
+        return closed
+
+    @staticmethod
+    def _description(description):
+        if description is None:
+            return ""
+        return f"\n        <description>{escape(str(description))}</description>"
+
+    def write_point(self, name, coordinates_str, style="#pointStyle"):
+        """
+        Writes one point placemark. `coordinates_str` is a "lon,lat,0" string,
+        usually one item of format_point_coordinates() for the whole batch.
+        """
+        self._stream.write(f"""
+    <Placemark>
+      <name>{escape(str(name))}</name>
+      <styleUrl>{style}</styleUrl> <!-- Link to the style defined above -->
+      <Point>
+        <coordinates>{coordinates_str}</coordinates>
+      </Point>
+    </Placemark>
+""")
+        self.count += 1
+
+    def close(self):
+        """Writes the footer and closes every underlying stream."""
+        if self._stream is None:
+            return
+        try:
+            self._stream.write(self.footer)
+            self._stream.close()
+        finally:
+            self._stream = None
+            if self._zip is not None:
+                self._zip.close()
@@ -0,0 +1,224 @@
+import os
+import sys
+import json
+import time
+import threading
+
+# --- Configuration ---
+# UTM_METRICS=<path> turns on structured events (JSON lines appended to <path>)
+# in every process that imports this module, including pool workers.
+# UTM_QUIET=1 silences the human-readable status lines printed by report().
+_state = {
+    "path": os.environ.get("UTM_METRICS") or None,
+    "quiet": os.environ.get("UTM_QUIET", "") not in ("", "0"),
+}
+_lock = threading.Lock()
+
+def enable(path):
+    """
+    Starts appending structured events to the JSON-lines file `path`.
+
+    The setting is also exported through UTM_METRICS so that worker
+    processes started afterwards record to the same file.
+    """
+    _state["path"] = path
+    os.environ["UTM_METRICS"] = path
+
+def disable():
+    """Stops recording events."""
+    _state["path"] = None
+    os.environ.pop("UTM_METRICS", None)
+
+def enabled():
+    return _state["path"] is not None
+
+def set_quiet(quiet=True):
+    """Silences (or restores) the status lines printed by report()."""
+    _state["quiet"] = quiet
+    if quiet:
+        os.environ["UTM_QUIET"] = "1"
+    else:
+        os.environ.pop("UTM_QUIET", None)
+
+# --- Events ---
+def _rss_kb():
+    # Current resident set size; only available where /proc exists (Linux)
+    try:
+        with open("/proc/self/statm", "rb") as f:
+            return int(f.read().split()[1]) * os.sysconf("SC_PAGE_SIZE") // 1024
+    except (OSError, ValueError, IndexError, AttributeError):
+        return None
+
+def _process_peak_rss_kb():
+    # Peak over the whole life of the process, not of one stage
+    try:
+        import resource
+        peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+        return peak // 1024 if sys.platform == "darwin" else peak # Bytes on macOS
+    except (ImportError, OSError):
+        return None
+
+def emit(event, **fields):
+    """Records one structured event. Does nothing unless metrics are enabled."""
+    path = _state["path"]
+    if path is None:
+        return
+    record = {"ts": time.time(), "pid": os.getpid(), "event": event}
+    record.update(fields)
+    line = json.dumps(record, default=str) + "\n"
+    with _lock:
+        # One write per line on an O_APPEND file, so processes don't interleave lines
+        with open(path, "a", encoding="utf-8") as f:
+            f.write(line)
+
+def report(message, event=None, **fields):
+    """
+    Prints a status line (unless quiet) and, if `event` is given, records it
+    as a structured event with `fields` and the message.
+    """
+    if not _state["quiet"]:
+        print(message)
+    if event is not None and _state["path"] is not None:
+        emit(event, message=message, **fields)
+
+
+class _Stage:
+    """Measures one stage; created by stage() when metrics are enabled."""
+
+    def __init__(self, name, fields):
+        self.name = name
+        self.fields = dict(fields)
+        self.failure = None
+
+    def count(self, **counts):
+        """Adds page/table/row/vertex counts (or any other fields) to the event."""
+        self.fields.update(counts)
+
+    def fail(self, reason):
+        """Marks the stage as failed without raising."""
+        self.failure = reason
+
+    def __enter__(self):
+        self._wall = time.perf_counter()
+        self._cpu = time.process_time()
+        self._rss = _rss_kb()
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        if exc_type is not None and self.failure is None:
+            self.failure = f"{exc_type.__name__}: {exc}"
+        rss = _rss_kb()
+        emit(
+            "stage",
+            stage=self.name,
+            ok=self.failure is None,
+            failure=self.failure,
+            wall_s=time.perf_counter() - self._wall,
+            cpu_s=time.process_time() - self._cpu,
+            rss_delta_kb=None if rss is None or self._rss is None else rss - self._rss,
+            process_peak_rss_kb=_process_peak_rss_kb(),
+            **self.fields,
+        )
+        return False
+
+
+class _NoopStage:
+    """Shared do-nothing stage returned while metrics are disabled."""
+
+    def count(self, **counts):
+        pass
+
+    def fail(self, reason):
+        pass
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        return False
+
+_NOOP = _NoopStage()
+
+def stage(name, **fields):
+    """
+    Context manager that records wall time, CPU time, memory, counts and
+    the failure reason of a pipeline stage as one 'stage' event:
+
+        with metrics.stage("docx_coords", file=path) as st:
+            ...
+            st.count(tables=n_tables, rows=n_rows)
+
+    Memory is reported as 'rss_delta_kb', the change of the resident set
+    size between the start and the end of the stage (None where it cannot
+    be read), and 'process_peak_rss_kb', the peak RSS of the whole process
+    so far. The latter is a lifetime value: a stage shows the largest peak
+    of any earlier stage, not its own use.
+
+    While metrics are disabled it returns a shared no-op object, so the
+    instrumentation costs a dict lookup and nothing else.
+    """
+    if _state["path"] is None:
+        return _NOOP
+    return _Stage(name, fields)
+
+# --- Aggregation ---
+# Memory fields are aggregated by their maximum instead of summed
+GAUGES = {
+    "rss_delta_kb": "Largest RSS growth of a single call of the stage, in KiB.",
+    "process_peak_rss_kb": "Largest lifetime peak RSS of a process that ran the stage, in KiB "
+                           "(includes memory used by earlier stages).",
+}
+
+def summarize(jsonl_path):
+    """
+    Aggregates the 'stage' events of a JSON-lines file per stage.
+
+    Returns:
+        dict: stage -> {'calls', 'failures', 'wall_s', 'cpu_s', the maximum
+              of 'rss_delta_kb' and 'process_peak_rss_kb', plus the sum of
+              every numeric count field}.
+    """
+    summary = {}
+    with open(jsonl_path, "r", encoding="utf-8") as f:
+        for line in f:
+            try:
+                record = json.loads(line)
+            except ValueError:
+                continue
+            if record.get("event") != "stage":
+                continue
+            s = summary.setdefault(record["stage"], {"calls": 0, "failures": 0, "wall_s": 0.0, "cpu_s": 0.0})
+            s["calls"] += 1
+            s["failures"] += 0 if record.get("ok") else 1
+            for key in GAUGES:
+                if record.get(key) is not None:
+                    s[key] = max(s.get(key, record[key]), record[key])
+            for key, value in record.items():
+                if key in ("ts", "pid", "ok") or key in GAUGES or isinstance(value, bool):
+                    continue
+                if isinstance(value, (int, float)):
+                    s[key] = s.get(key, 0) + value
+    return summary
+
+def prometheus_text(jsonl_path):
+    """
+    Renders the aggregated events of a JSON-lines file in the Prometheus
+    text exposition format (e.g. for the node_exporter textfile collector).
+    """
+    lines = []
+    summary = summarize(jsonl_path)
+    metric_names = sorted({key for s in summary.values() for key in s})
+    for key in metric_names:
+        metric = f"utm_stage_{key}" if key in GAUGES else f"utm_stage_{key}_total"
+        if key in GAUGES:
+            lines.append(f"# HELP {metric} {GAUGES[key]}")
+        lines.append(f"# TYPE {metric} {'gauge' if key in GAUGES else 'counter'}")
+        for stage_name, s in sorted(summary.items()):
+            if key in s:
+                lines.append(f'{metric}{{stage="{stage_name}"}} {s[key]}')
+    return "\n".join(lines) + "\n"
+
+def dump_prometheus(jsonl_path, out_path):
+    """Writes prometheus_text(jsonl_path) to `out_path`."""
+    with open(out_path, "w", encoding="utf-8") as f:
+        f.write(prometheus_text(jsonl_path))
@@ -0,0 +1,206 @@
+# pip install pdf2docx -q   (installs PyMuPDF, imported as fitz)
+
+import os
+import sys
+
+from pdf_2_doc import convert_coordinate_pages, convert_in_windows, find_coordinate_pages, page_ranges
+from doc_2_coords import read_docx_with_tables, read_table_rows, iter_docx_table_rows, is_coordinate_row
+
+import metrics
+
+def read_pdf_with_tables(pdf_path):
+    """
+    Reads UTM coordinate tables straight from the PDF's text layer,
+    without converting it to DOCX first.
+
+    Tables are detected with PyMuPDF's page.find_tables() and every row is
+    classified with the same rules as read_docx_with_tables.
+
+    Args:
+        pdf_path (str): The path to the .pdf file.
+
+    Returns:
+        tuple: (text, coords), with the same contract as read_docx_with_tables:
+               the coordinate rows joined by newlines and the list of row cells.
+               Returns ("", []) when no X/Y headers were found, and
+               (None, None) if the file cannot be read.
+    """
+    if not os.path.exists(pdf_path):
+        metrics.report(f"Error: File not found at {pdf_path}")
+        return None, None
+
+    try:
+        import fitz  # PyMuPDF, installed with pdf2docx
+
+        full_content = []
+        coords = []
+        utmx = 0
+        utmy = 0
+        n_tables = 0
+        n_rows = 0
+
+        with metrics.stage("pdf_coords", file=pdf_path) as st, fitz.open(pdf_path) as doc:
+            st.count(pages=doc.page_count)
+            for page in doc:
+                for table in page.find_tables().tables:
+                    n_tables += 1
+                    for row in table.extract():
+                        n_rows += 1
+                        # Clean up cell text (replace newlines within a cell with spaces)
+                        row_cells = [(cell or '').replace('\n', ' ').strip() for cell in row]
+
+                        for cell_text in row_cells:
+                            if "X" in cell_text:utmx+=1
+                            elif "Y" in cell_text:utmy+=1
+
+                        row_text = ",".join(row_cells)
+                        if is_coordinate_row(row_text):
+                            full_content.append(row_text)
+                            coords.append(row_cells)
+            st.count(tables=n_tables, rows=n_rows, coords=len(coords))
+
+        metrics.report(f"Found {n_tables} table(s) in the PDF.")
+        if utmx==0 and utmy==0:
+            return "", []
+        return '\n'.join(full_content), coords
+
+    except Exception:
+
+        exc_type, exc_obj, exc_tb = sys.exc_info()
+        error_l = exc_tb.tb_lineno
+        cadena_error = str(exc_type) + " => " + str(exc_obj)
+
+        metrics.report(f"Error line: {error_l}")
+        metrics.report(f"Error message: {cadena_error}")
+        return None, None
+
+def read_pdf_in_windows(pdf_path, pages=None, window=25, work_dir=None, columnar=False):
+    """
+    Reads coordinate tables through the DOCX route, converting `window`
+    pages at a time (see pdf_2_doc.convert_in_windows).
+
+    The rows of every fragment are fed to the same single-pass classifier
+    as read_docx_with_tables while the fragment exists, then the fragment is
+    deleted, so memory stays bounded for documents of any length. The
+    fragments are read as one document: a table whose headers are in one
+    window and whose rows continue in the next is still recognized.
+
+    Args:
+        pdf_path (str): The path to the .pdf file.
+        pages (list, optional): 0-based pages to convert. Defaults to all.
+        window (int, optional): Pages per conversion. Defaults to 25.
+        work_dir (str, optional): Where to write the temporary fragments.
+        columnar (bool, optional): Return a CoordinateSet, see read_docx_with_tables.
+
+    Returns:
+        tuple: (text, coords), with the read_docx_with_tables contract.
+    """
+    def rows():
+        table_base = 0
+        for _, fragment in convert_in_windows(pdf_path, pages, window, work_dir):
+            n_tables = 0
+            for table_index, cells in iter_docx_table_rows(fragment):
+                n_tables = table_index + 1
+                yield table_base + table_index, cells
+            table_base += n_tables
+
+    return read_table_rows(rows(), pdf_path, columnar, stage="windowed_coords")
+
+def extract_coords(pdf_path, docx_path=None, engine="auto", cache=None, refresh=False,
+                   page_window=None):
+    """
+    Extracts coordinates from a PDF, reading the PDF directly when possible
+    and falling back to the PDF -> DOCX route otherwise.
+
+    Args:
+        pdf_path (str): The path to the .pdf file.
+        docx_path (str, optional): Where to write the DOCX if the fallback
+                                   is needed. Defaults to next to the PDF.
+        engine (str, optional): "auto" (direct, then DOCX fallback),
+                                "direct" (PDF text layer only) or
+                                "docx" (always convert). Defaults to "auto".
+        cache (PipelineCache, optional): Cache to look up and store results
+                                         in. A hit skips conversion entirely.
+        refresh (bool, optional): Ignore any cached entry and recompute it.
+        page_window (int, optional): Convert at most this many pages at a
+                                     time on the DOCX route (see
+                                     read_pdf_in_windows). No DOCX is kept
+                                     in this mode. Defaults to None (one
+                                     conversion of all selected pages).
+
+    Returns:
+        tuple: (text, coords, info). text/coords follow the
+               read_docx_with_tables contract; info is a dict with 'engine'
+               ("direct" or "docx") and, for the DOCX route, the page
+               selection from convert_coordinate_pages ('pages', 'ranges',
+               'total_pages'). With a cache, info['cache'] is "hit" or "miss".
+    """
+    if engine not in ("auto", "direct", "docx"):
+        raise ValueError(f"Unknown engine '{engine}'. Use 'auto', 'direct' or 'docx'.")
+
+    if docx_path is None:
+        docx_path = os.path.splitext(pdf_path)[0] + ".docx"
+
+    if cache is None or not os.path.exists(pdf_path):
+        return _extract_coords(pdf_path, docx_path, engine, page_window)
+
+    key = cache.key_for(pdf_path, engine, page_window)
+    if not refresh:
+        hit = cache.get(key, docx_path)
+        if hit is not None:
+            return hit
+
+    text, coords, info = _extract_coords(pdf_path, docx_path, engine, page_window)
+    # Only successful extractions are cached; failures are retried next time
+    if coords is not None:
+        cache.put(key, text, coords, info, docx_path if info["engine"] == "docx" else None)
+    info["cache"] = "miss"
+    return text, coords, info
+
+def _extract_coords(pdf_path, docx_path, engine, page_window=None):
+
+    if engine in ("auto", "direct"):
+        text, coords = read_pdf_with_tables(pdf_path)
+        # The DOCX route has an extra parser for space-separated coordinate
+        # cells, so a table with headers but no clean rows also falls back.
+        # An unreadable PDF (coords is None) would fail pdf2docx as well.
+        if engine == "direct" or coords or coords is None:
+            return text, coords, {"engine": "direct"}
+        metrics.report("No coordinate table found in the PDF text layer. Falling back to DOCX conversion.",
+                       event="extract.fallback", file=pdf_path)
+
+    if page_window:
+        return _extract_coords_in_windows(pdf_path, docx_path, page_window)
+
+    conversion = convert_coordinate_pages(pdf_path, docx_path)
+    info = {
+        "engine": "docx",
+        "pages": conversion["pages"],
+        "ranges": conversion["ranges"],
+        "total_pages": conversion["total_pages"],
+    }
+    if not conversion["success"]:
+        return None, None, info
+
+    extracted = read_docx_with_tables(docx_path)
+    if not isinstance(extracted, tuple):
+        return None, None, info
+    return extracted[0], extracted[1], info
+
+def _extract_coords_in_windows(pdf_path, docx_path, page_window):
+    # Same page selection as convert_coordinate_pages, converted window by window
+    try:
+        pages, total_pages = find_coordinate_pages(pdf_path)
+    except Exception as e:
+        metrics.report(f"Pre-scan failed for '{os.path.basename(pdf_path)}': {e}. Converting all pages.")
+        pages, total_pages = [], None
+    info = {
+        "engine": "docx",
+        "pages": pages or None,
+        "ranges": page_ranges(pages) if pages else None,
+        "total_pages": total_pages,
+        "page_window": page_window,
+    }
+    work_dir = os.path.dirname(os.path.abspath(docx_path))
+    text, coords = read_pdf_in_windows(pdf_path, pages or None, page_window, work_dir)
+    return text, coords, info
@@ -2,13 +2,71 @@
 # !pip install python-docx -q
 
 import os
-import docx
-import argparse
+import gc
+import shutil
+import tempfile
 
-from glob import glob
-from pdf2docx import Converter
+import metrics
 
-def convert_pdf_to_docx(pdf_path, docx_path=None):
+# Words that mark a page as holding a UTM coordinate table. "X"/"Y" and
+# "ipu" are the same markers read_docx_with_tables keys on.
+COORD_MARKERS = ("utm", "este", "norte")
+
+def find_coordinate_pages(pdf_path, min_numbers=4):
+    """
+    Cheap pre-scan of the PDF text layer for pages that hold coordinate tables.
+
+    A page is selected when it mentions "UTM", "Este", "Norte" or "ipu", or
+    has both a standalone "X" and "Y". A page right after a selected one is
+    also kept when it has at least `min_numbers` 6-7 digit numbers, so that
+    tables continuing on the next page without repeated headers are not lost.
+
+    Args:
+        pdf_path (str): The full path to the input PDF file.
+        min_numbers (int, optional): Easting/northing-like numbers needed to
+                                     keep a continuation page. Defaults to 4.
+
+    Returns:
+        tuple: (pages, total_pages) where pages is a sorted list of 0-based
+               page indices.
+    """
+    import fitz  # PyMuPDF, installed with pdf2docx
+
+    pages = []
+    with metrics.stage("prescan", file=pdf_path) as st, fitz.open(pdf_path) as doc:
+        total_pages = doc.page_count
+        for page in doc:
+            words = [w[4] for w in page.get_text("words")]
+            lowered = {w.lower().strip(":.,;()") for w in words}
+            has_header = (
+                any(marker in lowered for marker in COORD_MARKERS)
+                or any("ipu" in w for w in words)
+                or ("X" in words and "Y" in words)
+            )
+            if has_header:
+                pages.append(page.number)
+            elif pages and pages[-1] == page.number - 1:
+                numbers = sum(1 for w in words if w.isdecimal() and 6 <= len(w) <= 7)
+                if numbers >= min_numbers:
+                    pages.append(page.number)
+        st.count(pages=total_pages, selected=len(pages))
+    return pages, total_pages
+
+def page_ranges(pages):
+    """
+    Collapses sorted 0-based page indices into inclusive (start, end) ranges.
+
+    Example: [2, 3, 4, 9] -> [(2, 4), (9, 9)]
+    """
+    ranges = []
+    for p in pages:
+        if ranges and p == ranges[-1][1] + 1:
+            ranges[-1] = (ranges[-1][0], p)
+        else:
+            ranges.append((p, p))
+    return ranges
+
+def convert_pdf_to_docx(pdf_path, docx_path=None, pages=None):
     """
     Converts a specified PDF file to a DOCX file.
 
@@ -18,16 +76,19 @@ def convert_pdf_to_docx(pdf_path, docx_path=None):
                                    If None, it saves the DOCX in the same
                                    directory as the PDF with the same name
                                    but a .docx extension. Defaults to None.
+        pages (list, optional): 0-based indices of the pages to convert.
+                                Defaults to None (all pages).
 
     Returns:
         bool: True if conversion was successful, False otherwise.
     """
     # Validate input PDF path
     if not os.path.exists(pdf_path):
-        print(f"Error: Input PDF file not found at '{pdf_path}'")
+        metrics.report(f"Error: Input PDF file not found at '{pdf_path}'", event="pdf_to_docx.failed",
+                       file=pdf_path, reason="not_found")
         return False
     if not pdf_path.lower().endswith(".pdf"):
-        print(f"Warning: Input file '{os.path.basename(pdf_path)}' might not be a PDF.")
+        metrics.report(f"Warning: Input file '{os.path.basename(pdf_path)}' might not be a PDF.")
         # Continue anyway, let pdf2docx handle potential errors
 
     # Determine output DOCX path if not provided
@@ -35,41 +96,130 @@ def convert_pdf_to_docx(pdf_path, docx_path=None):
         base_name = os.path.splitext(pdf_path)[0]
         docx_path = base_name + ".docx"
     elif not docx_path.lower().endswith(".docx"):
-         print(f"Warning: Specified output path '{docx_path}' doesn't end with .docx. Appending it.")
+         metrics.report(f"Warning: Specified output path '{docx_path}' doesn't end with .docx. Appending it.")
          docx_path += ".docx"
 
 
-    print(f"Starting conversion: '{os.path.basename(pdf_path)}' -> '{os.path.basename(docx_path)}'")
+    metrics.report(f"Starting conversion: '{os.path.basename(pdf_path)}' -> '{os.path.basename(docx_path)}'")
 
     try:
-        # Initialize the Converter object
-        cv = Converter(pdf_path)
+        # Imported here: pdf2docx pulls in PyMuPDF and OpenCV, which is slow
+        from pdf2docx import Converter
+
+        with metrics.stage("pdf_to_docx", file=pdf_path) as st:
+            # Initialize the Converter object
+            cv = Converter(pdf_path)
+            st.count(pages=len(pages) if pages else len(cv.fitz_doc))
 
-        # Perform the conversion
-        # You can specify page ranges: cv.convert(docx_path, start=0, end=1) for first 2 pages
-        cv.convert(docx_path, start=0, end=None) # end=None converts all pages
+            # Perform the conversion
+            # You can specify page ranges: cv.convert(docx_path, start=0, end=1) for first 2 pages
+            if pages:
+                cv.convert(docx_path, pages=list(pages))
+            else:
+                cv.convert(docx_path, start=0, end=None) # end=None converts all pages
 
-        # Close the converter object
-        cv.close()
+            # Close the converter object
+            cv.close()
+
+            if not os.path.exists(docx_path):
+                st.fail("output_missing")
 
         if os.path.exists(docx_path):
-             print(f"Successfully converted PDF to: '{docx_path}'")
+             metrics.report(f"Successfully converted PDF to: '{docx_path}'")
              return True
         else:
-             print(f"Conversion process completed, but output file not found at '{docx_path}'. Check permissions or disk space.")
+             metrics.report(f"Conversion process completed, but output file not found at '{docx_path}'. Check permissions or disk space.")
              return False
 
     except Exception as e:
-        print(f"\nAn error occurred during conversion:")
-        print(f"------------------------------------")
-        print(e)
-        print(f"------------------------------------")
-        print("Conversion failed.")
+        metrics.report("\nAn error occurred during conversion:")
+        metrics.report("------------------------------------")
+        metrics.report(e, event="pdf_to_docx.failed", file=pdf_path, reason=f"{type(e).__name__}: {e}")
+        metrics.report("------------------------------------")
+        metrics.report("Conversion failed.")
         # Clean up partially created file if it exists
         if os.path.exists(docx_path):
             try:
                 # os.remove(docx_path) # Optional: uncomment to delete partial files on error
-                print(f"Note: A potentially incomplete output file might exist at '{docx_path}'")
+                metrics.report(f"Note: A potentially incomplete output file might exist at '{docx_path}'")
             except OSError as oe:
-                 print(f"Could not access potentially incomplete output file: {oe}")
+                 metrics.report(f"Could not access potentially incomplete output file: {oe}")
         return False
+
+def convert_coordinate_pages(pdf_path, docx_path=None):
+    """
+    Converts only the pages that the pre-scan flags as holding coordinate
+    tables. If no page is flagged, the whole document is converted.
+
+    Args:
+        pdf_path (str): The full path to the input PDF file.
+        docx_path (str, optional): The output DOCX path. See convert_pdf_to_docx.
+
+    Returns:
+        dict: 'success' (bool), 'docx_path', 'pages' (0-based indices that
+              were converted, or None for all pages), 'ranges' (inclusive
+              (start, end) tuples) and 'total_pages', for auditing.
+    """
+    if docx_path is None:
+        docx_path = os.path.splitext(pdf_path)[0] + ".docx"
+    result = {"success": False, "docx_path": docx_path, "pages": None, "ranges": None, "total_pages": None}
+
+    try:
+        pages, total_pages = find_coordinate_pages(pdf_path)
+    except Exception as e:
+        metrics.report(f"Pre-scan failed for '{os.path.basename(pdf_path)}': {e}. Converting all pages.")
+        pages, total_pages = [], None
+
+    result["total_pages"] = total_pages
+    if pages:
+        result["pages"] = pages
+        result["ranges"] = page_ranges(pages)
+        metrics.report(f"Pre-scan selected {len(pages)} of {total_pages} page(s): {result['ranges']}")
+
+    result["success"] = convert_pdf_to_docx(pdf_path, docx_path, pages=pages or None)
+    return result
+
+def convert_in_windows(pdf_path, pages=None, window=25, work_dir=None):
+    """
+    Converts a PDF to DOCX a window of pages at a time, for documents too
+    large to convert in one go.
+
+    Every window gets its own pdf2docx Converter, so the layout model of one
+    window is released before the next is parsed and peak memory depends on
+    `window`, not on the length of the document. Each DOCX fragment is
+    deleted as soon as the caller asks for the next one.
+
+    Args:
+        pdf_path (str): The full path to the input PDF file.
+        pages (list, optional): 0-based indices of the pages to convert.
+                                Defaults to None (all pages).
+        window (int, optional): Pages per fragment. Defaults to 25.
+        work_dir (str, optional): Where to write the fragments. Defaults to
+                                  the system temporary directory.
+
+    Yields:
+        tuple: (window_pages, fragment_path).
+
+    Raises:
+        RuntimeError: If a window cannot be converted.
+    """
+    if pages is None:
+        import fitz  # PyMuPDF, installed with pdf2docx
+        with fitz.open(pdf_path) as doc:
+            pages = list(range(doc.page_count))
+    window = max(1, int(window))
+
+    tmp = tempfile.mkdtemp(prefix="utm_windows_", dir=work_dir)
+    try:
+        for start in range(0, len(pages), window):
+            chunk = list(pages[start:start + window])
+            label = f"{chunk[0] + 1}-{chunk[-1] + 1}"
+            fragment = os.path.join(tmp, f"pages_{label}.docx")
+            metrics.report(f"Converting page window {label} of '{os.path.basename(pdf_path)}'")
+            if not convert_pdf_to_docx(pdf_path, fragment, pages=chunk):
+                raise RuntimeError(f"Conversion of pages {label} failed")
+            yield chunk, fragment
+            os.remove(fragment)
+            gc.collect()
+    finally:
+        shutil.rmtree(tmp, ignore_errors=True)
@@ -1,55 +1,20 @@
-from pyproj import CRS, Transformer
+import numpy as np
+import pandas as pd
 
-def save_single_point_to_kml(point_utm_list, file_name, point_name="UTM Point"):
-    """
-    Saves a single UTM point (WGS84 Zone 17S) to a KML file.
-
-    Args:
-        point_utm_list (list): A list containing two strings or numbers representing
-                               the UTM coordinates: [easting, northing].
-                               Example: ['532137', '9892120']
-        output_kml_file (str): The desired path for the output KML file.
-        point_name (str, optional): The name for the placemark in the KML file.
-                                      Defaults to "UTM Point".
-    """
-    # --- Input Validation ---
-    if not isinstance(point_utm_list, list) or len(point_utm_list) != 2:
-        print(f"Error: Input 'point_utm_list' must be a list containing exactly two elements (easting, northing). Received: {point_utm_list}")
-        return
-
-    try:
-        # Convert coordinates to float for transformation
-        utm_x = float(point_utm_list[0])
-        utm_y = float(point_utm_list[1])
-    except (ValueError, TypeError) as e:
-        print(f"Error converting coordinates {point_utm_list} to numbers: {e}")
-        return
+from xml.sax.saxutils import escape
 
-    # --- Define Coordinate Reference Systems ---
-    source_crs = CRS("EPSG:32717") # WGS 84 / UTM zone 17S
-    target_crs = CRS("EPSG:4326") # WGS 84 (lat/lon)
+from crs import get_transformer, resolve_utm_epsg
+from coords_2_kml import transform_vertices
+from kml_writer import KMLWriter, format_point_coordinates
 
-    # --- Create Transformer ---
-    # always_xy=True ensures output is (longitude, latitude) order for KML
-    transformer = Transformer.from_crs(source_crs, target_crs, always_xy=True)
-
-    # --- Transform the single point ---
-    try:
-        lon, lat = transformer.transform(utm_x, utm_y)
-    except Exception as e:
-        print(f"Error during coordinate transformation: {e}")
-        return
+import metrics
 
-    # --- Format coordinates for KML ---
-    # KML format: longitude,latitude,altitude (altitude is often 0)
-    coordinates_str = f"{lon},{lat},0"
-
-    # --- KML Structure Components ---
-    kml_header = """<?xml version="1.0" encoding="UTF-8"?>
+# --- KML Structure Components ---
+POINT_KML_HEADER = """<?xml version="1.0" encoding="UTF-8"?>
 <kml xmlns="http://www.opengis.net/kml/2.2">
   <Document>
-    <name>Single Point KML</name>
-    <description>{file_name}</description>
+    <name>{name}</name>
+    <description>{description}</description>
     <!-- Optional: Define a style for the point marker -->
     <Style id="pointStyle">
       <IconStyle>
@@ -62,28 +27,151 @@ def save_single_point_to_kml(point_utm_list, file_name, point_name="UTM Point"):
     </Style>
 """
 
-    # Use an f-string to create the Placemark for the point
-    kml_placemark = f"""
-    <Placemark>
-      <name>{point_name} ({point_utm_list[0]}, {point_utm_list[1]})</name>
-      <styleUrl>#pointStyle</styleUrl> <!-- Link to the style defined above -->
-      <Point>
-        <coordinates>{coordinates_str}</coordinates>
-      </Point>
-    </Placemark>
-"""
-
-    kml_footer = """
+POINT_KML_FOOTER = """
   </Document>
 </kml>"""
 
-    # --- Combine all parts into the final KML string ---
-    full_kml = kml_header + kml_placemark + kml_footer
+def save_points_to_kml(points, output_kml_file, names=None, groups=None, zone=17, south=None,
+                       precision=None, document_name="UTM Points", description=""):
+    """
+    Saves many UTM points to a single KML/KMZ file.
+
+    All points are reprojected with one vectorized transform call and the
+    placemarks are streamed to the file, so tens of thousands of points cost
+    one file and one transformer.
+
+    Args:
+        points (DataFrame or array-like): A DataFrame with 'x' (easting) and
+                                          'y' (northing) columns, or an (N, 2)
+                                          array of [easting, northing] rows.
+        output_kml_file (str): Output path; '.kmz' or '.gz' compresses it.
+        names (str or array-like, optional): Placemark names, or the name of
+                                             a DataFrame column holding them.
+                                             Defaults to "Point <n>".
+        groups (str or array-like, optional): Group key per point (e.g. the
+                                              source document), or a column
+                                              name. Each group is written as
+                                              a KML Folder.
+        zone (int, optional): UTM zone. Defaults to 17.
+        south (bool, optional): Southern hemisphere. Defaults to None, which
+                                detects it from the northings.
+        precision (int, optional): Decimal places of the output coordinates.
+                                   Defaults to None (full float repr).
+        document_name (str, optional): <name> of the KML Document.
+        description (str, optional): <description> of the KML Document.
+
+    Returns:
+        int: Number of placemarks written, or 0 on error.
+    """
+    # --- Input Validation ---
+    if isinstance(points, pd.DataFrame):
+        if 'x' not in points.columns or 'y' not in points.columns:
+            metrics.report("Error: 'points' DataFrame must have 'x' and 'y' columns.")
+            return 0
+        x = pd.to_numeric(points['x'], errors='coerce').to_numpy(dtype=np.float64)
+        y = pd.to_numeric(points['y'], errors='coerce').to_numpy(dtype=np.float64)
+        if isinstance(names, str):
+            names = points[names]
+        if isinstance(groups, str):
+            groups = points[groups]
+    else:
+        try:
+            xy = np.asarray(points, dtype=np.float64).reshape(-1, 2)
+        except (ValueError, TypeError) as e:
+            metrics.report(f"Error converting points to numbers: {e}")
+            return 0
+        x, y = xy[:, 0], xy[:, 1]
+
+    n = len(x)
+    names = np.asarray([f"Point {i+1}" for i in range(n)] if names is None else names, dtype=object)
+    if len(names) != n or (groups is not None and len(groups) != n):
+        metrics.report(f"Error: 'names' and 'groups' must have one entry per point ({n}).")
+        return 0
 
-    # --- Write the KML string to a file ---
+    valid = np.isfinite(x) & np.isfinite(y)
+    if not valid.all():
+        metrics.report(f"Skipping {int((~valid).sum())} point(s) with missing or non-numeric coordinates.")
+        x, y, names = x[valid], y[valid], names[valid]
+        if groups is not None:
+            groups = np.asarray(groups, dtype=object)[valid]
+
+    with metrics.stage("points_kml", file=output_kml_file) as st:
+        st.count(points=len(x), skipped=int((~valid).sum()))
+        return _write_points(x, y, names, groups, output_kml_file, zone, south, precision,
+                             document_name, description, st)
+
+def _write_points(x, y, names, groups, output_kml_file, zone, south, precision, document_name,
+                  description, st):
+    # --- Transform all points at once ---
     try:
-        with open(output_kml_file, 'w', encoding='utf-8') as f:
-            f.write(full_kml)
-        print(f"Successfully created KML file for point: '{output_kml_file}'")
+        transformer = get_transformer(resolve_utm_epsg(y if len(y) else None, zone, south))
+        lons, lats = transform_vertices(transformer, x, y)
     except Exception as e:
-        print(f"Error writing KML file '{output_kml_file}': {e}")
+        metrics.report(f"Error during coordinate transformation: {e}")
+        st.fail(f"{type(e).__name__}: {e}")
+        return 0
+    coordinates = format_point_coordinates(lons, lats, precision)
+
+    # --- Stream the placemarks, one Folder per group ---
+    header = POINT_KML_HEADER.format(name=escape(str(document_name)), description=escape(str(description)))
+    try:
+        with KMLWriter(output_kml_file, header, POINT_KML_FOOTER, precision=precision) as kml:
+            if groups is None:
+                for name, coords_str in zip(names.tolist(), coordinates):
+                    kml.write_point(name, coords_str)
+            else:
+                codes, uniques = pd.factorize(pd.Series(groups, dtype=object))
+                order = np.argsort(codes, kind="stable")
+                bounds = np.searchsorted(codes[order], np.arange(len(uniques) + 1))
+                for g, group in enumerate(uniques):
+                    kml.open_folder(group)
+                    for idx in order[bounds[g]:bounds[g+1]].tolist():
+                        kml.write_point(names[idx], coordinates[idx])
+                    kml.close_folder()
+                # Points without a group (NaN/None) go after the folders
+                for idx in order[:bounds[0]].tolist():
+                    kml.write_point(names[idx], coordinates[idx])
+            written = kml.count
+        metrics.report(f"Successfully created KML file with {written} point(s): '{output_kml_file}'")
+        return written
+    except Exception as e:
+        metrics.report(f"Error writing KML file '{output_kml_file}': {e}")
+        st.fail(f"{type(e).__name__}: {e}")
+        return 0
+
+def save_single_point_to_kml(point_utm_list, file_name, point_name="UTM Point", zone=17, south=None):
+    """
+    Saves a single UTM point (WGS84 Zone 17S by default) to a KML file.
+
+    Args:
+        point_utm_list (list): A list containing two strings or numbers representing
+                               the UTM coordinates: [easting, northing].
+                               Example: ['532137', '9892120']
+        file_name (str): The desired path for the output KML file. A ".docx"
+                         extension is replaced by ".kml", as in generate_kml.
+        point_name (str, optional): The name for the placemark in the KML file.
+                                      Defaults to "UTM Point".
+        zone (int, optional): UTM zone of the point. Defaults to 17.
+        south (bool, optional): Southern hemisphere. Defaults to None, which
+                                detects it from the northing.
+    """
+    # --- Input Validation ---
+    if not isinstance(point_utm_list, list) or len(point_utm_list) != 2:
+        metrics.report(f"Error: Input 'point_utm_list' must be a list containing exactly two elements (easting, northing). Received: {point_utm_list}")
+        return
+
+    try:
+        # Convert coordinates to float for transformation
+        utm_x = float(point_utm_list[0])
+        utm_y = float(point_utm_list[1])
+    except (ValueError, TypeError) as e:
+        metrics.report(f"Error converting coordinates {point_utm_list} to numbers: {e}")
+        return
+
+    output_kml_file = file_name.replace(".docx", ".kml")
+    save_points_to_kml(
+        [[utm_x, utm_y]], output_kml_file,
+        names=[f"{point_name} ({point_utm_list[0]}, {point_utm_list[1]})"],
+        zone=zone, south=south,
+        document_name="Single Point KML", description=file_name,
+    )
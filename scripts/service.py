@@ -0,0 +1,372 @@
+import os
+import re
+import sys
+import json
+import math
+import time
+import uuid
+import shutil
+import asyncio
+import argparse
+
+from functools import partial
+from urllib.parse import urlsplit, parse_qs
+from concurrent.futures import ProcessPoolExecutor
+
+from batch import process_pdf, _init_worker
+
+# --- HTTP helpers ---
+REASONS = {
+    200: "OK", 202: "Accepted", 400: "Bad Request", 404: "Not Found",
+    405: "Method Not Allowed", 409: "Conflict", 411: "Length Required",
+    413: "Payload Too Large", 500: "Internal Server Error", 503: "Service Unavailable",
+}
+CHUNK_SIZE = 1 << 16
+
+class HTTPError(Exception):
+    def __init__(self, status, message, headers=None):
+        super().__init__(message)
+        self.status = status
+        self.message = message
+        self.headers = headers or {}
+
+async def send_response(writer, status, body=b"", content_type="application/json", headers=None):
+    if isinstance(body, (dict, list)):
+        body = json.dumps(body, indent=2).encode("utf-8")
+    elif isinstance(body, str):
+        body = body.encode("utf-8")
+    lines = [f"HTTP/1.1 {status} {REASONS.get(status, '')}",
+             f"Content-Type: {content_type}",
+             f"Content-Length: {len(body)}",
+             "Connection: close"]
+    lines += [f"{k}: {v}" for k, v in (headers or {}).items()]
+    writer.write(("\r\n".join(lines) + "\r\n\r\n").encode("latin-1") + body)
+    await writer.drain()
+
+async def send_file(writer, path, content_type, filename):
+    """Streams a file to the client in chunks, without loading it in memory."""
+    size = os.path.getsize(path)
+    head = (f"HTTP/1.1 200 OK\r\nContent-Type: {content_type}\r\nContent-Length: {size}\r\n"
+            f"Content-Disposition: attachment; filename=\"{filename}\"\r\nConnection: close\r\n\r\n")
+    writer.write(head.encode("latin-1"))
+    with open(path, "rb") as f:
+        for chunk in iter(lambda: f.read(CHUNK_SIZE), b""):
+            writer.write(chunk)
+            await writer.drain()
+
+async def read_request(reader):
+    """Reads the request line and headers. Returns (method, path, query, headers)."""
+    request_line = (await reader.readline()).decode("latin-1").strip()
+    if not request_line:
+        raise HTTPError(400, "Empty request")
+    try:
+        method, target, _ = request_line.split(" ", 2)
+    except ValueError:
+        raise HTTPError(400, "Malformed request line")
+
+    headers = {}
+    while True:
+        line = (await reader.readline()).decode("latin-1")
+        if line in ("\r\n", "\n", ""):
+            break
+        key, _, value = line.partition(":")
+        headers[key.strip().lower()] = value.strip()
+
+    url = urlsplit(target)
+    return method.upper(), url.path.rstrip("/") or "/", parse_qs(url.query), headers
+
+def _extract_multipart_pdf(content_type, body):
+    """Returns (filename, bytes) of the first file in a multipart/form-data body."""
+    from email.parser import BytesParser
+    from email.policy import default
+
+    message = BytesParser(policy=default).parsebytes(
+        f"Content-Type: {content_type}\r\n\r\n".encode("latin-1") + body)
+    for part in message.iter_parts():
+        filename = part.get_filename()
+        if filename:
+            return filename, part.get_payload(decode=True)
+    raise HTTPError(400, "No file found in the multipart upload")
+
+def _parse_wait(query):
+    value = query.get("wait", ["0"])[0] or "0"
+    try:
+        wait = float(value)
+    except ValueError:
+        wait = math.nan
+    if not 0 <= wait < math.inf:
+        raise HTTPError(400, f"wait must be a non-negative number of seconds, got '{value}'")
+    return wait
+
+
+# --- Jobs ---
+class JobService:
+    """
+    Queues uploaded PDFs and runs the PDF -> coords -> KML pipeline on a
+    bounded process pool.
+
+    At most `max_queue` jobs wait for a worker; further uploads are refused
+    with 503 so clients back off instead of piling work onto the box.
+
+    Args:
+        work_dir (str): Where uploads and results are stored, one directory per job.
+        workers (int, optional): Worker processes. Defaults to os.cpu_count().
+        max_queue (int, optional): Jobs allowed to wait for a worker. Defaults to 100.
+        max_upload_mb (float, optional): Largest accepted upload. Defaults to 200 MiB.
+        timeout (float, optional): Per-job time budget in seconds.
+        keep_finished (int, optional): Finished jobs (and their files) kept for
+                                       download; older ones are deleted first.
+                                       Defaults to 1000.
+        max_age (float, optional): Delete finished jobs this many seconds after
+                                   they finish. Defaults to None (no age limit).
+        process_options (dict, optional): Extra keyword arguments for
+                                          batch.process_pdf (engine, cache_dir, zone...).
+    """
+
+    def __init__(self, work_dir, workers=None, max_queue=100, max_upload_mb=200, timeout=None,
+                 process_options=None, keep_finished=1000, max_age=None):
+        self.work_dir = work_dir
+        self.workers = workers or os.cpu_count() or 1
+        self.max_upload = int(max_upload_mb * 1024 * 1024)
+        self.timeout = timeout
+        self.keep_finished = keep_finished
+        self.max_age = max_age
+        self.process_options = process_options or {}
+        self.jobs = {}
+        self.queue = asyncio.Queue(maxsize=max_queue)
+        self.pool = None
+        self._dispatchers = []
+        os.makedirs(work_dir, exist_ok=True)
+
+    async def start(self):
+        self.pool = ProcessPoolExecutor(max_workers=self.workers, initializer=_init_worker,
+                                        initargs=(os.environ.get("UTM_METRICS"), True))
+        # The pool forks its workers on first use; do it now, before any client
+        # socket is open, or the children would inherit the connection and
+        # the client would never see it close
+        await asyncio.get_running_loop().run_in_executor(self.pool, int)
+        self._dispatchers = [asyncio.create_task(self._dispatch()) for _ in range(self.workers)]
+
+    async def stop(self):
+        for task in self._dispatchers:
+            task.cancel()
+        await asyncio.gather(*self._dispatchers, return_exceptions=True)
+        self.pool.shutdown(wait=False, cancel_futures=True)
+
+    def submit(self, filename, data):
+        """Stores an upload and queues it. Raises HTTPError(503) when the queue is full."""
+        self.prune()
+        if self.queue.full():
+            raise HTTPError(503, "Queue is full, retry later", {"Retry-After": "30"})
+
+        job_id = uuid.uuid4().hex
+        job_dir = os.path.join(self.work_dir, job_id)
+        os.makedirs(job_dir)
+        # The stem names the KML download, so only header-safe characters are kept
+        stem = os.path.splitext(os.path.basename(filename or "upload.pdf"))[0]
+        stem = re.sub(r"[^A-Za-z0-9._-]", "", stem).lstrip(".") or "upload"
+        pdf_path = os.path.join(job_dir, stem + ".pdf")
+        with open(pdf_path, "wb") as f:
+            f.write(data)
+
+        job = {"id": job_id, "status": "queued", "filename": filename, "pdf": pdf_path,
+               "created": time.time(), "started": None, "finished": None,
+               "error": None, "kml": None, "result": None, "done": asyncio.Event()}
+        self.jobs[job_id] = job
+        self.queue.put_nowait(job_id)
+        return job
+
+    async def _dispatch(self):
+        loop = asyncio.get_running_loop()
+        while True:
+            job = self.jobs.get(await self.queue.get())
+            try:
+                if job is None:
+                    continue # Deleted while queued
+                job["status"] = "running"
+                job["started"] = time.time()
+                try:
+                    result = await loop.run_in_executor(self.pool, partial(
+                        process_pdf, job["pdf"], os.path.dirname(job["pdf"]),
+                        timeout=self.timeout, **self.process_options))
+                except Exception as e:
+                    result = {"status": "failed", "error": f"{type(e).__name__}: {e}", "kml": None}
+                job["result"] = result
+                job["kml"] = result.get("kml")
+                job["error"] = result.get("error")
+                job["status"] = "done" if result["status"] == "ok" else result["status"]
+                job["finished"] = time.time()
+                job["done"].set()
+                if self.jobs.get(job["id"]) is not job:
+                    self._remove_files(job) # Deleted while running
+                self.prune()
+            finally:
+                self.queue.task_done()
+
+    def describe(self, job):
+        info = {k: v for k, v in job.items() if k not in ("done", "pdf", "kml")}
+        info["kml_url"] = f"/jobs/{job['id']}/kml" if job["kml"] else None
+        if job["status"] == "queued":
+            info["queue_position"] = sum(1 for j in self.jobs.values() if j["status"] == "queued"
+                                         and j["created"] < job["created"]) + 1
+        return info
+
+    def delete(self, job_id):
+        """Forgets a job. A running job's files are removed when it finishes."""
+        job = self.jobs.pop(job_id, None)
+        if job is not None and job["status"] != "running":
+            self._remove_files(job)
+        return job
+
+    def prune(self):
+        """Deletes finished jobs older than `max_age` and beyond the newest `keep_finished`."""
+        finished = sorted((j for j in self.jobs.values() if j["done"].is_set()),
+                          key=lambda j: j["finished"], reverse=True)
+        expired = finished[self.keep_finished:]
+        if self.max_age is not None:
+            cutoff = time.time() - self.max_age
+            expired += [j for j in finished[:self.keep_finished] if j["finished"] < cutoff]
+        for job in expired:
+            self.delete(job["id"])
+        return len(expired)
+
+    @staticmethod
+    def _remove_files(job):
+        shutil.rmtree(os.path.dirname(job["pdf"]), ignore_errors=True)
+
+    # --- Request handling ---
+    async def handle(self, reader, writer):
+        try:
+            method, path, query, headers = await read_request(reader)
+            await self.route(method, path, query, headers, reader, writer)
+        except HTTPError as e:
+            await send_response(writer, e.status, {"error": e.message}, headers=e.headers)
+        except (ConnectionError, asyncio.IncompleteReadError):
+            pass
+        except Exception as e:
+            await send_response(writer, 500, {"error": f"{type(e).__name__}: {e}"})
+        finally:
+            try:
+                writer.close()
+                await writer.wait_closed()
+            except ConnectionError:
+                pass
+
+    async def route(self, method, path, query, headers, reader, writer):
+        parts = path.strip("/").split("/")
+
+        if path == "/health":
+            await send_response(writer, 200, {
+                "workers": self.workers, "queued": self.queue.qsize(),
+                "capacity": self.queue.maxsize,
+                "running": sum(1 for j in self.jobs.values() if j["status"] == "running"),
+                "jobs": len(self.jobs)})
+            return
+
+        if parts == ["jobs"]:
+            if method == "GET":
+                await send_response(writer, 200, [self.describe(j) for j in self.jobs.values()])
+                return
+            if method != "POST":
+                raise HTTPError(405, "Use POST to upload a PDF")
+            filename, data = await self._read_upload(query, headers, reader)
+            job = self.submit(filename, data)
+            await send_response(writer, 202, self.describe(job), headers={"Location": f"/jobs/{job['id']}"})
+            return
+
+        if len(parts) in (2, 3) and parts[0] == "jobs":
+            job = self.jobs.get(parts[1])
+            if job is None:
+                raise HTTPError(404, "Unknown job")
+
+            if len(parts) == 2:
+                if method == "DELETE":
+                    self.delete(job["id"])
+                    await send_response(writer, 200, {"deleted": job["id"]})
+                elif method == "GET":
+                    await send_response(writer, 200, self.describe(job))
+                else:
+                    raise HTTPError(405, "Use GET or DELETE")
+                return
+
+            if parts[2] == "kml" and method == "GET":
+                # ?wait=<seconds> holds the request until the job finishes (long polling)
+                wait = _parse_wait(query)
+                if wait > 0 and not job["done"].is_set():
+                    try:
+                        await asyncio.wait_for(job["done"].wait(), wait)
+                    except asyncio.TimeoutError:
+                        pass
+                if not job["done"].is_set():
+                    await send_response(writer, 202, self.describe(job), headers={"Retry-After": "5"})
+                elif job["kml"] and os.path.exists(job["kml"]):
+                    await send_file(writer, job["kml"], "application/vnd.google-earth.kml+xml",
+                                    os.path.basename(job["kml"]))
+                else:
+                    raise HTTPError(409, f"Job finished without a KML: {job['error'] or job['status']}")
+                return
+
+        raise HTTPError(404, "Not found")
+
+    async def _read_upload(self, query, headers, reader):
+        if "content-length" not in headers:
+            raise HTTPError(411, "Content-Length is required")
+        length = int(headers["content-length"])
+        if length > self.max_upload:
+            raise HTTPError(413, f"Uploads are limited to {self.max_upload} bytes")
+        body = await reader.readexactly(length)
+
+        content_type = headers.get("content-type", "application/pdf")
+        if content_type.startswith("multipart/form-data"):
+            filename, data = _extract_multipart_pdf(content_type, body)
+        else:
+            filename, data = query.get("name", ["upload.pdf"])[0], body
+        if not data.startswith(b"%PDF"):
+            raise HTTPError(400, "Upload is not a PDF")
+        return filename, data
+
+
+async def serve(host, port, service):
+    await service.start()
+    server = await asyncio.start_server(service.handle, host, port)
+    print(f"Serving PDF -> KML jobs on http://{host}:{port} with {service.workers} worker(s)")
+    try:
+        async with server:
+            await server.serve_forever()
+    finally:
+        await service.stop()
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Local HTTP service that converts uploaded PDFs to KML.")
+    parser.add_argument("--host", default="127.0.0.1", help="Interface to bind (default: localhost only)")
+    parser.add_argument("--port", type=int, default=8080)
+    parser.add_argument("-d", "--work-dir", default="jobs", help="Directory for uploads and results")
+    parser.add_argument("-j", "--workers", type=int, default=None, help="Worker processes")
+    parser.add_argument("--max-queue", type=int, default=100, help="Jobs allowed to wait before uploads get 503")
+    parser.add_argument("--max-upload-mb", type=float, default=200)
+    parser.add_argument("-t", "--timeout", type=float, default=None, help="Per-job timeout in seconds")
+    parser.add_argument("--keep-finished", type=int, default=1000,
+                        help="Finished jobs kept for download before the oldest are deleted")
+    parser.add_argument("--max-age", type=float, default=None,
+                        help="Delete finished jobs this many seconds after they finish")
+    parser.add_argument("-e", "--engine", choices=["auto", "direct", "docx"], default="auto")
+    parser.add_argument("--cache-dir", default=None, help="Directory of the conversion cache")
+    parser.add_argument("--page-window", type=int, default=None,
+                        help="Convert long PDFs this many pages at a time to bound memory")
+    args = parser.parse_args(argv)
+
+    async def run():
+        service = JobService(args.work_dir, args.workers, args.max_queue, args.max_upload_mb,
+                             args.timeout, {"engine": args.engine, "cache_dir": args.cache_dir,
+                              "page_window": args.page_window},
+                             args.keep_finished, args.max_age)
+        await serve(args.host, args.port, service)
+
+    try:
+        asyncio.run(run())
+    except KeyboardInterrupt:
+        pass
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main())
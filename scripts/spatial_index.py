@@ -0,0 +1,434 @@
+import os
+import sys
+import argparse
+
+import numpy as np
+
+from geometry import segments_intersect
+
+NODE_SIZE = 8
+# Pairs/edges handled per vectorized step; bounds the temporary arrays
+CHUNK_SIZE = 1 << 22
+
+# --- STR packing ---
+def polygon_bboxes(x, y, offsets):
+    """(n, 4) array of [minx, miny, maxx, maxy] for the polygons described by offsets."""
+    starts = offsets[:-1]
+    boxes = np.full((len(starts), 4), np.nan)
+    nonempty = np.diff(offsets) > 0
+    if len(x) and nonempty.any():
+        s = starts[nonempty]
+        boxes[nonempty, 0] = np.minimum.reduceat(x, s)
+        boxes[nonempty, 1] = np.minimum.reduceat(y, s)
+        boxes[nonempty, 2] = np.maximum.reduceat(x, s)
+        boxes[nonempty, 3] = np.maximum.reduceat(y, s)
+    return boxes
+
+def str_order(boxes, node_size=NODE_SIZE):
+    """
+    Sort-Tile-Recursive order of the boxes: vertical slabs by center x, then
+    center y within each slab, so that every run of `node_size` consecutive
+    boxes is spatially compact.
+    """
+    n = len(boxes)
+    if n <= node_size:
+        return np.arange(n)
+    cx = boxes[:, 0] + boxes[:, 2]
+    cy = boxes[:, 1] + boxes[:, 3]
+    n_leaves = -(-n // node_size)
+    n_slabs = int(np.ceil(np.sqrt(n_leaves)))
+    slab_len = -(-n_leaves // n_slabs) * node_size
+    order = np.argsort(cx, kind="stable")
+    slab = np.arange(n) // slab_len
+    return order[np.lexsort((cy[order], slab))]
+
+def pack_levels(boxes, node_size=NODE_SIZE):
+    """
+    Builds the node boxes of a packed tree over `boxes` (already in STR order).
+
+    Node i of a level covers the children i*node_size:(i+1)*node_size of the
+    level below, so no child pointers are stored.
+
+    Returns:
+        list: Box arrays from the leaves (levels[0] == boxes) up to the root.
+    """
+    levels = [boxes]
+    while len(levels[-1]) > 1:
+        b = levels[-1]
+        starts = np.arange(0, len(b), node_size)
+        levels.append(np.column_stack([np.minimum.reduceat(b[:, 0], starts),
+                                       np.minimum.reduceat(b[:, 1], starts),
+                                       np.maximum.reduceat(b[:, 2], starts),
+                                       np.maximum.reduceat(b[:, 3], starts)]))
+    return levels
+
+
+class _PackedTree:
+    # Static STR tree over a contiguous range of polygons [first, first + len(order))
+    def __init__(self, boxes, first=0, order=None, levels=None, node_size=NODE_SIZE):
+        self.first = first
+        self.node_size = node_size
+        if order is None:
+            order = str_order(boxes, node_size)
+            levels = pack_levels(boxes[order], node_size)
+        self.order = order
+        self.levels = levels
+        self._columns = [tuple(np.ascontiguousarray(b[:, i]) for i in range(4)) for b in levels]
+
+    def search(self, queries):
+        """Returns (query_index, polygon_index) pairs whose boxes intersect."""
+        empty = np.empty(0, dtype=np.int64)
+        if len(self.order) == 0 or len(queries) == 0:
+            return empty, empty
+        # One contiguous column per box side; gathering 1-D arrays is much
+        # cheaper than gathering rows of an (n, 4) array
+        qminx, qminy, qmaxx, qmaxy = (np.ascontiguousarray(queries[:, i]) for i in range(4))
+        q = np.arange(len(queries))
+        node = np.zeros(len(queries), dtype=np.int64)
+        for depth in range(len(self.levels) - 1, -1, -1):
+            minx, miny, maxx, maxy = self._columns[depth]
+            hit = minx[node] <= qmaxx[q]
+            q, node = q[hit], node[hit]
+            hit = maxx[node] >= qminx[q]
+            q, node = q[hit], node[hit]
+            hit = (miny[node] <= qmaxy[q]) & (maxy[node] >= qminy[q])
+            q, node = q[hit], node[hit]
+            if depth == 0 or len(q) == 0:
+                break
+            child = node[:, None] * self.node_size + np.arange(self.node_size)
+            valid = child < len(self.levels[depth - 1])
+            q = np.broadcast_to(q[:, None], child.shape)[valid]
+            node = child[valid]
+        if len(q) == 0:
+            return empty, empty
+        return q, self.order[node] + self.first
+
+
+# --- Exact geometric tests ---
+def _points_in_polygons(x, y, offsets, px, py, poly):
+    """
+    Even-odd test of point k against polygon poly[k], vectorized over every
+    (point, edge) pair. Rings may be given closed or open.
+    """
+    starts = offsets[poly]
+    counts = offsets[poly + 1] - starts
+    inside = np.zeros(len(poly), dtype=bool)
+    # Chunk the pairs so that the expanded edge arrays stay bounded
+    cum = np.cumsum(counts)
+    lo = 0
+    while lo < len(poly):
+        base = cum[lo - 1] if lo else 0
+        hi = max(lo + 1, int(np.searchsorted(cum, base + CHUNK_SIZE, side="right")))
+        c = counts[lo:hi]
+        pair = np.repeat(np.arange(lo, hi), c)
+        local = np.arange(len(pair)) - np.repeat(np.cumsum(c) - c, c)
+        j = starts[pair] + local
+        prev = np.where(local == 0, starts[pair] + counts[pair] - 1, j - 1)
+        xi, yi, xj, yj = x[j], y[j], x[prev], y[prev]
+        qx, qy = px[pair], py[pair]
+        straddles = (yi > qy) != (yj > qy)
+        with np.errstate(divide="ignore", invalid="ignore"):
+            cross_x = (xj - xi) * (qy - yi) / (yj - yi) + xi
+        crossings = straddles & (qx < cross_x)
+        inside[lo:hi] = np.bincount(pair - lo, weights=crossings, minlength=hi - lo) % 2 == 1
+        lo = hi
+    return inside
+
+
+class SpatialIndex:
+    """
+    Persistent spatial index over extracted polygons.
+
+    Polygons are stored the same way as in a CoordinateSet (flat x/y arrays
+    split by offsets), each tagged with its source document and its polygon
+    number in that document. Their bounding boxes are bulk-loaded into an
+    STR-packed tree; polygons added later go to a small second tree that is
+    repacked on every add and merged into the main one once it grows past
+    `merge_ratio` of it. Removed documents are masked until the next merge.
+
+    Coordinates are kept as extracted (UTM meters); queries must use the
+    same CRS.
+
+    Args:
+        node_size (int, optional): Children per tree node. Defaults to 8.
+        merge_ratio (float, optional): Size of the delta tree, relative to
+                                       the main one, that triggers a full
+                                       repack. Defaults to 0.125.
+    """
+
+    def __init__(self, node_size=NODE_SIZE, merge_ratio=0.125):
+        self.node_size = node_size
+        self.merge_ratio = merge_ratio
+        self.docs = []
+        self._doc_ids = {}
+        self.x = np.empty(0)
+        self.y = np.empty(0)
+        self.offsets = np.zeros(1, dtype=np.int64)
+        self.doc = np.empty(0, dtype=np.int64)
+        self.part = np.empty(0, dtype=np.int64)
+        self.alive = np.empty(0, dtype=bool)
+        self.boxes = np.empty((0, 4))
+        self._main = _PackedTree(self.boxes, 0, node_size=node_size)
+        self._delta = _PackedTree(self.boxes, 0, node_size=node_size)
+
+    def __len__(self):
+        return int(self.alive.sum())
+
+    # --- Updates ---
+    def add(self, source, coordset):
+        """
+        Adds (or replaces) the polygons of one document.
+
+        Args:
+            source (str): Document identifier, e.g. the PDF path.
+            coordset (CoordinateSet): Its polygons. Anything with x, y and
+                                      offsets arrays works.
+        """
+        self.add_many([(source, coordset)])
+
+    def add_many(self, items):
+        """
+        Adds (or replaces) several documents with a single concatenation,
+        which is much cheaper than calling add() in a loop.
+
+        Args:
+            items (iterable): (source, coordset) pairs.
+        """
+        items = list(items)
+        self.remove_many([source for source, _ in items])
+        xs, ys, offs, docs, parts, boxes = [], [], [], [], [], []
+        base = self.offsets[-1]
+        for source, coordset in items:
+            x = np.asarray(coordset.x, dtype=np.float64)
+            y = np.asarray(coordset.y, dtype=np.float64)
+            offsets = np.asarray(coordset.offsets, dtype=np.int64)
+            n_new = len(offsets) - 1
+            if n_new == 0:
+                continue
+            doc_id = self._doc_ids.get(source)
+            if doc_id is None:
+                doc_id = self._doc_ids[source] = len(self.docs)
+                self.docs.append(source)
+            xs.append(x)
+            ys.append(y)
+            offs.append(offsets[1:] + base)
+            base += offsets[-1]
+            docs.append(np.full(n_new, doc_id))
+            parts.append(np.arange(1, n_new + 1))
+            boxes.append(polygon_bboxes(x, y, offsets))
+        if not xs:
+            return
+
+        self.x = np.concatenate([self.x] + xs)
+        self.y = np.concatenate([self.y] + ys)
+        self.offsets = np.concatenate([self.offsets] + offs)
+        self.doc = np.concatenate([self.doc] + docs)
+        self.part = np.concatenate([self.part] + parts)
+        self.alive = np.concatenate([self.alive, np.ones(len(self.doc) - len(self.alive), dtype=bool)])
+        self.boxes = np.concatenate([self.boxes] + boxes)
+
+        n_main = len(self._main.order)
+        if len(self.boxes) - n_main > self.merge_ratio * n_main:
+            self.repack()
+        else:
+            self._delta = _PackedTree(self.boxes[n_main:], n_main, node_size=self.node_size)
+
+    def remove(self, source):
+        """Masks the polygons of a document; returns how many were removed."""
+        return self.remove_many([source])
+
+    def remove_many(self, sources):
+        """Masks the polygons of several documents; returns how many were removed."""
+        ids = [self._doc_ids[s] for s in sources if s in self._doc_ids]
+        if not ids:
+            return 0
+        mask = self.alive & np.isin(self.doc, ids)
+        self.alive[mask] = False
+        return int(mask.sum())
+
+    def repack(self):
+        """Drops removed polygons and bulk-loads everything into one tree."""
+        keep = np.flatnonzero(self.alive)
+        if len(keep) != len(self.alive):
+            counts = np.diff(self.offsets)[keep]
+            vertex_mask = np.repeat(self.alive, np.diff(self.offsets))
+            self.x, self.y = self.x[vertex_mask], self.y[vertex_mask]
+            self.offsets = np.zeros(len(keep) + 1, dtype=np.int64)
+            np.cumsum(counts, out=self.offsets[1:])
+            self.doc, self.part, self.boxes = self.doc[keep], self.part[keep], self.boxes[keep]
+            self.alive = np.ones(len(keep), dtype=bool)
+        self._main = _PackedTree(self.boxes, 0, node_size=self.node_size)
+        self._delta = _PackedTree(self.boxes[len(self.boxes):], len(self.boxes), node_size=self.node_size)
+
+    # --- Queries ---
+    def query_bbox(self, boxes):
+        """
+        Finds the polygons whose bounding box intersects each query box.
+
+        Args:
+            boxes (array-like): (m, 4) array of [minx, miny, maxx, maxy].
+
+        Returns:
+            tuple: (query_index, polygon_index) int64 arrays, one entry per hit.
+        """
+        boxes = np.atleast_2d(np.asarray(boxes, dtype=np.float64))
+        q_main, p_main = self._main.search(boxes)
+        q_delta, p_delta = self._delta.search(boxes)
+        q = np.concatenate([q_main, q_delta])
+        p = np.concatenate([p_main, p_delta])
+        keep = self.alive[p]
+        return q[keep], p[keep]
+
+    def contains(self, px, py):
+        """
+        Batched point-in-polygon: which polygons contain each point.
+
+        Args:
+            px, py (array-like): Point coordinates.
+
+        Returns:
+            tuple: (point_index, polygon_index) int64 arrays, one entry per
+                   (point, containing polygon) pair.
+        """
+        px = np.atleast_1d(np.asarray(px, dtype=np.float64))
+        py = np.atleast_1d(np.asarray(py, dtype=np.float64))
+        q, p = self.query_bbox(np.column_stack([px, py, px, py]))
+        inside = _points_in_polygons(self.x, self.y, self.offsets, px[q], py[q], p)
+        return q[inside], p[inside]
+
+    def overlapping(self, qx, qy):
+        """
+        Polygons that overlap (intersect or touch) the query polygon.
+
+        Args:
+            qx, qy (array-like): Vertices of the query ring, e.g. a concession.
+
+        Returns:
+            numpy.ndarray: Sorted polygon indices.
+        """
+        qx = np.asarray(qx, dtype=np.float64)
+        qy = np.asarray(qy, dtype=np.float64)
+        if len(qx) == 0:
+            return np.empty(0, dtype=np.int64)
+        _, cand = self.query_bbox([[qx.min(), qy.min(), qx.max(), qy.max()]])
+        if len(cand) == 0:
+            return cand
+        hit = np.zeros(len(cand), dtype=bool)
+
+        # A vertex of a candidate inside the query ring
+        q_offsets = np.array([0, len(qx)], dtype=np.int64)
+        starts = self.offsets[cand]
+        counts = self.offsets[cand + 1] - starts
+        owner = np.repeat(np.arange(len(cand)), counts)
+        local = np.arange(len(owner)) - np.repeat(np.cumsum(counts) - counts, counts)
+        vertex = starts[owner] + local
+        prev = np.where(local == 0, starts[owner] + counts[owner] - 1, vertex - 1)
+        inside = _points_in_polygons(qx, qy, q_offsets, self.x[vertex], self.y[vertex],
+                                     np.zeros(len(vertex), dtype=np.int64))
+        hit[np.unique(owner[inside])] = True
+
+        # A vertex of the query ring inside a candidate (query fully within it)
+        rest = np.flatnonzero(~hit)
+        if len(rest):
+            inside = _points_in_polygons(self.x, self.y, self.offsets,
+                                         np.full(len(rest), qx[0]), np.full(len(rest), qy[0]), cand[rest])
+            hit[rest[inside]] = True
+
+        # Crossing edges
+        rest = np.flatnonzero(~hit)
+        if len(rest):
+            sel = np.isin(owner, rest)
+            e_owner, e_vertex, e_prev = owner[sel], vertex[sel], prev[sel]
+            qpx, qpy = np.roll(qx, 1), np.roll(qy, 1)
+            step = max(1, CHUNK_SIZE // len(qx))
+            for lo in range(0, len(e_vertex), step):
+                sl = slice(lo, lo + step)
+                a, b = e_vertex[sl, None], e_prev[sl, None]
+                crosses = segments_intersect(self.x[a], self.y[a], self.x[b], self.y[b],
+                                             qx[None, :], qy[None, :], qpx[None, :], qpy[None, :])
+                hit[np.unique(e_owner[sl][crosses.any(axis=1)])] = True
+        return np.sort(cand[hit])
+
+    def info(self, polygons):
+        """DataFrame with the source document, polygon number and box of each polygon index."""
+        import pandas as pd
+
+        polygons = np.asarray(polygons, dtype=np.int64)
+        docs = np.asarray(self.docs, dtype=object)
+        b = self.boxes[polygons]
+        return pd.DataFrame({"index": polygons, "source": docs[self.doc[polygons]],
+                             "polygon": self.part[polygons], "minx": b[:, 0], "miny": b[:, 1],
+                             "maxx": b[:, 2], "maxy": b[:, 3]})
+
+    # --- Persistence ---
+    def save(self, path):
+        """Writes the index to a .npz file (atomically)."""
+        directory = os.path.dirname(os.path.abspath(path))
+        os.makedirs(directory, exist_ok=True)
+        tmp = path + ".tmp"
+        levels = self._main.levels
+        with open(tmp, "wb") as f:
+            np.savez(f, x=self.x, y=self.y, offsets=self.offsets, doc=self.doc, part=self.part,
+                     alive=self.alive, boxes=self.boxes, docs=np.asarray(self.docs, dtype=str),
+                     node_size=self.node_size, merge_ratio=self.merge_ratio,
+                     main_order=self._main.order, main_levels=np.concatenate(levels),
+                     main_level_sizes=np.array([len(b) for b in levels], dtype=np.int64))
+        os.replace(tmp, path)
+
+    @classmethod
+    def load(cls, path):
+        """Reads an index written by save(); the main tree is not rebuilt."""
+        with np.load(path, allow_pickle=False) as data:
+            index = cls(int(data["node_size"]), float(data["merge_ratio"]))
+            for name in ("x", "y", "offsets", "doc", "part", "alive", "boxes"):
+                setattr(index, name, data[name])
+            index.docs = [str(d) for d in data["docs"]]
+            sizes = data["main_level_sizes"]
+            levels = np.split(data["main_levels"], np.cumsum(sizes)[:-1])
+            index._main = _PackedTree(None, 0, data["main_order"], levels, index.node_size)
+        index._doc_ids = {d: i for i, d in enumerate(index.docs)}
+        n_main = len(index._main.order)
+        index._delta = _PackedTree(index.boxes[n_main:], n_main, node_size=index.node_size)
+        return index
+
+    @classmethod
+    def open(cls, path, **kwargs):
+        """Loads `path` if it exists, otherwise returns a new empty index."""
+        return cls.load(path) if os.path.exists(path) else cls(**kwargs)
+
+    def __repr__(self):
+        return (f"SpatialIndex({len(self)} polygon(s) from {len(set(self.doc[self.alive].tolist()))} "
+                f"document(s), {len(self.x)} vertices)")
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Query a spatial index built by 'batch --index'.")
+    parser.add_argument("index", help="Index file (.npz)")
+    parser.add_argument("--point", nargs=2, type=float, action="append", metavar=("X", "Y"),
+                        help="Polygons containing this UTM point (repeatable)")
+    parser.add_argument("--bbox", nargs=4, type=float, metavar=("MINX", "MINY", "MAXX", "MAXY"),
+                        help="Polygons whose bounding box intersects this box")
+    parser.add_argument("--overlaps", default=None,
+                        help="CSV with 'x' and 'y' columns of a ring; polygons overlapping it")
+    args = parser.parse_args(argv)
+
+    index = SpatialIndex.load(args.index)
+    print(index)
+    if args.point:
+        pts = np.asarray(args.point)
+        q, p = index.contains(pts[:, 0], pts[:, 1])
+        df = index.info(p)
+        df.insert(0, "x", pts[q, 0])
+        df.insert(1, "y", pts[q, 1])
+        print(df.to_string(index=False))
+    if args.bbox:
+        _, p = index.query_bbox([args.bbox])
+        print(index.info(np.sort(p)).to_string(index=False))
+    if args.overlaps:
+        import pandas as pd
+        ring = pd.read_csv(args.overlaps)
+        print(index.info(index.overlapping(ring["x"], ring["y"])).to_string(index=False))
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -1,6 +1,7 @@
 import numpy as np
 import pandas as pd
-import matplotlib.pyplot as plt
+
+import metrics
 
 # --- Shoelace Formula for Polygon Area ---
 def calculate_polygon_area(x, y):
@@ -28,125 +29,320 @@ def calculate_polygon_area(x, y):
     # area = 0.5 * abs(area)
     return area
 
+# --- Batched Shoelace Formula for many polygons ---
+def calculate_polygon_areas(x, y, offsets, signed=False):
+    """
+    Calculates the area of every polygon in one vectorized call.
+
+    Polygon k is made of the vertices offsets[k]:offsets[k+1] of the flat
+    x and y arrays. Same result as calling calculate_polygon_area on each
+    slice (including its implicit closing edge), without a Python loop.
+
+    Args:
+        x, y (array-like): Flat vertex coordinates of all polygons.
+        offsets (array-like): Polygon boundaries, length n_polygons + 1.
+        signed (bool, optional): Keep the sign of the shoelace sum: positive
+                                 for counter-clockwise rings, negative for
+                                 clockwise ones. Defaults to False.
+
+    Returns:
+        numpy.ndarray: Areas in square input units; 0.0 for polygons with
+                       fewer than 3 vertices.
+    """
+    x = np.asarray(x, dtype=np.float64)
+    y = np.asarray(y, dtype=np.float64)
+    offsets = np.asarray(offsets, dtype=np.int64)
+    starts, ends = offsets[:-1], offsets[1:]
+    counts = ends - starts
+    areas = np.zeros(len(counts))
+    if len(x) == 0 or len(counts) == 0:
+        return areas
+
+    # Shift to a local origin: the formula is translation invariant and UTM
+    # values (~1e7) would otherwise lose precision in the products.
+    x = x - x[0]
+    y = y - y[0]
+
+    # Previous vertex of each vertex, wrapping around within its polygon (np.roll(., 1))
+    prev = np.arange(len(x)) - 1
+    nonempty = counts > 0
+    prev[starts[nonempty]] = ends[nonempty] - 1
+
+    cross = x * y[prev] - y * x[prev]
+    sums = np.add.reduceat(cross, starts[nonempty])
+    # cross sums x[i] * y[i-1] - y[i] * x[i-1], the negative of the usual
+    # counter-clockwise-positive orientation
+    areas[nonempty] = -0.5 * sums if signed else 0.5 * np.abs(sums)
+    areas[counts < 3] = 0.0 # A polygon needs at least 3 vertices
+    return areas
+
 # --- Logic to Detect Polygons ---
-polygons = []
-polygon_areas_sq_units = [] # To store calculated areas in original square units
-polygon_areas_hectares = [] # To store calculated areas in hectares
-current_polygon_indices = []
-start_point = None
-start_index = -1 # Keep track of the index of the start point
-
-if not df.empty:
-    for index, row in df.iterrows():
-        current_point = (row['x'], row['y'])
-
-        if start_point is None:
-            # Start of a new potential polygon
-            start_point = current_point
-            start_index = index
-            current_polygon_indices.append(index)
-        else:
-            # Continue current polygon
-            current_polygon_indices.append(index)
-            # Check if this point closes the polygon (matches start_point and is not the start_point itself)
-            if current_point == start_point and index != start_index:
-                # Polygon closed, store it
-                poly_df = df.loc[current_polygon_indices].copy()
-                polygons.append(poly_df)
-
-                # --- Calculate Area ---
-                # Extract coordinates for area calculation
-                # Important: Don't include the repeated closing point twice for area calc if needed,
-                # but the Shoelace formula handles it correctly even if included.
-                # Let's use all points as detected for simplicity.
-                x_coords = poly_df['x'].values
-                y_coords = poly_df['y'].values
-
-                if len(x_coords) >= 3:
-                    area_sq_units = calculate_polygon_area(x_coords, y_coords)
-                    # ASSUMPTION: Coordinates are in meters. 1 Hectare = 10,000 sq meters
-                    area_hectares = area_sq_units / 10000.0
-                else:
-                    area_sq_units = 0.0
-                    area_hectares = 0.0
-
-                polygon_areas_sq_units.append(area_sq_units)
-                polygon_areas_hectares.append(area_hectares)
-                # --- End Area Calculation ---
-
-                # Reset for the next potential polygon
-                current_polygon_indices = []
-                start_point = None
-                start_index = -1
-
-    # If there are remaining points after the loop, they form the last polygon
-    if current_polygon_indices:
-        poly_df = df.loc[current_polygon_indices].copy()
-        polygons.append(poly_df)
-         # --- Calculate Area for the last (potentially unclosed) polygon ---
-         # The Shoelace formula calculates area based on the sequence of vertices,
-         # implicitly closing the polygon from the last to the first point.
-        x_coords = poly_df['x'].values
-        y_coords = poly_df['y'].values
-
-        if len(x_coords) >= 3:
-            area_sq_units = calculate_polygon_area(x_coords, y_coords)
-            # ASSUMPTION: Coordinates are in meters. 1 Hectare = 10,000 sq meters
-            area_hectares = area_sq_units / 10000.0
+def find_polygon_offsets(x, y):
+    """
+    Splits a flat sequence of vertices into polygons.
+
+    A polygon starts at a vertex and ends (inclusive) at the next vertex with
+    exactly the same coordinates; the following vertex starts a new polygon.
+    Vertices left over after the last closing vertex form a final, possibly
+    unclosed polygon.
+
+    The "next identical vertex" of every point is found with one lexsort,
+    so only one Python step per polygon remains.
+
+    Args:
+        x, y (array-like): Vertex coordinates in file order.
+
+    Returns:
+        numpy.ndarray: int64 offsets of length n_polygons + 1. Polygon k is
+                       x[offsets[k]:offsets[k+1]] (a view, not a copy).
+    """
+    x = np.asarray(x)
+    y = np.asarray(y)
+    n = len(x)
+    if n == 0:
+        return np.zeros(1, dtype=np.int64)
+
+    # Sort by coordinates, keeping file order among identical points
+    order = np.lexsort((np.arange(n), y, x))
+    same = (x[order[1:]] == x[order[:-1]]) & (y[order[1:]] == y[order[:-1]])
+    next_same = np.full(n, -1, dtype=np.int64)
+    next_same[order[:-1][same]] = order[1:][same]
+
+    offsets = [0]
+    start = 0
+    while start < n:
+        end = next_same[start]
+        if end < 0:
+            offsets.append(n) # Remaining points form the last polygon
+            break
+        offsets.append(end + 1)
+        start = end + 1
+    return np.asarray(offsets, dtype=np.int64)
+
+def iter_polygons(x, y, offsets):
+    """Yields (x, y) views of each polygon described by `offsets`."""
+    for a, b in zip(offsets[:-1], offsets[1:]):
+        yield x[a:b], y[a:b]
+
+def detect_polygons(df):
+    """
+    Detects the polygons in a DataFrame with 'x' and 'y' columns and
+    computes their areas. A coordset.CoordinateSet is used as it is, with
+    its own polygon offsets.
+
+    Args:
+        df (pandas.DataFrame | CoordinateSet): Vertices in file order.
+
+    Returns:
+        tuple: (x, y, offsets, areas_sq_units). x and y are the flat float
+               arrays, offsets the polygon boundaries (see
+               find_polygon_offsets) and areas_sq_units one area per polygon.
+    """
+    from coordset import CoordinateSet # coordset imports this module
+
+    with metrics.stage("segmentation") as st:
+        if isinstance(df, CoordinateSet):
+            x, y, offsets = df.x, df.y, df.offsets
         else:
-            area_sq_units = 0.0
-            area_hectares = 0.0
-
-        polygon_areas_sq_units.append(area_sq_units)
-        polygon_areas_hectares.append(area_hectares)
-        # --- End Area Calculation ---
-
-# --- Analysis and Plotting ---
-
-num_polygons = len(polygons)
-
-print("-" * 30) # Separator
-if num_polygons > 1:
-    print(f"Found {num_polygons} polygons in the DataFrame.")
-elif num_polygons == 1:
-    print("Found 1 polygon in the DataFrame.")
-else:
-    print("Found no complete polygons based on the closing rule.")
-print("-" * 30) # Separator
-
-# Print Areas
-if num_polygons > 0:
-    print("Calculated Polygon Areas:")
-    print("NOTE: Assumes input coordinates are in METERS.")
-    for i in range(num_polygons):
-        print(f"  Polygon {i+1}: {polygon_areas_sq_units[i]:,.2f} sq. units "
-              f"({polygon_areas_hectares[i]:,.4f} Hectares)")
-    print("-" * 30) # Separator
+            x = df['x'].to_numpy(dtype=np.float64)
+            y = df['y'].to_numpy(dtype=np.float64)
+            offsets = find_polygon_offsets(x, y)
+        areas = calculate_polygon_areas(x, y, offsets)
+        st.count(vertices=len(x), polygons=len(offsets) - 1)
+    return x, y, offsets, areas
 
+# --- Fast rendering for many polygons ---
+def decimate_polygons(x, y, offsets, tolerance):
+    """
+    Drops vertices that fall in the same `tolerance`-sized grid cell as the
+    previous kept vertex of their polygon. The first and last vertex of
+    every polygon are always kept. Meant for overview plots, not for areas.
 
-# --- Plotting ---
-if num_polygons > 0:
-    fig, ax = plt.subplots(figsize=(12, 12)) # Adjust figure size as needed
-    colors = plt.cm.viridis(np.linspace(0, 1, max(1, num_polygons))) # Get distinct colors
+    Args:
+        x, y (array-like): Flat vertex coordinates.
+        offsets (array-like): Polygon boundaries, length n_polygons + 1.
+        tolerance (float): Cell size, in coordinate units.
 
-    total_area_ha = 0
-    for i, poly_df in enumerate(polygons):
-        area_ha = polygon_areas_hectares[i]
-        total_area_ha += area_ha
-        # Include area in the label for the legend
-        label = f'Polygon {i+1} ({area_ha:.4f} Ha)'
-        # Plot lines connecting vertices
-        ax.plot(poly_df['x'], poly_df['y'], marker='o', linestyle='-', label=label, color=colors[i])
+    Returns:
+        tuple: (x, y, offsets) of the decimated polygons.
+    """
+    x = np.asarray(x, dtype=np.float64)
+    y = np.asarray(y, dtype=np.float64)
+    offsets = np.asarray(offsets, dtype=np.int64)
+    if len(x) == 0 or not tolerance:
+        return x, y, offsets
+    cx = np.floor((x - x.min()) / tolerance)
+    cy = np.floor((y - y.min()) / tolerance)
+    keep = np.ones(len(x), dtype=bool)
+    keep[1:] = (cx[1:] != cx[:-1]) | (cy[1:] != cy[:-1])
+    counts = np.diff(offsets)
+    nonempty = counts > 0
+    keep[offsets[:-1][nonempty]] = True
+    keep[offsets[1:][nonempty] - 1] = True
+    kept = np.zeros(len(counts), dtype=np.int64)
+    kept[nonempty] = np.add.reduceat(keep, offsets[:-1][nonempty])
+    new_offsets = np.zeros(len(offsets), dtype=np.int64)
+    np.cumsum(kept, out=new_offsets[1:])
+    return x[keep], y[keep], new_offsets
+
+def render_polygons(data, output, decimate=None, figsize=(12, 12), dpi=150, top=10, cmap="viridis"):
+    """
+    Draws every polygon in a single PolyCollection and writes the figure
+    to `output` (PNG, SVG, PDF... by extension) without a display.
+
+    Polygons are colored by area with a colorbar, and an area summary
+    (count, total, min/median/max and the `top` largest polygons) replaces
+    the per-polygon legend, so thousands of parcels render in seconds.
+
+    Args:
+        data (pandas.DataFrame | CoordinateSet): Vertices with 'x' and 'y'
+                                                 columns, in meters.
+        output (str): Image file to write.
+        decimate (float | str, optional): Grid size in meters for vertex
+                                          decimation (see decimate_polygons),
+                                          or "auto" for about one output
+                                          pixel. Defaults to None (all vertices).
+        figsize (tuple, optional): Figure size in inches. Defaults to (12, 12).
+        dpi (int, optional): Resolution of raster outputs. Defaults to 150.
+        top (int, optional): Largest polygons listed in the summary. Defaults to 10.
+        cmap (str, optional): Matplotlib colormap for the areas.
+
+    Returns:
+        dict: 'polygons', 'vertices' and 'drawn_vertices' counts.
+    """
+    # The object API with an Agg canvas never touches pyplot's global state
+    # or the configured interactive backend
+    from matplotlib.figure import Figure
+    from matplotlib.backends.backend_agg import FigureCanvasAgg
+    from matplotlib.collections import PolyCollection
+
+    x, y, offsets, areas = detect_polygons(data)
+    areas_ha = areas / 10000.0
+    num_polygons = len(offsets) - 1
+
+    if decimate == "auto" and len(x):
+        extent = max(x.max() - x.min(), y.max() - y.min())
+        decimate = extent / (max(figsize) * dpi)
+    dx, dy, d_offsets = decimate_polygons(x, y, offsets, decimate) if decimate else (x, y, offsets)
+
+    fig = Figure(figsize=figsize)
+    FigureCanvasAgg(fig)
+    ax = fig.add_axes([0.08, 0.30, 0.80, 0.65])
+
+    if num_polygons:
+        points = np.column_stack([dx, dy])
+        verts = np.split(points, d_offsets[1:-1]) # Views, one per polygon
+        collection = PolyCollection(verts, array=areas_ha, cmap=cmap, edgecolors="black",
+                                    linewidths=0.3 if num_polygons < 1000 else 0.05, alpha=0.8)
+        ax.add_collection(collection)
+        ax.autoscale_view()
+        fig.colorbar(collection, ax=ax, fraction=0.04, pad=0.02, label="Area (Ha)")
 
     ax.set_xlabel("X-coordinate (meters)")
     ax.set_ylabel("Y-coordinate (meters)")
-    title = f"Detected Polygons ({num_polygons} found)"
-    if num_polygons > 0 :
-         title += f" - Total Area: {total_area_ha:.4f} Ha"
-    ax.set_title(title)
-    ax.grid(True)
-    ax.legend()
-    # Use 'equal' aspect ratio for correct shape representation
-    ax.set_aspect('equal', adjustable='box')
-    plt.show()
-else:print("No polygons to plot.")
+    ax.set_title(f"Detected Polygons ({num_polygons} found) - Total Area: {areas_ha.sum():,.4f} Ha")
+    ax.grid(True, linewidth=0.3)
+    ax.set_aspect('equal', adjustable='datalim')
+
+    # --- Area summary in place of a legend ---
+    table_ax = fig.add_axes([0.08, 0.02, 0.84, 0.22])
+    table_ax.axis("off")
+    if num_polygons:
+        summary = [["Polygons", f"{num_polygons:,}"],
+                   ["Total area (Ha)", f"{areas_ha.sum():,.4f}"],
+                   ["Min / median / max (Ha)",
+                    f"{areas_ha.min():,.4f} / {np.median(areas_ha):,.4f} / {areas_ha.max():,.4f}"]]
+        largest = np.argsort(areas_ha)[::-1][:top]
+        summary.append([f"Largest {len(largest)}",
+                        ", ".join(f"#{i + 1}: {areas_ha[i]:,.2f}" for i in largest[:5])])
+        if len(largest) > 5:
+            summary.append(["", ", ".join(f"#{i + 1}: {areas_ha[i]:,.2f}" for i in largest[5:])])
+        table = table_ax.table(cellText=summary, colWidths=[0.25, 0.75], loc="upper center", cellLoc="left")
+        table.auto_set_font_size(False)
+        table.set_fontsize(9)
+
+    fig.savefig(output, dpi=dpi)
+    return {"polygons": num_polygons, "vertices": len(x), "drawn_vertices": len(dx)}
+
+def report_polygons(df, output=None, decimate=None):
+    """
+    Detects the polygons in `df`, prints their areas and plots them.
+
+    Args:
+        df (pandas.DataFrame): Vertices with 'x' and 'y' columns, in meters.
+        output (str, optional): Save the figure to this file instead of
+                                showing it in a window. Uses render_polygons,
+                                so it works headless and with many polygons.
+        decimate (float | str, optional): Vertex decimation for the saved
+                                          figure, see render_polygons.
+    """
+    x, y, offsets, polygon_areas_sq_units = detect_polygons(df)
+    # ASSUMPTION: Coordinates are in meters. 1 Hectare = 10,000 sq meters
+    polygon_areas_hectares = polygon_areas_sq_units / 10000.0
+
+    # --- Analysis and Plotting ---
+
+    num_polygons = len(offsets) - 1
+
+    print("-" * 30) # Separator
+    if num_polygons > 1:
+        print(f"Found {num_polygons} polygons in the DataFrame.")
+    elif num_polygons == 1:
+        print("Found 1 polygon in the DataFrame.")
+    else:
+        print("Found no complete polygons based on the closing rule.")
+    print("-" * 30) # Separator
+
+    # Print Areas
+    if num_polygons > 0:
+        print("Calculated Polygon Areas:")
+        print("NOTE: Assumes input coordinates are in METERS.")
+        for i in range(num_polygons):
+            print(f"  Polygon {i+1}: {polygon_areas_sq_units[i]:,.2f} sq. units "
+                  f"({polygon_areas_hectares[i]:,.4f} Hectares)")
+        print("-" * 30) # Separator
+
+
+    # --- Plotting ---
+    if num_polygons > 0 and output:
+        render_polygons(df, output, decimate=decimate)
+        print(f"Plot saved to '{output}'")
+    elif num_polygons > 0:
+        import matplotlib.pyplot as plt
+
+        fig, ax = plt.subplots(figsize=(12, 12)) # Adjust figure size as needed
+        colors = plt.cm.viridis(np.linspace(0, 1, max(1, num_polygons))) # Get distinct colors
+
+        total_area_ha = 0
+        for i, (poly_x, poly_y) in enumerate(iter_polygons(x, y, offsets)):
+            area_ha = polygon_areas_hectares[i]
+            total_area_ha += area_ha
+            # Include area in the label for the legend
+            label = f'Polygon {i+1} ({area_ha:.4f} Ha)'
+            # Plot lines connecting vertices
+            ax.plot(poly_x, poly_y, marker='o', linestyle='-', label=label, color=colors[i])
+
+        ax.set_xlabel("X-coordinate (meters)")
+        ax.set_ylabel("Y-coordinate (meters)")
+        title = f"Detected Polygons ({num_polygons} found)"
+        if num_polygons > 0 :
+             title += f" - Total Area: {total_area_ha:.4f} Ha"
+        ax.set_title(title)
+        ax.grid(True)
+        ax.legend()
+        # Use 'equal' aspect ratio for correct shape representation
+        ax.set_aspect('equal', adjustable='box')
+        plt.show()
+    else:print("No polygons to plot.")
+
+if __name__ == "__main__":
+    # When pasted into a notebook (or run with %run -i), `df` already exists.
+    # As a script, read it from a CSV with 'x' and 'y' columns, and save the
+    # plot if an image path follows it.
+    output = None
+    if "df" not in globals():
+        import sys
+        df = pd.read_csv(sys.argv[1])
+        output = sys.argv[2] if len(sys.argv) > 2 else None
+
+    report_polygons(df, output=output)
@@ -0,0 +1,22 @@
+import pytest
+
+SQUARE = [("1", "532137", "9892120"), ("2", "532237", "9892120"), ("3", "532237", "9892220"),
+          ("4", "532137", "9892220"), ("1", "532137", "9892120")]
+
+def write_table_pdf(path, rows, header=("PUNTO", "X", "Y")):
+    """Writes a one-page PDF with a ruled coordinate table that page.find_tables() detects."""
+    import fitz
+
+    with fitz.open() as doc:
+        page = doc.new_page()
+        for i, row in enumerate([header] + list(rows)):
+            for j, cell in enumerate(row):
+                rect = fitz.Rect(72 + j * 120, 72 + i * 20, 72 + (j + 1) * 120, 72 + (i + 1) * 20)
+                page.draw_rect(rect, color=(0, 0, 0), width=0.8)
+                page.insert_text((rect.x0 + 4, rect.y1 - 6), cell, fontsize=9)
+        doc.save(str(path))
+    return str(path)
+
+@pytest.fixture
+def table_pdf():
+    return write_table_pdf
@@ -0,0 +1,63 @@
+import json
+
+import pytest
+
+from conftest import SQUARE
+
+from batch import OutputCollision, run_batch
+from dedup import ParcelStore
+
+def shifted(rows, dx):
+    return [(p, str(int(x) + dx), y) for p, x, y in rows]
+
+def test_incremental_run_with_dedup(tmp_path, table_pdf):
+    inputs = tmp_path / "in"
+    inputs.mkdir()
+    table_pdf(inputs / "a.pdf", SQUARE)
+    table_pdf(inputs / "b.pdf", SQUARE[::-1])
+    out = tmp_path / "out"
+    state_db = str(out / "sources.sqlite")
+    dedup_db = str(out / "parcels.sqlite")
+
+    manifest = run_batch([str(inputs)], str(out), workers=1, engine="direct",
+                         state_db=state_db, dedup_db=dedup_db)
+    assert manifest["counts"] == {"ok": 2}
+    assert sorted(f["new_parcels"] for f in manifest["files"]) == [0, 1]
+    with ParcelStore(dedup_db) as store:
+        assert store.stats() == {"parcels": 1, "occurrences": 2, "sources": 2}
+
+    # Unchanged inputs are skipped; a new one is processed and deduplicated
+    table_pdf(inputs / "c.pdf", shifted(SQUARE, 500))
+    manifest = run_batch([str(inputs)], str(out), workers=1, engine="direct",
+                         state_db=state_db, dedup_db=dedup_db)
+    assert manifest["unchanged"] == 2
+    assert [f["new_parcels"] for f in manifest["files"]] == [1]
+    with ParcelStore(dedup_db) as store:
+        assert store.stats()["parcels"] == 2
+    assert json.load(open(out / "manifest.json"))["parcels_kml"] == str(out / "parcels.kml")
+    assert (out / "parcels.kml").read_text().count("<Placemark>") == 2
+
+def test_same_names_in_subfolders_keep_separate_outputs(tmp_path, table_pdf):
+    inputs = tmp_path / "in"
+    (inputs / "a").mkdir(parents=True)
+    (inputs / "b").mkdir()
+    table_pdf(inputs / "a" / "permit.pdf", SQUARE)
+    table_pdf(inputs / "b" / "permit.pdf", shifted(SQUARE, 500))
+    out = tmp_path / "out"
+
+    manifest = run_batch([str(inputs)], str(out), workers=2, engine="direct")
+    assert manifest["counts"] == {"ok": 2}
+    kmls = sorted(f["kml"] for f in manifest["files"])
+    assert kmls == [str(out / "a" / "permit.kml"), str(out / "b" / "permit.kml")]
+    assert (out / "a" / "permit.kml").read_text() != (out / "b" / "permit.kml").read_text()
+
+def test_colliding_outputs_fail_before_processing(tmp_path, table_pdf):
+    (tmp_path / "a").mkdir()
+    (tmp_path / "b").mkdir()
+    first = table_pdf(tmp_path / "a" / "permit.pdf", SQUARE)
+    second = table_pdf(tmp_path / "b" / "permit.pdf", SQUARE)
+    out = tmp_path / "out"
+
+    with pytest.raises(OutputCollision, match="permit"):
+        run_batch([first, second], str(out), workers=1, engine="direct")
+    assert not (out / "permit.kml").exists()
@@ -0,0 +1,24 @@
+from conftest import SQUARE
+
+from cache import PipelineCache
+from pdf_2_coords import extract_coords
+
+def test_windowed_entries_do_not_serve_whole_conversions(tmp_path, table_pdf):
+    pdf = table_pdf(tmp_path / "a.pdf", SQUARE)
+    cache = PipelineCache(str(tmp_path / "cache"))
+    docx = tmp_path / "a.docx"
+
+    _, coords, info = extract_coords(pdf, str(docx), engine="docx", cache=cache, page_window=1)
+    assert len(coords) == len(SQUARE) and info["cache"] == "miss"
+    assert not docx.exists()
+
+    # A whole-document run converts again and keeps its DOCX, then hits
+    _, _, info = extract_coords(pdf, str(docx), engine="docx", cache=cache)
+    assert info["cache"] == "miss" and docx.exists()
+    docx.unlink()
+    _, _, info = extract_coords(pdf, str(docx), engine="docx", cache=cache)
+    assert info["cache"] == "hit" and docx.exists()
+
+    # The window size does not change the result
+    _, _, info = extract_coords(pdf, str(docx), engine="docx", cache=cache, page_window=5)
+    assert info["cache"] == "hit"
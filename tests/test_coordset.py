@@ -0,0 +1,43 @@
+import numpy as np
+
+from coordset import CoordinateSet
+from vis import calculate_polygon_area
+
+# Two closed squares (100 m and 20 m) and an unclosed triangle
+ROWS = [["1", "532137", "9892120"], ["2", "532237", "9892120"], ["3", "532237", "9892220"],
+        ["4", "532137", "9892220"], ["5", "532137", "9892120"],
+        ["1", "0", "0"], ["2", "20", "0"], ["3", "20", "20"], ["4", "0", "20"], ["5", "0", "0"],
+        ["1", "5", "5"], ["2", "8", "5"], ["3", "5", "9"]]
+
+def test_offsets_split_on_closing_vertices():
+    coords = CoordinateSet.from_rows(ROWS)
+    assert coords.offsets.tolist() == [0, 5, 10, 13]
+    assert coords.point_ids.tolist() == [int(r[0]) for r in ROWS]
+    assert coords.to_rows() == ROWS
+
+def test_offsets_round_trip():
+    coords = CoordinateSet.from_rows(ROWS)
+    again = CoordinateSet.from_dataframe(coords.to_dataframe(), coords.offsets)
+    assert again.offsets.tolist() == coords.offsets.tolist()
+    assert again.to_rows() == ROWS
+    # Without explicit offsets they are found again from the closing vertices
+    assert CoordinateSet(coords.point_ids, coords.x, coords.y).offsets.tolist() == coords.offsets.tolist()
+    for k, frame in enumerate(coords.polygons()):
+        x, y = coords.polygon(k)
+        assert frame["x"].tolist() == x.tolist() and frame["y"].tolist() == y.tolist()
+
+def test_areas_match_the_single_polygon_formula():
+    rng = np.random.default_rng(0)
+    counts = rng.integers(3, 12, size=50)
+    x = rng.uniform(500000, 600000, counts.sum())
+    y = rng.uniform(9e6, 9.1e6, counts.sum())
+    offsets = np.concatenate([[0], np.cumsum(counts)])
+    coords = CoordinateSet(np.arange(len(x)), x, y, offsets)
+    expected = [calculate_polygon_area(*coords.polygon(k)) for k in range(coords.n_polygons)]
+    np.testing.assert_allclose(coords.areas(), expected, rtol=1e-9)
+    assert np.allclose(CoordinateSet.from_rows(ROWS).areas(), [10000, 400, 6])
+
+def test_packed_drops_short_polygons():
+    coords = CoordinateSet.from_rows(ROWS[:5] + [["1", "1", "1"], ["2", "2", "2"]])
+    ids, x, y, offsets = coords.packed(min_vertices=3)
+    assert ids == [1] and offsets.tolist() == [0, 5] and len(x) == len(y) == 5
@@ -0,0 +1,56 @@
+import numpy as np
+
+from coordset import CoordinateSet
+from dedup import polygon_fingerprints
+
+def ring_set(rings, closed=True):
+    """CoordinateSet of open (x, y) rings, closed again when `closed`."""
+    xs, ys, offsets = [], [], [0]
+    for x, y in rings:
+        if closed:
+            x, y = np.append(x, x[0]), np.append(y, y[0])
+        xs.append(x)
+        ys.append(y)
+        offsets.append(offsets[-1] + len(x))
+    x, y = np.concatenate(xs), np.concatenate(ys)
+    return CoordinateSet(np.arange(len(x)), x, y, offsets)
+
+def random_ring(rng):
+    k = int(rng.integers(4, 12))
+    angles = np.sort(rng.uniform(0, 2 * np.pi, k))
+    r = rng.uniform(50, 200, k)
+    # Whole centimetres plus a little noise, away from the 0.01 m grid boundaries
+    x = np.round(532000 + r * np.cos(angles), 2) + rng.uniform(-0.003, 0.003, k)
+    y = np.round(9892000 + r * np.sin(angles), 2) + rng.uniform(-0.003, 0.003, k)
+    return x, y
+
+def test_fingerprint_ignores_start_vertex_direction_and_closure():
+    rng = np.random.default_rng(4)
+    for _ in range(25):
+        x, y = random_ring(rng)
+        shift = int(rng.integers(1, len(x)))
+        variants = [(x, y), (np.roll(x, shift), np.roll(y, shift)), (x[::-1], y[::-1]),
+                    (np.roll(x[::-1], shift), np.roll(y[::-1], shift))]
+        _, closed = polygon_fingerprints(ring_set(variants))
+        _, opened = polygon_fingerprints(ring_set(variants, closed=False))
+        assert len(set(closed + opened)) == 1
+
+def test_repeated_vertices_do_not_change_the_fingerprint():
+    x, y = random_ring(np.random.default_rng(5))
+    repeated = np.insert(x, 2, x[2]), np.insert(y, 2, y[2])
+    _, fingerprints = polygon_fingerprints(ring_set([(x, y), repeated]))
+    assert fingerprints[0] == fingerprints[1]
+
+def test_different_parcels_differ():
+    rng = np.random.default_rng(6)
+    rings = [random_ring(rng) for _ in range(50)]
+    x, y = rings[0]
+    rings.append((x + 0.05, y)) # Shifted by five grid cells
+    _, fingerprints = polygon_fingerprints(ring_set(rings))
+    assert len(set(fingerprints)) == len(rings)
+
+def test_short_polygons_are_skipped():
+    x, y = random_ring(np.random.default_rng(7))
+    coords = ring_set([(np.array([0.0, 1.0]), np.array([0.0, 1.0])), (x, y)], closed=False)
+    ids, fingerprints = polygon_fingerprints(coords)
+    assert ids == [2] and len(fingerprints) == 1
@@ -0,0 +1,50 @@
+from doc_2_coords import pair_coordinate_runs, read_table_rows
+
+E = "532137 532237 532237"
+N = "9892120 9892120 9892220"
+ROWS = [["1", "532137", "9892120"], ["2", "532237", "9892120"], ["3", "532237", "9892220"]]
+
+def test_interleaved_and_blocked_cells_pair_on_their_own():
+    interleaved = "532137 9892120 532237 9892120 532237 9892220"
+    assert pair_coordinate_runs([(0, 1, 0, interleaved)]) == (ROWS, [])
+    assert pair_coordinate_runs([(0, 1, 0, E + " " + N)]) == (ROWS, [])
+
+def test_runs_in_one_row_keep_their_point_numbers():
+    cells = [(0, 2, 0, "7 8 9"), (0, 2, 1, E), (0, 2, 2, N)]
+    rows, unpaired = pair_coordinate_runs(cells)
+    assert [r[0] for r in rows] == ["7", "8", "9"] and unpaired == []
+
+def test_header_columns_are_paired_first():
+    # Two runs of each kind in one row: the X/Y header columns decide the pairing
+    other_e, other_n = "600000 600001 600002", "9000000 9000001 9000002"
+    cells = [(0, 2, 0, other_e), (0, 2, 1, N), (0, 2, 2, E), (0, 2, 3, other_n)]
+    rows, _ = pair_coordinate_runs(cells, x_columns={(0, 2)}, y_columns={(0, 1)})
+    pairs = {(x, y) for _, x, y in rows}
+    assert {(x, y) for _, x, y in ROWS} <= pairs
+    assert ("600000", "9000000") in pairs and len(pairs) == 6
+
+def test_runs_in_consecutive_rows_are_paired_in_order():
+    cells = [(0, 1, 1, E), (0, 2, 1, N)]
+    assert pair_coordinate_runs(cells) == (ROWS, [])
+
+def test_unmatched_runs_are_reported():
+    rows, unpaired = pair_coordinate_runs([(0, 1, 1, E), (0, 2, 1, "9892120 9892120")])
+    assert rows == []
+    assert unpaired == [{"table": 0, "row": 1, "column": 1, "kind": "easting", "count": 3},
+                        {"table": 0, "row": 2, "column": 1, "kind": "northing", "count": 2}]
+
+def test_northern_zone_northings_follow_the_y_header():
+    # Zone 17N close to the equator: northings have 6 digits, like eastings
+    cells = [(0, 2, 0, "1 2 3"), (0, 2, 1, E), (0, 2, 2, "120000 120000 120100")]
+    rows, unpaired = pair_coordinate_runs(cells, x_columns={(0, 1)}, y_columns={(0, 2)})
+    assert unpaired == []
+    assert rows == [["1", "532137", "120000"], ["2", "532237", "120000"], ["3", "532237", "120100"]]
+
+    # Without headers the magnitudes alone cannot tell them apart
+    _, unpaired = pair_coordinate_runs(cells)
+    assert {u["kind"] for u in unpaired} == {"easting"}
+
+def test_northern_zone_table_through_the_reader():
+    rows = [(0, ["PUNTO", "X", "Y"]), (0, ["1 2 3", E, "120000 120000 120100"])]
+    _, coords = read_table_rows(iter(rows))
+    assert coords == [["1", "532137", "120000"], ["2", "532237", "120000"], ["3", "532237", "120100"]]
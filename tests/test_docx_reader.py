@@ -0,0 +1,51 @@
+import docx
+
+from doc_2_coords import iter_docx_table_rows, read_docx_with_tables
+
+def python_docx_rows(path):
+    return [(t, [cell.text for cell in row.cells])
+            for t, table in enumerate(docx.Document(path).tables) for row in table.rows]
+
+def write_docx(path):
+    document = docx.Document()
+    document.add_paragraph("Cuadro de coordenadas")
+
+    table = document.add_table(rows=6, cols=4)
+    for r, row in enumerate(table.rows):
+        for c, cell in enumerate(row.cells):
+            cell.text = f"r{r}c{c}"
+    table.cell(0, 0).merge(table.cell(0, 3)).text = "COORDENADAS UTM"  # Horizontal
+    table.cell(1, 1).merge(table.cell(3, 1)).text = "vertical"         # Vertical
+    table.cell(4, 2).merge(table.cell(5, 3)).text = "block"            # Both
+    cell = table.cell(2, 2)
+    cell.add_paragraph("second line")
+    nested = cell.add_table(rows=2, cols=2)                            # Nested, not read
+    for r, row in enumerate(nested.rows):
+        for c, inner in enumerate(row.cells):
+            inner.text = f"nested {r}{c}"
+
+    document.add_paragraph("Between tables")
+    rows = [("PUNTO", "X", "Y"), ("1", "532137", "9892120"), ("2", "532237", "9892120"),
+            ("3", "532237", "9892220"), ("1", "532137", "9892120")]
+    table = document.add_table(rows=len(rows), cols=3)
+    for row, values in zip(table.rows, rows):
+        for cell, value in zip(row.cells, values):
+            cell.text = value
+    document.save(str(path))
+    return str(path)
+
+def test_streamed_rows_match_python_docx(tmp_path):
+    path = write_docx(tmp_path / "tables.docx")
+    streamed = list(iter_docx_table_rows(path))
+    assert streamed == python_docx_rows(path)
+    assert streamed[0][1] == ["COORDENADAS UTM"] * 4
+    assert [cells[1] for _, cells in streamed[1:4]] == ["vertical"] * 3
+    # add_table() leaves an empty paragraph after the nested table
+    assert streamed[2][1][2] == "r2c2\nsecond line\n"
+    assert not any("nested" in text for _, cells in streamed for text in cells)
+
+def test_coordinates_are_read_from_the_streamed_rows(tmp_path):
+    text, coords = read_docx_with_tables(write_docx(tmp_path / "tables.docx"))
+    assert coords == [["1", "532137", "9892120"], ["2", "532237", "9892120"],
+                      ["3", "532237", "9892220"], ["1", "532137", "9892120"]]
+    assert text.splitlines()[0] == "1,532137,9892120"
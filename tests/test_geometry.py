@@ -0,0 +1,95 @@
+import numpy as np
+
+from coordset import CoordinateSet
+from geometry import clean_polygons, simplify
+
+# --- Reference Douglas–Peucker, one ring at a time ---
+def segment_distance(px, py, ax, ay, bx, by):
+    dx, dy = bx - ax, by - ay
+    length2 = dx * dx + dy * dy
+    if length2 == 0:
+        return np.hypot(px - ax, py - ay)
+    t = min(1.0, max(0.0, ((px - ax) * dx + (py - ay) * dy) / length2))
+    return np.hypot(px - (ax + t * dx), py - (ay + t * dy))
+
+def douglas_peucker(x, y, chain, tolerance, keep):
+    # Recursively keeps the farthest vertex strictly between chain[0] and chain[-1]
+    if len(chain) < 3:
+        return
+    a, b = chain[0], chain[-1]
+    dist = [segment_distance(x[i], y[i], x[a], y[a], x[b], y[b]) for i in chain[1:-1]]
+    k = int(np.argmax(dist)) + 1
+    if dist[k - 1] > tolerance:
+        keep.add(chain[k])
+        douglas_peucker(x, y, chain[:k + 1], tolerance, keep)
+        douglas_peucker(x, y, chain[k:], tolerance, keep)
+
+def simplify_ring(x, y, tolerance):
+    # Anchored at the first vertex and the vertex farthest from it
+    n = len(x)
+    far = int(np.argmax(np.hypot(x - x[0], y - y[0])))
+    keep = {0, far}
+    douglas_peucker(x, y, list(range(far + 1)), tolerance, keep)
+    douglas_peucker(x, y, list(range(far, n)) + [0], tolerance, keep)
+    return sorted(keep)
+
+def noisy_rings(rng, n_rings):
+    xs, ys, counts = [], [], []
+    for _ in range(n_rings):
+        k = int(rng.integers(8, 60))
+        angles = np.sort(rng.uniform(0, 2 * np.pi, k))
+        r = 100 + rng.normal(0, 3, k)
+        xs.append(r * np.cos(angles))
+        ys.append(r * np.sin(angles))
+        counts.append(k)
+    return np.concatenate(xs), np.concatenate(ys), np.array(counts)
+
+def test_simplify_matches_reference_douglas_peucker():
+    rng = np.random.default_rng(3)
+    x, y, counts = noisy_rings(rng, 40)
+    offsets = np.concatenate([[0], np.cumsum(counts)])
+    ring = np.repeat(np.arange(len(counts)), counts)
+    for tolerance in (0.5, 2.0, 5.0):
+        idx, kept_ring, removed = simplify(x, y, np.arange(len(x)), ring, len(counts), tolerance)
+        for k in range(len(counts)):
+            a, b = offsets[k], offsets[k + 1]
+            expected = [a + i for i in simplify_ring(x[a:b], y[a:b], tolerance)]
+            if len(expected) < 3:
+                continue # simplify() keeps 3 vertices where the reference keeps 2
+            assert idx[kept_ring == k].tolist() == expected
+            assert removed[k] == counts[k] - len(expected)
+
+def test_short_rings_keep_three_vertices():
+    # A thin sliver: Douglas–Peucker alone would keep only the two anchors
+    x = np.array([0.0, 50.0, 100.0, 50.0])
+    y = np.array([0.0, 0.1, 0.0, -0.1])
+    idx, ring, _ = simplify(x, y, np.arange(4), np.zeros(4, dtype=np.int64), 1, 10.0)
+    assert len(idx) == 3 and {0, 2} <= set(idx.tolist())
+
+def test_clean_polygons_removes_duplicate_and_collinear_vertices():
+    # Clockwise 100 m square, closed, with a repeated vertex and two points on an edge
+    x = [0, 0, 0, 100, 100, 100, 60, 30, 0]
+    y = [0, 100, 100, 100, 0, 0, 0, 0, 0]
+    coords = CoordinateSet(np.arange(1, 10), x, y, [0, 9])
+    cleaned, report = clean_polygons(coords)
+    row = report.iloc[0]
+    assert (row.duplicates, row.collinear, row.vertices_out) == (2, 2, 5)
+    assert row.reversed and row.valid and row.area_out_m2 == row.area_in_m2 == 10000
+    # Counter-clockwise, starting at the same vertex, closed again
+    assert list(zip(cleaned.x, cleaned.y)) == [(0, 0), (100, 0), (100, 100), (0, 100), (0, 0)]
+
+def test_clean_polygons_flags_a_bowtie():
+    x = [0, 100, 100, 0, 0]
+    y = [0, 100, 0, 100, 0]
+    square = [0, 10, 10, 0, 0], [0, 0, 10, 10, 0]
+    coords = CoordinateSet(np.arange(10), x + square[0], y + square[1], [0, 5, 10])
+    cleaned, report = clean_polygons(coords)
+    assert report["issue"].tolist() == ["self_intersection", ""]
+    assert report["valid"].tolist() == [False, True]
+    assert cleaned.n_polygons == 2 and np.diff(cleaned.offsets).tolist() == [5, 5]
+
+def test_clean_polygons_passes_short_polygons_through():
+    coords = CoordinateSet([1, 2], [0, 1], [0, 1], [0, 2])
+    cleaned, report = clean_polygons(coords)
+    assert report["issue"].tolist() == ["too_few_vertices"]
+    assert cleaned.x.tolist() == [0, 1]
@@ -0,0 +1,36 @@
+import os
+
+import numpy as np
+import pytest
+
+pa = pytest.importorskip("pyarrow")
+import pyarrow.dataset as ds
+
+from coordset import CoordinateSet
+from geoparquet import write_geoparquet
+
+def square(x0):
+    x = np.array([0, 100, 100, 0, 0], dtype=float) + x0
+    y = np.array([0, 0, 100, 100, 0], dtype=float) + 9892120
+    return CoordinateSet(np.arange(1, 6), x, y, [0, 5])
+
+def read(dataset_dir, layer="polygons"):
+    return ds.dataset(os.path.join(dataset_dir, layer)).to_table()
+
+def test_rewriting_a_source_replaces_its_rows(tmp_path):
+    out = str(tmp_path / "ds")
+    write_geoparquet(out, [("a.pdf", square(532137)), ("b.pdf", square(533000))])
+    write_geoparquet(out, [("a.pdf", square(534000))])
+
+    table = read(out)
+    assert sorted(table.column("source").to_pylist()) == ["a.pdf", "b.pdf"]
+    assert table.column("area_m2").to_pylist() == pytest.approx([10000.0, 10000.0])
+    assert read(out, "points").num_rows == 10
+
+def test_removed_sources_are_dropped(tmp_path):
+    out = str(tmp_path / "ds")
+    write_geoparquet(out, [("a.pdf", square(532137)), ("b.pdf", square(533000))])
+    write_geoparquet(out, [], removed=["a.pdf"])
+
+    assert read(out).column("source").to_pylist() == ["b.pdf"]
+    assert read(out, "points").column("source").unique().to_pylist() == ["b.pdf"]
@@ -0,0 +1,42 @@
+import json
+
+import numpy as np
+import pytest
+
+import metrics
+
+@pytest.fixture
+def events(tmp_path):
+    path = str(tmp_path / "metrics.jsonl")
+    metrics.enable(path)
+    yield path
+    metrics.disable()
+
+def stages(path):
+    return {r["stage"]: r for r in map(json.loads, open(path)) if r["event"] == "stage"}
+
+def test_memory_is_measured_per_stage(events):
+    if metrics._rss_kb() is None:
+        pytest.skip("RSS is not readable on this platform")
+    with metrics.stage("big"):
+        block = np.ones(64 * 1024 * 1024 // 8) # 64 MiB, touched
+    del block
+    with metrics.stage("small"):
+        np.ones(1024)
+
+    recorded = stages(events)
+    assert recorded["big"]["rss_delta_kb"] > 48 * 1024
+    assert recorded["small"]["rss_delta_kb"] < 8 * 1024
+    # The lifetime peak still includes the earlier stage
+    assert recorded["small"]["process_peak_rss_kb"] >= recorded["big"]["rss_delta_kb"]
+
+def test_summary_and_prometheus_text(events):
+    for rows in (3, 4):
+        with metrics.stage("docx_coords") as st:
+            st.count(rows=rows)
+    summary = metrics.summarize(events)["docx_coords"]
+    assert summary["calls"] == 2 and summary["rows"] == 7
+    text = metrics.prometheus_text(events)
+    assert "# HELP utm_stage_process_peak_rss_kb" in text
+    assert "# TYPE utm_stage_process_peak_rss_kb gauge" in text
+    assert 'utm_stage_rows_total{stage="docx_coords"} 7' in text
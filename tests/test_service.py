@@ -0,0 +1,105 @@
+import os
+import time
+import asyncio
+
+from conftest import SQUARE
+
+from service import JobService
+
+async def request(port, method, path, body=b""):
+    reader, writer = await asyncio.open_connection("127.0.0.1", port)
+    writer.write(f"{method} {path} HTTP/1.1\r\nContent-Length: {len(body)}\r\n\r\n".encode() + body)
+    await writer.drain()
+    status = int((await reader.readline()).split()[1])
+    await reader.read()
+    writer.close()
+    return status
+
+def run_service(tmp_path, scenario, **options):
+    async def main():
+        service = JobService(str(tmp_path / "jobs"), workers=1,
+                             process_options={"engine": "direct"}, **options)
+        await service.start()
+        server = await asyncio.start_server(service.handle, "127.0.0.1", 0)
+        try:
+            return await scenario(service, server.sockets[0].getsockname()[1])
+        finally:
+            server.close()
+            await service.stop()
+    return asyncio.run(main())
+
+def test_invalid_wait_is_a_bad_request(tmp_path, table_pdf):
+    data = open(table_pdf(tmp_path / "a.pdf", SQUARE), "rb").read()
+
+    async def scenario(service, port):
+        job = service.submit("a.pdf", data)
+        return [await request(port, "GET", f"/jobs/{job['id']}/kml?wait={wait}")
+                for wait in ("soon", "-1", "nan", "inf", "30")]
+
+    assert run_service(tmp_path, scenario) == [400, 400, 400, 400, 200]
+
+def test_deleting_a_running_job_removes_its_files(tmp_path, table_pdf):
+    data = open(table_pdf(tmp_path / "a.pdf", SQUARE), "rb").read()
+
+    async def scenario(service, port):
+        job = service.submit("a.pdf", data)
+        while job["status"] == "queued":
+            await asyncio.sleep(0.01)
+        assert await request(port, "DELETE", f"/jobs/{job['id']}") == 200
+        await job["done"].wait()
+        return job
+
+    job = run_service(tmp_path, scenario)
+    assert not os.path.exists(os.path.dirname(job["pdf"]))
+
+def test_finished_jobs_are_pruned(tmp_path, table_pdf):
+    data = open(table_pdf(tmp_path / "a.pdf", SQUARE), "rb").read()
+
+    async def scenario(service, port):
+        jobs = [service.submit(f"{i}.pdf", data) for i in range(3)]
+        for job in jobs:
+            await job["done"].wait()
+        kept = sorted(service.jobs)
+        service.max_age = 0
+        time.sleep(0.01)
+        return jobs, kept, service.prune()
+
+    jobs, kept, expired = run_service(tmp_path, scenario, keep_finished=2)
+    assert kept == sorted(j["id"] for j in jobs[1:])
+    assert not os.path.exists(os.path.dirname(jobs[0]["pdf"]))
+    assert expired == 2
+    assert os.listdir(tmp_path / "jobs") == []
+
+def test_upload_and_download_over_http(tmp_path, table_pdf):
+    data = open(table_pdf(tmp_path / "a.pdf", SQUARE), "rb").read()
+
+    async def scenario(service, port):
+        status = await asyncio.wait_for(request(port, "POST", "/jobs?name=a.pdf", data), 30)
+        job, = service.jobs.values()
+        return status, await asyncio.wait_for(request(port, "GET", f"/jobs/{job['id']}/kml?wait=30"), 30)
+
+    assert run_service(tmp_path, scenario) == (202, 200)
+
+def test_download_name_cannot_inject_headers(tmp_path, table_pdf):
+    data = open(table_pdf(tmp_path / "a.pdf", SQUARE), "rb").read()
+
+    async def scenario(service, port):
+        name = "a%22%0d%0aX-Injected:%201%0d%0a.pdf"
+        reader, writer = await asyncio.open_connection("127.0.0.1", port)
+        writer.write(f"POST /jobs?name={name} HTTP/1.1\r\nContent-Length: {len(data)}\r\n\r\n".encode() + data)
+        await writer.drain()
+        await reader.read()
+        writer.close()
+        job, = service.jobs.values()
+
+        reader, writer = await asyncio.open_connection("127.0.0.1", port)
+        writer.write(f"GET /jobs/{job['id']}/kml?wait=30 HTTP/1.1\r\n\r\n".encode())
+        await writer.drain()
+        head = (await reader.read()).split(b"\r\n\r\n", 1)[0].decode("latin-1")
+        writer.close()
+        return head
+
+    head = run_service(tmp_path, scenario)
+    assert head.startswith("HTTP/1.1 200")
+    assert not any(line.startswith("X-Injected") for line in head.split("\r\n"))
+    assert 'filename="aX-Injected1.kml"' in head
@@ -0,0 +1,103 @@
+import numpy as np
+
+from coordset import CoordinateSet
+from spatial_index import SpatialIndex
+
+def star_polygons(rng, n, spread=1000.0, radius=(5, 60)):
+    """n star-shaped rings (open, 5-9 vertices) scattered over a spread x spread area."""
+    xs, ys, offsets = [], [], [0]
+    for _ in range(n):
+        k = int(rng.integers(5, 10))
+        angles = np.sort(rng.uniform(0, 2 * np.pi, k))
+        r = rng.uniform(*radius, k)
+        cx, cy = rng.uniform(0, spread, 2)
+        xs.append(cx + r * np.cos(angles))
+        ys.append(cy + r * np.sin(angles))
+        offsets.append(offsets[-1] + k)
+    x, y = np.concatenate(xs), np.concatenate(ys)
+    return CoordinateSet(np.arange(len(x)), x, y, offsets)
+
+def documents(seed=0, n_docs=12):
+    rng = np.random.default_rng(seed)
+    return {f"doc{i}.pdf": star_polygons(rng, int(rng.integers(1, 15))) for i in range(n_docs)}
+
+# --- Brute force references, one polygon at a time ---
+def rings(docs):
+    return {(source, k + 1): cs.polygon(k) for source, cs in docs.items() for k in range(cs.n_polygons)}
+
+def point_in_ring(px, py, x, y):
+    inside = False
+    for i in range(len(x)):
+        xi, yi, xj, yj = x[i], y[i], x[i - 1], y[i - 1]
+        if (yi > py) != (yj > py) and px < (xj - xi) * (py - yi) / (yj - yi) + xi:
+            inside = not inside
+    return inside
+
+def segments_cross(a, b, c, d):
+    def orient(p, q, r):
+        return np.sign((q[0] - p[0]) * (r[1] - p[1]) - (q[1] - p[1]) * (r[0] - p[0]))
+    o1, o2, o3, o4 = orient(a, b, c), orient(a, b, d), orient(c, d, a), orient(c, d, b)
+    return o1 * o2 <= 0 and o3 * o4 <= 0 and not (o1 == 0 and o2 == 0)
+
+def rings_overlap(x1, y1, x2, y2):
+    if any(point_in_ring(px, py, x2, y2) for px, py in zip(x1, y1)):
+        return True
+    if point_in_ring(x2[0], y2[0], x1, y1):
+        return True
+    return any(segments_cross((x1[i], y1[i]), (x1[i - 1], y1[i - 1]), (x2[j], y2[j]), (x2[j - 1], y2[j - 1]))
+               for i in range(len(x1)) for j in range(len(x2)))
+
+def labels(index, polygons):
+    return sorted((index.docs[index.doc[p]], int(index.part[p])) for p in polygons)
+
+def check(index, docs, rng):
+    expected = rings(docs)
+    assert len(index) == len(expected)
+
+    low = rng.uniform(-50, 1000, (20, 2))
+    boxes = np.hstack([low, low + rng.uniform(0, 300, (20, 2))])
+    q, p = index.query_bbox(boxes)
+    assert len(p)
+    for i, (minx, miny, maxx, maxy) in enumerate(boxes):
+        want = sorted(key for key, (x, y) in expected.items()
+                      if x.min() <= maxx and x.max() >= minx and y.min() <= maxy and y.max() >= miny)
+        assert labels(index, p[q == i]) == want
+
+    px, py = rng.uniform(0, 1000, 300), rng.uniform(0, 1000, 300)
+    q, p = index.contains(px, py)
+    assert len(p)
+    for i in range(len(px)):
+        want = sorted(key for key, (x, y) in expected.items() if point_in_ring(px[i], py[i], x, y))
+        assert labels(index, p[q == i]) == want
+
+    query = star_polygons(rng, 3, radius=(100, 250))
+    for k in range(query.n_polygons):
+        qx, qy = query.polygon(k)
+        want = sorted(key for key, (x, y) in expected.items() if rings_overlap(x, y, qx, qy))
+        assert want and labels(index, index.overlapping(qx, qy)) == want
+
+def test_queries_match_brute_force_through_updates(tmp_path):
+    rng = np.random.default_rng(1)
+    docs = documents()
+    names = list(docs)
+    index = SpatialIndex(merge_ratio=0.5)
+    index.add_many((s, docs[s]) for s in names[:8])
+    for s in names[8:]:
+        index.add(s, docs[s]) # Lands in the delta tree
+    check(index, docs, rng)
+
+    # Removed documents are masked, replaced ones are re-added
+    index.remove_many(names[:3])
+    replacement = documents(seed=2, n_docs=1)["doc0.pdf"]
+    index.add(names[5], replacement)
+    docs = {s: cs for s, cs in docs.items() if s not in names[:3]}
+    docs[names[5]] = replacement
+    check(index, docs, rng)
+
+    index.repack()
+    assert len(index.alive) == len(index)
+    check(index, docs, rng)
+
+    path = str(tmp_path / "index.npz")
+    index.save(path)
+    check(SpatialIndex.load(path), docs, rng)